@@ -0,0 +1,330 @@
+import sys
+import struct
+import base64
+import asyncio
+import hashlib
+import threading
+from collections import deque
+import Utils
+
+#------------------------------------------------------------------------------
+# asyncio server for the web pages and the WebSocket feeds, for events with many spectators.
+#
+# One event loop in a background thread serves the http port and the WebSocket ports.
+# Requests are answered by the same GetResponse function as the threaded server, in a
+# thread pool so a page build never blocks the loop.
+# A WebSocket message sent to all clients is framed once and the same bytes are queued for
+# every client.  Each client has its own queue and writer task: a client that falls more than
+# maxQueue frames behind, or does not accept data for writeTimeout seconds, is dropped.
+# Fragmented client messages are joined before dispatch, and a message longer than maxMessage
+# gets a close frame.
+
+wsGUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+CLOSE_TOO_BIG = 1009		# Close status for a message that is too big to process.
+
+def makeFrame( message, opcode=OPCODE_TEXT ):
+	''' Returns a server-to-client WebSocket frame (unmasked). '''
+	if not isinstance(message, bytes):
+		message = message.encode()
+	n = len(message)
+	if n <= 125:
+		header = struct.pack( '!BB', 0x80 | opcode, n )
+	elif n <= 0xFFFF:
+		header = struct.pack( '!BBH', 0x80 | opcode, 126, n )
+	else:
+		header = struct.pack( '!BBQ', 0x80 | opcode, 127, n )
+	return header + message
+
+class FrameTooBig( ValueError ):
+	pass
+
+async def readFrame( reader, maxSize=None ):
+	'''
+		Returns (fin, opcode, payload) of the next frame.
+		Raises FrameTooBig without reading the payload if it is longer than maxSize.
+	'''
+	b0, b1 = await reader.readexactly( 2 )
+	fin = bool(b0 & 0x80)
+	opcode = b0 & 0x0F
+	n = b1 & 0x7F
+	if n == 126:
+		n = struct.unpack( '!H', await reader.readexactly(2) )[0]
+	elif n == 127:
+		n = struct.unpack( '!Q', await reader.readexactly(8) )[0]
+	if maxSize is not None and n > maxSize:
+		raise FrameTooBig( 'frame of {} bytes'.format(n) )
+	mask = await reader.readexactly( 4 ) if b1 & 0x80 else None
+	payload = await reader.readexactly( n )
+	if mask:
+		payload = bytes( b ^ mask[i & 3] for i, b in enumerate(payload) )
+	return fin, opcode, payload
+
+async def readHeaders( reader ):
+	''' Returns (method, path, version, headers) of the next http request, or None at the end of the connection. '''
+	line = await reader.readline()
+	if not line:
+		return None
+	try:
+		method, path, version = line.decode('latin-1').split()
+	except ValueError:
+		raise ValueError( 'bad request line' )
+	headers = {}
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b'\n', b''):
+			break
+		k, sep, v = line.decode('latin-1').partition( ':' )
+		headers[k.strip().lower()] = v.strip()
+	return method, path, version, headers
+
+def formatResponse( status, headers, connection ):
+	reason = {200:'OK', 101:'Switching Protocols', 304:'Not Modified', 400:'Bad Request', 404:'Not Found', 405:'Method Not Allowed'}.get( status, '' )
+	lines = ['HTTP/1.1 {} {}'.format(status, reason)]
+	lines.extend( '{}: {}'.format(k, v) for k, v in headers )
+	lines.append( 'Connection: {}'.format(connection) )
+	return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+class WsClient( object ):
+	def __init__( self, channel, writer, address ):
+		self.channel = channel
+		self.writer = writer
+		self.address = address
+		self.queue = deque()
+		self.ready = asyncio.Event()
+		self.closed = False
+		self.sent = 0
+
+	def __getitem__( self, key ):
+		# Clients of websocket_server are dicts.  Support the keys CrossMgr uses.
+		if key == 'address':
+			return self.address
+		raise KeyError( key )
+
+	def send( self, frame ):
+		if self.closed:
+			return
+		if len(self.queue) >= self.channel.maxQueue:
+			self.channel.dropped += 1
+			Utils.writeLog( u'AsyncWebServer: {}: dropping slow client {}'.format(self.channel.name, self.address) )
+			self.close()
+			return
+		self.queue.append( frame )
+		self.ready.set()
+
+	def close( self ):
+		if not self.closed:
+			self.closed = True
+			self.ready.set()
+			self.writer.close()
+
+	async def writeLoop( self ):
+		writer = self.writer
+		timeout = self.channel.writeTimeout
+		try:
+			while not self.closed:
+				await self.ready.wait()
+				self.ready.clear()
+				if writer.transport.is_closing():
+					break
+				queue = self.queue
+				while queue and not self.closed:
+					writer.write( queue.popleft() )
+					self.sent += 1
+				await asyncio.wait_for( writer.drain(), timeout )
+		except (asyncio.TimeoutError, ConnectionError, OSError):
+			if not self.closed:
+				self.channel.dropped += 1
+		finally:
+			self.close()
+
+class WsChannel( object ):
+	'''
+		The clients of one WebSocket port.
+		Has the interface of websocket_server.WebsocketServer that WebServer uses, and may be called from any thread.
+	'''
+	maxQueue = 64			# Frames queued for a client before it is dropped.
+	writeTimeout = 30.0		# Seconds a client may block before it is dropped.
+	maxMessage = 16*1024	# Longest message accepted from a client.  Clients only send short commands.
+
+	def __init__( self, server, name, port ):
+		self.server = server
+		self.name = name
+		self.port = port
+		self.clients = set()
+		self.dropped = 0
+		self.broadcasts = 0
+		self.fnNewClient = None
+		self.fnMessageReceived = None
+
+	def set_fn_new_client( self, fn ):
+		self.fnNewClient = fn
+
+	def set_fn_message_received( self, fn ):
+		self.fnMessageReceived = fn
+
+	def hasClients( self ):
+		return bool(self.clients)
+
+	def send_message( self, client, message ):
+		frame = makeFrame( message )
+		self.server.callSoon( client.send, frame )
+
+	def send_message_to_all( self, message ):
+		frame = makeFrame( message )		# Framed once for all clients.
+		self.server.callSoon( self.broadcast, frame )
+
+	def broadcast( self, frame ):
+		self.broadcasts += 1
+		for client in list(self.clients):
+			client.send( frame )
+
+	def getStats( self ):
+		return {'clients': len(self.clients), 'broadcasts': self.broadcasts, 'dropped': self.dropped}
+
+	async def handle( self, reader, writer, headers ):
+		key = headers.get( 'sec-websocket-key' )
+		if not key or headers.get( 'upgrade', '' ).lower() != 'websocket':
+			writer.write( formatResponse(400, [('Content-Length', 0)], 'close') )
+			return
+		accept = base64.b64encode( hashlib.sha1(key.encode() + wsGUID).digest() ).decode()
+		writer.write( formatResponse(101, [('Upgrade', 'websocket'), ('Sec-WebSocket-Accept', accept)], 'Upgrade') )
+
+		client = WsClient( self, writer, writer.get_extra_info('peername') )
+		self.clients.add( client )
+		writeTask = asyncio.ensure_future( client.writeLoop() )
+		loop = asyncio.get_event_loop()
+		try:
+			if self.fnNewClient:
+				await loop.run_in_executor( None, self.fnNewClient, client, self )
+			fragments, size = [], 0
+			while not client.closed:
+				fin, opcode, payload = await readFrame( reader, self.maxMessage )
+				if opcode == OPCODE_CLOSE:
+					break
+				elif opcode == OPCODE_PING:
+					client.send( makeFrame(payload, OPCODE_PONG) )
+				elif opcode in (OPCODE_TEXT, OPCODE_CONTINUATION):
+					if opcode == OPCODE_TEXT:
+						fragments, size = [], 0
+					fragments.append( payload )
+					size += len(payload)
+					if size > self.maxMessage:
+						raise FrameTooBig( 'message of {} bytes'.format(size) )
+					if not fin:
+						continue		# Wait for the rest of the message.
+					message = b''.join( fragments ).decode( 'utf-8', 'replace' )
+					fragments, size = [], 0
+					if self.fnMessageReceived:
+						await loop.run_in_executor( None, self.fnMessageReceived, client, self, message )
+		except FrameTooBig:
+			Utils.writeLog( u'AsyncWebServer: {}: message too big from {}'.format(self.name, client.address) )
+			if not client.closed:
+				writer.write( makeFrame(struct.pack('!H', CLOSE_TOO_BIG), OPCODE_CLOSE) )
+		except (asyncio.IncompleteReadError, ConnectionError, OSError):
+			pass
+		finally:
+			self.clients.discard( client )
+			client.close()
+			writeTask.cancel()
+
+class AsyncWebServer( object ):
+	keepAliveSeconds = 30.0
+
+	def __init__( self, getResponse, port, host='' ):
+		self.getResponse = getResponse
+		self.port = port
+		self.host = host or None
+		self.channels = []
+		self.loop = None
+		self.thread = None
+		self.requests = 0
+
+	def addChannel( self, name, port ):
+		channel = WsChannel( self, name, port )
+		self.channels.append( channel )
+		return channel
+
+	def callSoon( self, f, *args ):
+		if self.loop:
+			self.loop.call_soon_threadsafe( f, *args )
+
+	def start( self ):
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread( target=self.run, name='AsyncWebServer' )
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop( self ):
+		if self.loop and self.thread.is_alive():
+			self.loop.call_soon_threadsafe( self.loop.stop )
+			self.thread.join()
+		self.loop = None
+
+	def getStats( self ):
+		return {'requests': self.requests, 'channels': {c.name: c.getStats() for c in self.channels}}
+
+	def run( self ):
+		loop = self.loop
+		asyncio.set_event_loop( loop )
+		loop.run_until_complete( self.startServers() )
+		loop.run_forever()
+
+	async def startServers( self ):
+		while True:
+			try:
+				await asyncio.start_server( self.handleHttp, self.host, self.port, reuse_address=True )
+				for channel in self.channels:
+					await asyncio.start_server( (lambda c: lambda r, w: self.handleWs(c, r, w))(channel), self.host, channel.port, reuse_address=True )
+				return
+			except OSError as e:
+				Utils.writeLog( u'AsyncWebServer: {}'.format(e) )
+				await asyncio.sleep( 5 )
+
+	async def handleWs( self, channel, reader, writer ):
+		try:
+			request = await readHeaders( reader )
+			if request:
+				await channel.handle( reader, writer, request[3] )
+		except (asyncio.IncompleteReadError, ConnectionError, ValueError, OSError):
+			pass
+		except Exception as e:
+			Utils.logException( e, sys.exc_info() )
+		finally:
+			writer.close()
+
+	async def handleHttp( self, reader, writer ):
+		loop = asyncio.get_event_loop()
+		try:
+			while True:
+				request = await asyncio.wait_for( readHeaders(reader), self.keepAliveSeconds )
+				if not request:
+					break
+				method, path, version, headers = request
+				connection = headers.get('connection', '').lower()
+				keepAlive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+				connection = 'keep-alive' if keepAlive else 'close'
+				if method not in ('GET', 'HEAD'):
+					writer.write( formatResponse(405, [('Content-Length', 0)], connection) )
+				else:
+					self.requests += 1
+					status, responseHeaders, content = await loop.run_in_executor( None, self.getResponse, path, headers )
+					writer.write( formatResponse(status, responseHeaders, connection) )
+					if content and method == 'GET':
+						writer.write( content )
+				await writer.drain()
+				if not keepAlive:
+					break
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError, OSError):
+			pass
+		except Exception as e:
+			Utils.logException( e, sys.exc_info() )
+		finally:
+			writer.close()
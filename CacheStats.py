@@ -0,0 +1,126 @@
+import wx
+import Model
+import ColGrid
+from RaceWriter import raceWriter
+from TagResolver import tagResolver
+from WebServer import feedStats, resultsPublisher, lapCounterLatency
+
+#------------------------------------------------------------------------------------------------
+class CacheStatsDialog( wx.Dialog ):
+	def __init__( self, parent, id = wx.ID_ANY ):
+		wx.Dialog.__init__( self, parent, id, _("Cache Statistics"),
+						style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER|wx.TAB_TRAVERSAL )
+
+		vs = wx.BoxSizer(wx.VERTICAL)
+
+		font = wx.Font(10, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD)
+		self.title = wx.StaticText( self, label = _("Memoized Function Cache Statistics") )
+		self.title.SetFont( font )
+
+		self.colnames = [
+			_('Function'), _('Entries'), _('Hits'), _('Misses'), _('Hit %'), _('Evictions'), _('Recompute (s)'),
+		]
+		self.grid = ColGrid.ColGrid( self, colnames = self.colnames )
+		self.grid.SetLeftAlignCols( [0, 1] )
+		self.grid.SetRowLabelSize( 0 )
+		self.grid.EnableEditing( False )
+		self.grid.DisableDragRowSize()
+
+		self.writerStats = wx.StaticText( self )
+		self.tagStats = wx.StaticText( self )
+		self.feedStats = wx.StaticText( self )
+		self.latencyStats = wx.StaticText( self )
+
+		self.refreshBtn = wx.Button( self, label = _('Refresh') )
+		self.Bind( wx.EVT_BUTTON, self.onRefresh, self.refreshBtn )
+
+		self.resetBtn = wx.Button( self, label = _('Reset Stats') )
+		self.Bind( wx.EVT_BUTTON, self.onReset, self.resetBtn )
+
+		self.closeBtn = wx.Button( self, wx.ID_CANCEL, label = _('Close') )
+
+		hs = wx.BoxSizer( wx.HORIZONTAL )
+		hs.Add( self.refreshBtn, flag=wx.ALL, border=4 )
+		hs.Add( self.resetBtn, flag=wx.ALL, border=4 )
+		hs.AddStretchSpacer()
+		hs.Add( self.closeBtn, flag=wx.ALL, border=4 )
+
+		vs.Add( self.title, flag=wx.ALL, border=4 )
+		vs.Add( self.grid, 1, flag=wx.ALL|wx.EXPAND, border=4 )
+		vs.Add( self.writerStats, flag=wx.ALL, border=4 )
+		vs.Add( self.tagStats, flag=wx.ALL, border=4 )
+		vs.Add( self.feedStats, flag=wx.ALL, border=4 )
+		vs.Add( self.latencyStats, flag=wx.ALL, border=4 )
+		vs.Add( hs, flag=wx.EXPAND )
+
+		self.refresh()
+
+		self.SetSizerAndFit( vs )
+		self.SetSize( (820, 480) )
+
+	def refresh( self ):
+		stats = Model.memoize.getStats()
+		data = [[] for c in self.colnames]
+		for name, entries, hits, misses, evictions, recomputeSeconds in stats:
+			calls = hits + misses
+			row = (
+				name,
+				u'{}'.format(entries),
+				u'{}'.format(hits),
+				u'{}'.format(misses),
+				u'{:.1f}'.format(100.0 * hits / calls) if calls else u'',
+				u'{}'.format(evictions),
+				u'{:.3f}'.format(recomputeSeconds),
+			)
+			for c, v in enumerate(row):
+				data[c].append( v )
+		self.grid.Set( data = data, colnames = self.colnames )
+		self.grid.AutoSizeColumns( False )
+		self.grid.Reset()
+
+		ws = raceWriter.getStats()
+		ms = lambda t: u'{:.1f}'.format(t * 1000.0) if t is not None else u''
+		self.writerStats.SetLabel( u'{}: {} ({} {})   {}: {} ms   {}: {} ms   {}: {} ms'.format(
+			_('Race Writes'), ws['writes'], ws['coalesced'], _('coalesced'),
+			_('Last'), ms(ws['lastWriteSeconds']),
+			_('Max'), ms(ws['maxWriteSeconds']),
+			_('Max Snapshot'), ms(ws['maxSnapshotSeconds']),
+		) )
+
+		ts = tagResolver.getStats()
+		self.tagStats.SetLabel( u'{}: {} ({} {})   {}: {}   {}: {}   {}: {}   {}: {}'.format(
+			_('Tags'), ts['tags'], ts['bibs'], _('bibs'),
+			_('Hits'), ts['hits'],
+			_('Misses'), ts['misses'],
+			_('Hit %'), u'{:.1f}'.format(100.0 * ts['hitRatio']) if ts['hitRatio'] is not None else u'',
+			_('Reconciled'), ts['reconciled'],
+		) )
+
+		fs = feedStats.getStats()
+		self.feedStats.SetLabel( u'{}: {}   {}: {}   {}: {}   {}: {} ms   {}: {} ({} {})   {}: {}'.format(
+			_('Results Updates'), fs['updates'],
+			_('Avg Bytes'), u'{:.0f}'.format(fs['bytesAvg']) if fs['bytesAvg'] is not None else u'',
+			_('Max Bytes'), fs['bytesMax'],
+			_('Avg Encode'), ms(fs['encodeSecondsAvg']),
+			_('Resumes'), fs['resumes'], fs['resumeUpdates'], _('updates'),
+			_('Baselines'), fs['baselines'],
+		) )
+
+		latency = lambda name, ls: u'{}: {}   {}: {} ms   {}: {} ms   {}: {} ms'.format(
+			name, ls['count'], _('p50'), ms(ls['p50']), _('p95'), ms(ls['p95']), _('Max'), ms(ls['max']),
+		)
+		self.latencyStats.SetLabel( u'{}\n{}'.format(
+			latency( _('Results Latency'), resultsPublisher.latency.getStats() ),
+			latency( _('Lap Counter Latency'), lapCounterLatency.getStats() ),
+		) )
+	
+	def onRefresh( self, event ):
+		self.refresh()
+
+	def onReset( self, event ):
+		Model.memoize.resetStats()
+		tagResolver.resetStats()
+		feedStats.reset()
+		resultsPublisher.latency.reset()
+		lapCounterLatency.reset()
+		self.refresh()
@@ -82,7 +82,7 @@ class ChangeRaceStartTimeDialog( wx.Dialog ):
 					rider.firstTime = max( 0.0, rider.firstTime - dTime )
 				except TypeError:
 					pass
-				rider.times[:] = [max(0.0, v - dTime) for v in rider.times]
+				rider.times = [max(0.0, v - dTime) for v in rider.times]
 		
 			race.numTimeInfo.adjustAllTimes( -dTime )
 			
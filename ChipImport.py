@@ -10,6 +10,7 @@ import Model
 import Utils
 import JChip
 from ReadSignOnSheet import GetTagNums
+from TagResolver import tagResolver
 from Undo		import undo
 from HighPrecisionTimeEdit import HighPrecisionTimeEdit
 
@@ -41,7 +42,7 @@ def DoChipImport(	fname, parseTagTime, startTime = None,
 		else:
 			race.resetStartClockOnFirstTag = True
 		
-		tagNums = GetTagNums( True )
+		tagResolver.setTagNums( GetTagNums(True) )
 		race.missingTags = set()
 		
 		tFirst, tLast = None, None
@@ -67,10 +68,10 @@ def DoChipImport(	fname, parseTagTime, startTime = None,
 			if not tFirst:
 				tFirst = t
 			tLast = t
-			try:
-				num = tagNums[tag]
+			num = tagResolver.resolve( tag )
+			if num is not None:
 				riderRaceTimes.setdefault( num, [] ).append( t )
-			except KeyError:
+			else:
 				if tag not in race.missingTags:
 					errors.append( u'{} {}: {}: {}'.format(_('line'), lineNo, _('tag missing from Excel sheet'), tag) )
 					race.missingTags.add( tag )
@@ -0,0 +1,85 @@
+import threading
+from collections import deque
+from six.moves.queue import Empty
+import Utils
+from TagResolver import tagResolver
+
+#------------------------------------------------------------------------------
+# Chip reads go from the reader threads to the UI thread through a ReadRing.
+# The UI thread drains it in one call, resolves the tags of the whole batch and adds
+# the times to the race with Race.addTimes, which sends one change notification.
+
+class ReadRing( object ):
+	'''
+		Buffer between a chip reader thread and the UI thread.
+		Supports the put/get_nowait calls the readers use on a Queue.
+		Nothing is ever dropped.  ReaderHub pauses its connections as the buffer nears capacity.
+		Other readers can go past it: the buffer grows, and the largest backlog is logged on the next drain.
+	'''
+	capacity = 1 << 16
+
+	def __init__( self, capacity = None ):
+		self.capacity = capacity or self.capacity
+		self.lock = threading.Lock()
+		self.buffer = deque()
+		self.backlogMax = 0
+
+	def put( self, item ):
+		with self.lock:
+			self.buffer.append( item )
+			if len(self.buffer) > self.capacity:
+				self.backlogMax = max( self.backlogMax, len(self.buffer) )
+
+	def putMany( self, items ):
+		with self.lock:
+			self.buffer.extend( items )
+			if len(self.buffer) > self.capacity:
+				self.backlogMax = max( self.backlogMax, len(self.buffer) )
+
+	def get_nowait( self ):
+		with self.lock:
+			try:
+				return self.buffer.popleft()
+			except IndexError:
+				raise Empty
+
+	def qsize( self ):
+		return len(self.buffer)
+
+	def drain( self ):
+		with self.lock:
+			data = list( self.buffer )
+			self.buffer.clear()
+			backlogMax, self.backlogMax = self.backlogMax, 0
+		if backlogMax:
+			Utils.writeLog( u'ReadRing: UI thread is behind: backlog of {} reads'.format(backlogMax) )
+		return data
+
+def ResolveTags( race, data ):
+	'''
+		Returns (num, raceTime) for the reads in data of known tags after the start of the race.
+		Reads of unknown tags are recorded as unmatched, and invalid tags as missing.
+	'''
+	numTimes = []
+	tagResolver.setTagNums( race.tagNums )
+	resolve = tagResolver.resolve
+	startTime = race.startTime
+	isRunning = race.isRunning()
+	for d in data:
+		if d[0] != 'data':
+			continue
+		tag, dt = d[1], d[2]
+		try:
+			num = resolve( tag )
+		except (TypeError, ValueError, AttributeError):
+			race.missingTags.add( tag )
+			continue
+		if num is None:
+			if isRunning and startTime <= dt:
+				race.addUnmatchedTag( tag, (dt - startTime).total_seconds() )
+			continue
+
+		# Only process times after the start of the race.
+		if isRunning and startTime <= dt:
+			numTimes.append( (num, (dt - startTime).total_seconds()) )
+	return numTimes
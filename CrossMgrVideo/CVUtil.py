@@ -3,7 +3,7 @@ import io
 import cv2
 import six
 import numpy as np
-from LRUCache import LRUCache
+from LRUCache import SizedLRUCache
 
 def rescaleToRect( w_src, h_src, w_dest, h_dest ):
 	scale = min( float(w_dest)/float(w_src), float(h_dest)/float(w_src) )
@@ -34,26 +34,55 @@ def resizeFrame( frame, w_req, h_req ):
 		frame = cv2.resize( frame, w_fix, h_fix )
 	return frame
 
-jpegFramesCacheMax = 30*60
-jpegFramesCache = LRUCache( jpegFramesCacheMax )
-def frameToJPeg( frame ):
-	jpeg = cv2.imencode('.jpg', frame)[1].tostring()
-	jpegFramesCache[bytes(jpeg)] = frame
+# Decoded frames cached by (ts, scale), limited by bytes, not entries.
+# The timestamp identifies a photo in the database, so the jpeg does not have to be hashed.
+frameCacheBytesMax = 768*1024*1024
+frameCache = SizedLRUCache( frameCacheBytesMax, lambda frame: frame.nbytes )
+
+# Scales that cv2 can decode directly, which is faster than decoding at full size.
+reducedDecode = {0.5: cv2.IMREAD_REDUCED_COLOR_2, 0.25: cv2.IMREAD_REDUCED_COLOR_4, 0.125: cv2.IMREAD_REDUCED_COLOR_8}
+
+def encodeJPeg( frame, quality=None ):
+	params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+	return cv2.imencode('.jpg', frame, params)[1].tobytes()
+
+def cacheFrame( ts, frame ):
+	frameCache[(ts, 1.0)] = frame
+
+def frameToJPeg( frame, ts=None ):
+	jpeg = encodeJPeg( frame )
+	if ts is not None:
+		cacheFrame( ts, frame )
 	return jpeg
 
-def jpegToFrame( jpeg ):
-	key = bytes( jpeg )
-	if key in jpegFramesCache:
-		return jpegFramesCache[key]
-	frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), 1)
-	jpegFramesCache[key] = frame
+def decodeJPeg( jpeg, scale=1.0 ):
+	buf = np.frombuffer(jpeg, np.uint8)
+	if scale in reducedDecode:
+		return cv2.imdecode( buf, reducedDecode[scale] )
+	frame = cv2.imdecode( buf, cv2.IMREAD_COLOR )
+	if scale != 1.0:
+		frame = cv2.resize( frame, (0,0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA )
+	return frame
+
+def jpegToFrame( jpeg, ts=None, scale=1.0 ):
+	''' Returns the frame of the jpeg, reduced by scale.  Cached if the photo timestamp is given. '''
+	if ts is None:
+		return decodeJPeg( jpeg, scale )
+	key = (ts, scale)
+	frame = frameCache.get( key )
+	if frame is None:
+		if scale != 1.0 and scale not in reducedDecode and (ts, 1.0) in frameCache:
+			frame = cv2.resize( jpegToFrame(jpeg, ts), (0,0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA )
+		else:
+			frame = decodeJPeg( jpeg, scale )
+		frameCache[key] = frame
 	return frame
 
-def jpegToImage( jpeg ):
-	return frameToImage(jpegToFrame(jpeg))
+def jpegToImage( jpeg, ts=None, scale=1.0 ):
+	return frameToImage(jpegToFrame(jpeg, ts, scale))
 	
-def jpegToBitmap( jpeg ):
-	return frameToBitmap(jpegToFrame(jpeg))
+def jpegToBitmap( jpeg, ts=None, scale=1.0 ):
+	return frameToBitmap(jpegToFrame(jpeg, ts, scale))
 	
 def adjustGammaFrame( frame, gamma=1.0 ):
 	# build a lookup table mapping the pixel values [0, 255] to
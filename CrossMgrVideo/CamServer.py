@@ -7,7 +7,7 @@ from six.moves.queue import Empty
 from multiprocessing import Process, Pipe, Queue
 from threading import Thread, Timer
 from datetime import datetime, timedelta
-from FrameCircBuf import FrameCircBuf
+from FrameCircBuf import FrameCircBuf, SharedFrameCircBuf, shared_memory
 
 now = datetime.now
 
@@ -34,12 +34,16 @@ class VideoCaptureManager( object ):
 transmitFramesMax = 2
 bufferSeconds = 8
 
+# Keep the frame buffer in shared memory and only send frame references (slot, seq) over the pipe.
+# Then the whole backlog can be sent at once.
+sharedFrames = shared_memory is not None
+
 def EstimateQuerySeconds( ts, s_before, s_after, fps ):
 	t = now()
 	tEarliest = ts - timedelta(seconds=s_before)
 	tLatest = ts + timedelta(seconds=s_after)
-	if tEarliest > t:		# Request is completely after the current time.
-		return (tLatest - t).total_seconds()
+	if tEarliest > t or sharedFrames:	# Request is completely after the current time, or there is no backlog.
+		return max( 0.0, (tLatest - t).total_seconds() )
 	
 	transmitRate = float(fps * transmitFramesMax)
 	sBefore = (t - tEarliest).total_seconds()
@@ -59,6 +63,8 @@ def CamServer( qIn, pWriter, camInfo=None ):
 	tsSeen = set()
 	camInfo = camInfo or {}
 	backlog = []
+	fcb = None
+	useShared = sharedFrames		# Cleared if the reader cannot attach to the shared memory.
 	
 	def pWriterSend( msg ):
 		try:
@@ -73,7 +79,10 @@ def CamServer( qIn, pWriter, camInfo=None ):
 			inCapture = False
 			doSnapshot = False
 			tsSeen.clear()
-			fcb = FrameCircBuf( int(camInfo.get('fps', 30) * bufferSeconds) )
+			if isinstance(fcb, SharedFrameCircBuf):
+				fcb.close()
+			fcb = None
+			bufSize = int(camInfo.get('fps', 30) * bufferSeconds)
 			tsQuery = tsMax = now()
 			keepCapturing = 1
 			
@@ -87,7 +96,17 @@ def CamServer( qIn, pWriter, camInfo=None ):
 				ts = now()
 				if not ret:
 					break
+				if fcb is None or (useShared and frame.shape != fcb.shape):
+					# Size the shared buffer from the frames the camera actually returns.
+					if useShared:
+						if fcb is not None:
+							fcb.close()
+						fcb = SharedFrameCircBuf( bufSize, frame.shape, frame.dtype )
+						pWriterSend( {'cmd':'frame_buffer', 'info':fcb.getInfo()} )
+					else:
+						fcb = FrameCircBuf( bufSize )
 				fcb.append( ts, frame )
+				frame = fcb.getLast()		# The frame reference if the buffer is shared.
 				
 				try:
 					m = qIn.get_nowait()
@@ -128,8 +147,16 @@ def CamServer( qIn, pWriter, camInfo=None ):
 							camInfo = m['info'] or {}
 							keepCapturing = 0
 							break
+						elif cmd == 'no_shared_frames':
+							# Send the frames themselves from now on.  References already sent are dropped by the reader.
+							useShared = False
+							if isinstance(fcb, SharedFrameCircBuf):
+								fcb.close()
+								fcb = FrameCircBuf( bufSize )
 						elif cmd == 'terminate':
 							pWriterSend( {'cmd':'terminate'} )
+							if isinstance(fcb, SharedFrameCircBuf):
+								fcb.close()
 							return
 						else:
 							assert False, 'Unknown Command'
@@ -143,8 +170,9 @@ def CamServer( qIn, pWriter, camInfo=None ):
 
 				# Don't send too many frames at a time.  We don't want to overwhelm the pipe and lose frames.
 				# Always ensure that the most recent frame is sent so any update requests can be satisfied with the last frame.
+				transmitMax = len(backlog) if useShared else transmitFramesMax
 				if backlog:
-					pWriterSend( { 'cmd':'response', 'ts_frames': backlog[-transmitFramesMax:] } )
+					pWriterSend( { 'cmd':'response', 'ts_frames': backlog[-transmitMax:] } )
 						
 				# Send update messages.  If there was a backlog, don't send the frame as we can use the last frame sent.
 				updateFrame = None if backlog and backlog[-1][0] == ts else frame
@@ -157,7 +185,7 @@ def CamServer( qIn, pWriter, camInfo=None ):
 					pWriterSend( {'cmd':'snapshot', 'ts':ts, 'frame':updateFrame} )
 					doSnapshot = False
 						
-				del backlog[-transmitFramesMax:]
+				del backlog[-transmitMax:]
 				frameCount += 1
 				
 def getCamServer( camInfo=None ):
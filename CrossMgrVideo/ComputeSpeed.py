@@ -83,7 +83,7 @@ class WheelEdgesPage(adv.WizardPageSimple):
 		
 	@property
 	def bitmap( self ):
-		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto1][1]) if self.iPhoto1 is not None else None
+		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto1][1], self.tsJpg[self.iPhoto1][0]) if self.iPhoto1 is not None else None
 		
 	def Set( self, tsJpg, iPhoto1, iPhoto2, wheelDiameter ):
 		self.tsJpg, self.iPhoto1, self.iPhoto2 = tsJpg, iPhoto1, iPhoto2
@@ -215,7 +215,7 @@ class ComputeSpeed( object ):
 	
 	@property
 	def bitmap1( self ):
-		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto1][1]) if self.iPhoto1 is not None else None
+		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto1][1], self.tsJpg[self.iPhoto1][0]) if self.iPhoto1 is not None else None
 	
 	@property
 	def t2( self ):
@@ -223,7 +223,7 @@ class ComputeSpeed( object ):
 	
 	@property
 	def bitmap2( self ):
-		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto2][1]) if self.iPhoto2 is not None else None
+		return CVUtil.jpegToBitmap(self.tsJpg[self.iPhoto2][1], self.tsJpg[self.iPhoto2][0]) if self.iPhoto2 is not None else None
 	
 	def Show( self, tsJpg, iPhoto1, iPhoto2, ts_start ):
 		self.tsJpg, self.iPhoto1, self.iPhoto2, self.ts_start = tsJpg, iPhoto1, iPhoto2, ts_start
@@ -264,8 +264,8 @@ if __name__ == '__main__':
 
 	tsJpg = Database().getLastPhotos( 12 )
 	t1, t2 = tsJpg[0][0], tsJpg[-1][0]
-	bitmap1 = CVUtil.jpegToBitmap(tsJpg[0][1])
-	bitmap2 = CVUtil.jpegToBitmap(tsJpg[-1][1])
+	bitmap1 = CVUtil.jpegToBitmap(tsJpg[0][1], tsJpg[0][0])
+	bitmap2 = CVUtil.jpegToBitmap(tsJpg[-1][1], tsJpg[-1][0])
 
 	mainWin = wx.Frame(None,title="ComputeSpeed", size=(600,300))
 	size = bitmap1.GetSize()
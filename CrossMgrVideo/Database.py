@@ -5,7 +5,8 @@ import six
 import time
 from datetime import datetime, timedelta
 import sqlite3
-import CVUtil
+from PhotoStore import PhotoStore, getPhotoDir
+from EncodePool import encodePool
 from collections import defaultdict
 
 from six.moves.queue import Queue, Empty
@@ -46,6 +47,12 @@ class Database( object ):
 		self.fname = (fname or os.path.join( os.path.expanduser("~"), 'CrossMgrVideo.sqlite3' ) )
 		self.fps = fps
 		
+		# Photos are kept in the segments of a PhotoStore.  Older databases keep them in the photo table until migrated (see MigratePhotos).
+		self.photoStore = None
+		photoDir = getPhotoDir( self.fname )
+		if os.path.isdir(photoDir) or (initTables and not os.path.exists(self.fname)):
+			self.photoStore = PhotoStore( photoDir )
+		
 		'''
 		try:
 			six.print_( 'database bytes: {}'.format( os.stat(self.fname).st_size ) )
@@ -102,10 +109,13 @@ class Database( object ):
 						('frames', 'INTEGER', False, 0),			# Number of frames with this trigger.		
 					)
 				)
-				self.photoTsCache = set( row[0] for row in self.conn.execute(
-						'SELECT ts FROM photo WHERE ts BETWEEN ? AND ?', (now() - timedelta(seconds=self.UpdateSeconds), now())
+				if self.photoStore:
+					self.photoTsCache = set( self.photoStore.getTimestamps(now() - timedelta(seconds=self.UpdateSeconds), now()) )
+				else:
+					self.photoTsCache = set( row[0] for row in self.conn.execute(
+							'SELECT ts FROM photo WHERE ts BETWEEN ? AND ?', (now() - timedelta(seconds=self.UpdateSeconds), now())
+						)
 					)
-				)
 			
 			self.deleteExistingTriggerDuplicates()
 		else:
@@ -124,7 +134,7 @@ class Database( object ):
 		
 	def getsize( self ):
 		try:
-			return os.path.getsize( self.fname )
+			return os.path.getsize( self.fname ) + (self.photoStore.getsize() if self.photoStore else 0)
 		except:
 			return None
 	
@@ -162,7 +172,10 @@ class Database( object ):
 					tsTriggers )
 			if tsJpgs:
 				assert not any(ts is None for ts, jpg in tsJpgs)
-				self.conn.executemany( 'INSERT INTO photo (ts,jpg) VALUES (?,?)', tsJpgs )
+				if self.photoStore:
+					self.photoStore.write( tsJpgs )
+				else:
+					self.conn.executemany( 'INSERT INTO photo (ts,jpg) VALUES (?,?)', tsJpgs )
 		
 		if tsJpgs:
 			self.photoTsCache.update( ts for ts, jpg in tsJpgs )
@@ -223,13 +236,17 @@ class Database( object ):
 		if key == self.tsJpgsKeyLast:
 			return self.tsJpgsLast
 		
-		with self.conn:
-			tsJpgs = list( self.conn.execute( 'SELECT ts,jpg FROM photo WHERE ts BETWEEN ? AND ? ORDER BY ts', (tsLower, tsUpper)) )
+		if self.photoStore:
+			tsJpgs = self.photoStore.getPhotos( tsLower, tsUpper )
+		else:
+			with self.conn:
+				tsJpgs = list( self.conn.execute( 'SELECT ts,jpg FROM photo WHERE ts BETWEEN ? AND ? ORDER BY ts', (tsLower, tsUpper)) )
 		self.tsJpgsKeyLast, self.tsJpgsLast = key, tsJpgs
 		return tsJpgs
 	
 	def getPhotoCount( self, tsLower, tsUpper ):
-		key = (tsLower, tsUpper)
+		if self.photoStore:
+			return self.photoStore.getCount( tsLower, tsUpper )
 		with self.conn:
 			count = self.conn.execute( 'SELECT COUNT(id) FROM photo WHERE ts BETWEEN ? AND ?', (tsLower, tsUpper)).fetchone()
 		return count[0] if count else 0
@@ -275,8 +292,11 @@ class Database( object ):
 					buckets[b].append(id)
 					
 			# Increment the count for every trigger intersecting this photo in the bucket.
-			for r in self.conn.execute( 'SELECT ts FROM photo WHERE ts BETWEEN ? AND ?', (tsLowerPhoto, tsUpperPhoto) ):
-				tsPhoto = r[0]
+			if self.photoStore:
+				tsPhotos = self.photoStore.getTimestamps( tsLowerPhoto, tsUpperPhoto )
+			else:
+				tsPhotos = [r[0] for r in self.conn.execute( 'SELECT ts FROM photo WHERE ts BETWEEN ? AND ?', (tsLowerPhoto, tsUpperPhoto) )]
+			for tsPhoto in tsPhotos:
 				for id in buckets[tsToB(tsPhoto)]:
 					tsBefore,tsAfter = triggers[id]
 					if tsBefore <= tsPhoto <= tsAfter:
@@ -290,6 +310,8 @@ class Database( object ):
 			)
 	
 	def getLastPhotos( self, count ):
+		if self.photoStore:
+			return self.photoStore.getLastPhotos( count )
 		with self.conn:
 			tsJpgs = list( self.conn.execute( 'SELECT ts,jpg FROM photo ORDER BY ts DESC LIMIT ?', (count,)) )
 		tsJpgs.reverse()
@@ -352,11 +374,11 @@ class Database( object ):
 		if not tsLower and not tsUpper:
 			return
 			
-		tsLower = tsLower or datetime.datetime(1900,1,1,0,0,0)
-		tsUpper = tsUpper or datetime.datetime(datetime.datetime.now().year+1000,1,1,0,0,0)
+		tsLower = tsLower or datetime(1900,1,1,0,0,0)
+		tsUpper = tsUpper or datetime(now().year+1000,1,1,0,0,0)
 	
+		self.deletePhotosBetween( tsLower, tsUpper )
 		with self.conn:
-			self.conn.execute( 'DELETE from photo WHERE ts BETWEEN ? AND ?', (tsLower,tsUpper) )
 			self.conn.execute( 'DELETE from trigger WHERE ts BETWEEN ? AND ?', (tsLower,tsUpper) )
 	
 	def deleteTrigger( self, id, s_before_default=0.5,  s_after_default=2.0 ):
@@ -404,13 +426,21 @@ class Database( object ):
 			if b != v:
 				toRemove.append( (b, v) )
 
-		if toRemove:
+		for a, b in toRemove:
+			self.deletePhotosBetween( a, b )
+	
+	def deletePhotosBetween( self, tsLower, tsUpper ):
+		self.tsJpgsKeyLast = self.tsJpgsLast = None
+		if self.photoStore:
+			self.photoStore.deleteBetween( tsLower, tsUpper )
+		else:
 			with self.conn:
-				for a, b in toRemove:
-					self.conn.execute( 'DELETE from photo WHERE ts BETWEEN ? AND ?', (a,b) )
-			
+				self.conn.execute( 'DELETE from photo WHERE ts BETWEEN ? AND ?', (tsLower,tsUpper) )
+	
 	def vacuum( self ):
 		self.conn.execute( 'VACUUM' )
+		if self.photoStore:
+			self.photoStore.vacuum()
 		
 tsJpgs = []
 tsTriggers = []
@@ -424,12 +454,14 @@ def flush( db, triggerWriteCB = None ):
 		
 def DBWriter( q, triggerWriteCB=None, fname=None ):
 	db = Database( fname=fname )
+	encodePool.q = q
 	
 	keepGoing = True
 	while keepGoing:
 		try:
 			v = q.get( timeout=2 )
 		except Empty:
+			tsJpgs.extend( encodePool.collect(True) )
 			if tsTriggers or tsJpgs:
 				flush( db, triggerWriteCB )
 			continue
@@ -438,10 +470,13 @@ def DBWriter( q, triggerWriteCB=None, fname=None ):
 		if v[0] == 'photo':
 			doFlush = False
 			if not db.isDup( v[1] ):
-				tsJpgs.append( (v[1], sqlite3.Binary(CVUtil.frameToJPeg(v[2]))) )
+				encodePool.submit( v[1], v[2] )		# Encoded in parallel, collected in order.
+			tsJpgs.extend( encodePool.collect() )
 		elif v[0] == 'trigger':
 			fieldLen = len(Database.triggerFieldsInput)
 			tsTriggers.append( (list(v[1:]) + [u''] * fieldLen)[:fieldLen] )
+		elif v[0] == 'encode_mode':
+			encodePool.setMode( v[1] )		# 'trigger' or 'capture'
 		elif v[0] == 'kmh':
 			db.updateTriggerKMH( v[1], v[2] )	# id, kmh
 		elif v[0] == 'flush':
@@ -449,10 +484,13 @@ def DBWriter( q, triggerWriteCB=None, fname=None ):
 		elif v[0] == 'terminate':
 			keepGoing = False
 		
+		if doFlush:
+			tsJpgs.extend( encodePool.collect(True) )
 		if doFlush or len(tsJpgs) >= 30*3:
 			flush( db, triggerWriteCB )
 		q.task_done()
-		
+	
+	tsJpgs.extend( encodePool.collect(True) )
 	flush( db )
 	
 def DBReader( q, callback, fname=None ):
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import CVUtil
+
+#------------------------------------------------------------------------------
+# Encode frames to jpeg on a pool of threads (cv2.imencode releases the GIL).
+#
+# Frames are submitted in timestamp order and collected in the same order, so the
+# database writes are unchanged.  Each capture mode has its own quality and size.
+# Both use the default quality unless a lower capture quality is set (see setCaptureQuality).
+
+defaultQuality = 95		# The cv2 default.
+
+encodePolicies = {
+	'trigger':	{'quality': defaultQuality, 'maxHeight': None},		# Frames around a trigger.
+	'capture':	{'quality': defaultQuality, 'maxHeight': None},		# Continuous capture.
+}
+
+def setCaptureQuality( quality, maxHeight=None ):
+	''' Trade some quality or size of the continuously captured frames for speed and space. '''
+	encodePolicies['capture'] = {'quality': max(1, min(100, int(quality))), 'maxHeight': maxHeight}
+
+def encodeFrame( frame, quality, maxHeight ):
+	tStart = time.perf_counter()
+	if maxHeight and frame.shape[0] > maxHeight:
+		h, w = frame.shape[:2]
+		frame = cv2.resize( frame, (int(w * maxHeight / h), maxHeight), interpolation=cv2.INTER_AREA )
+	return CVUtil.encodeJPeg( frame, quality ), frame, time.perf_counter() - tStart
+
+class EncodePool( object ):
+	maxPending = 30*4		# Frames waiting to be encoded before submit blocks.
+
+	def __init__( self, workers=None ):
+		self.workers = workers or max( 1, min(4, (os.cpu_count() or 2) - 1) )
+		self.executor = None
+		self.pending = deque()		# (ts, future, tSubmit)
+		self.mode = 'trigger'
+		self.q = None				# The DBWriter queue, for the stats.
+		self.lock = threading.Lock()
+		self.resetStats()
+
+	def resetStats( self ):
+		with self.lock:
+			self.encoded = 0
+			self.encodeSeconds = 0.0
+			self.latencySeconds = 0.0
+			self.latencyMax = 0.0
+			self.pendingMax = 0
+
+	def setMode( self, mode ):
+		if mode in encodePolicies:
+			self.mode = mode
+
+	def submit( self, ts, frame ):
+		if self.executor is None:
+			self.executor = ThreadPoolExecutor( max_workers=self.workers )
+		if len(self.pending) >= self.maxPending:
+			self.pending[0][1].result()		# Wait for the oldest frame so memory stays bounded.
+		policy = encodePolicies[self.mode]
+		self.pending.append( (ts, self.executor.submit(encodeFrame, frame, policy['quality'], policy['maxHeight']), time.perf_counter()) )
+		self.pendingMax = max( self.pendingMax, len(self.pending) )
+
+	def collect( self, wait=False ):
+		''' Returns (ts, jpeg) of the encoded frames in submit order.  If wait, waits for all the frames. '''
+		tsJpgs = []
+		pending = self.pending
+		while pending and (wait or pending[0][1].done()):
+			ts, future, tSubmit = pending.popleft()
+			jpeg, frame, encodeSeconds = future.result()
+			CVUtil.cacheFrame( ts, frame )
+			latency = time.perf_counter() - tSubmit
+			with self.lock:
+				self.encoded += 1
+				self.encodeSeconds += encodeSeconds
+				self.latencySeconds += latency
+				self.latencyMax = max( self.latencyMax, latency )
+			tsJpgs.append( (ts, jpeg) )
+		return tsJpgs
+
+	def getStats( self ):
+		with self.lock:
+			encoded = self.encoded
+			return {
+				'mode': self.mode,
+				'workers': self.workers,
+				'queue': self.q.qsize() if self.q else 0,
+				'pending': len(self.pending),
+				'pendingMax': self.pendingMax,
+				'encoded': encoded,
+				'encodeAvg': self.encodeSeconds / encoded if encoded else 0.0,
+				'latencyAvg': self.latencySeconds / encoded if encoded else 0.0,
+				'latencyMax': self.latencyMax,
+			}
+
+	def shutdown( self ):
+		if self.executor:
+			self.executor.shutdown()
+			self.executor = None
+
+encodePool = EncodePool()
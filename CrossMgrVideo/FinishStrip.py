@@ -8,7 +8,7 @@ import math
 import datetime
 import platform
 from bisect import bisect_left
-from MakeComposite import MakeComposite
+from MakeComposite import CompositeTiler
 import Utils
 import CVUtil
 
@@ -62,7 +62,8 @@ class FinishStrip( wx.Panel ):
 		self.xMotionLast = None
 		self.yMotionLast = None
 		
-		self.compositeBitmap = None
+		self.composite = None		# CompositeTiler of the current photos, speed, direction and scale.
+		self.tileBitmaps = {}
 		self.xTime = None
 		self.tsFirst = datetime.datetime.now()
 		self.tsJpgs = []
@@ -70,7 +71,6 @@ class FinishStrip( wx.Panel ):
 		self.jpgWidth, self.jpgHeight = 600, 480
 
 		self.times = []
-		self.jpg = {}
 		
 		self.leftToRight = leftToRight
 		self.pixelsPerSec = 25
@@ -109,12 +109,11 @@ class FinishStrip( wx.Panel ):
 	def SetTsJpgs( self, tsJpgs ):
 		self.tsJpgs = (tsJpgs or [])
 		self.times = []
-		self.jpg = {}
 		self.scale = 1.0
 		
 		if not tsJpgs:
 			self.tsFirst = datetime.datetime.now()
-			self.compositeBitmap = None
+			self.refreshCompositeBitmap()
 			self.Refresh()
 			return
 		
@@ -122,7 +121,6 @@ class FinishStrip( wx.Panel ):
 		for ts, jpg in tsJpgs:
 			t = (ts-self.tsFirst).total_seconds()
 			self.times.append( t )
-			self.jpg[t] = jpg
 		
 		self.tMax = self.times[-1]
 		
@@ -135,10 +133,18 @@ class FinishStrip( wx.Panel ):
 		self.refreshCompositeBitmap()
 	
 	def refreshCompositeBitmap( self ):
-		wait = wx.BusyCursor()
-		self.photoWidth, self.photoHeight, self.compositeBitmap = MakeComposite(
-			self.tsJpgs, self.leftToRight, self.pixelsPerSec, self.scale
-		)
+		# Only the geometry is computed here.  The tiles are rendered in the background when they are drawn.
+		if self.composite:
+			self.composite.cancel()
+		self.tileBitmaps = {}
+		if not self.tsJpgs:
+			self.composite = None
+			return
+		self.composite = CompositeTiler( self.tsJpgs, self.leftToRight, self.pixelsPerSec, self.scale )
+		self.photoWidth, self.photoHeight = self.composite.widthPhoto, self.composite.heightPhoto
+	
+	def GetCompositeWidth( self ):
+		return self.composite.width if self.composite else 0
 		
 	def OnErase( self, event ):
 		pass
@@ -160,8 +166,8 @@ class FinishStrip( wx.Panel ):
 			return
 		self.tCursor = t
 		x = self.xFromT( t )
-		if self.compositeBitmap:
-			self.bitmapLeft = max(0, min(x, self.compositeBitmap.GetSize()[0] - self.GetClientSize()[0]))
+		if self.composite:
+			self.bitmapLeft = max(0, min(x, self.composite.width - self.GetClientSize()[0]))
 		self.Refresh()
 		self.scrollCallback( self.bitmapLeft )
 	
@@ -222,8 +228,8 @@ class FinishStrip( wx.Panel ):
 		viewHeight = winHeight
 		viewWidth = min(winWidth//2, int(viewHeight * float(jpgWidth)/float(jpgHeight)))
 		
-		tbm = self.times[bisect_left(self.times, self.tFromX(x), hi=len(self.times)-1)]
-		bm = CVUtil.jpegToImage( self.jpg[tbm] ).ConvertToBitmap()
+		ts, jpg = self.tsJpgs[bisect_left(self.times, self.tFromX(x), hi=len(self.times)-1)]
+		bm = CVUtil.jpegToImage( jpg, ts ).ConvertToBitmap()
 		bmWidth, bmHeight = bm.GetSize()
 		bmWidth = int(bmWidth * self.magnification)
 		bmHeight = int(bmHeight * self.magnification)
@@ -315,7 +321,7 @@ class FinishStrip( wx.Panel ):
 			self.mouseWheelCallback( event )
 	
 	def OnMotion( self, event ):		
-		if not self.compositeBitmap:
+		if not self.composite:
 			return
 		x, y, dragging = event.GetX(), event.GetY(), event.Dragging()
 		
@@ -329,7 +335,7 @@ class FinishStrip( wx.Panel ):
 			dx = -(x - self.xDragLast)
 			self.xDragLast = x
 			self.tCursor = self.tFromX( x )
-			bitmapLeft = max(0, min(self.compositeBitmap.GetSize()[0]-winWidth, self.bitmapLeft+dx)) 
+			bitmapLeft = max(0, min(self.composite.width-winWidth, self.bitmapLeft+dx)) 
 			if bitmapLeft != self.bitmapLeft:
 				self.bitmapLeft = bitmapLeft					
 				wx.CallAfter( self.scrollCallback, self.bitmapLeft )
@@ -347,16 +353,27 @@ class FinishStrip( wx.Panel ):
 		dc.Clear()
 	
 		self.xMotionLast = None
-		if not self.compositeBitmap:
+		if not self.composite:
 			return
 		
-		compositeDC = wx.MemoryDC( self.compositeBitmap )
-		dc.Blit(
-			0, 0, winWidth, self.photoHeight,
-			compositeDC,
-			self.bitmapLeft, 0,
+		# Draw the tiles rendered so far, and request the missing ones and the ones on either side.
+		composite = self.composite
+		tileWidth = composite.tileWidth
+		for iTile in composite.getVisibleTiles( self.bitmapLeft, self.bitmapLeft + winWidth ):
+			tile, decodeScale = composite.getTile( iTile )
+			if tile is None:
+				continue
+			bitmap = self.tileBitmaps.get( (iTile, decodeScale) )
+			if bitmap is None:
+				bitmap = self.tileBitmaps[(iTile, decodeScale)] = CVUtil.frameToBitmap( tile )
+				if decodeScale != composite.levels[0]:
+					self.tileBitmaps.pop( (iTile, composite.levels[0]), None )	# Refined.  Drop the preview.
+			dc.DrawBitmap( bitmap, iTile * tileWidth - self.bitmapLeft, 0 )
+		
+		composite.requestTiles(
+			composite.getVisibleTiles( self.bitmapLeft - winWidth // 2, self.bitmapLeft + winWidth + winWidth // 2 ),
+			lambda: wx.CallAfter( self.onTileRendered )
 		)
-		compositeDC.SelectObject( wx.NullBitmap )
 		
 		# Draw the photo under the cursor.
 		
@@ -386,12 +403,16 @@ class FinishStrip( wx.Panel ):
 		gc.DrawText( text, xCursor - tWidth//2, border )
 		gc.DrawText( text, xCursor - tWidth//2, winHeight - tHeight - border )
 	
+	def onTileRendered( self ):
+		if self:		# The window may have been closed.
+			self.Refresh()
+	
 	def OnPaint( self, event=None ):
 		winWidth, winHeight = self.GetClientSize()
 		self.draw( wx.BufferedPaintDC(self), winWidth, winHeight )
 		
 	def GetBitmap( self ):
-		return self.compositeBitmap if self.compositeBitmap else None
+		return CVUtil.frameToBitmap( self.composite.getFrame() ) if self.composite else None
 
 class FinishStripPanel( wx.Panel ):
 	def __init__( self, parent, id=wx.ID_ANY, size=wx.DefaultSize, style=0, fps=25.0 ):
@@ -539,8 +560,7 @@ class FinishStripPanel( wx.Panel ):
 		if position is None:
 			position = self.timeScrollbar.GetThumbPosition()
 		
-		bitmap = self.finish.GetBitmap()
-		bmWidth =  bitmap.GetSize()[0] if bitmap else self.finish.GetClientSize()[0]
+		bmWidth = self.finish.GetCompositeWidth() or self.finish.GetClientSize()[0]
 		
 		range = bmWidth
 		thumbSize = min( self.finish.GetClientSize()[0], range )
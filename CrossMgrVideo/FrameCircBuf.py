@@ -2,6 +2,11 @@ import six
 import types
 import datetime
 from bisect import bisect_left
+import numpy as np
+try:
+	from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+	shared_memory = None		# Python < 3.8: frames are sent over the pipe.
 
 class CircAsFlat( object ):
 	__slots__ = ('arr', 'iStart', 'iMax')
@@ -53,6 +58,9 @@ class FrameCircBuf( object ):
 			self.frames[iStart] = frame
 			self.iStart = (iStart + 1) % self.bufSize
 
+	def getLast( self ):
+		return self.frames[(self.iStart-1)%self.bufSize]
+
 	def getTimeFrames( self, tStart, tEnd, tsSeen ):
 		iStart = self.iStart
 		bufSize = self.bufSize
@@ -72,6 +80,87 @@ class FrameCircBuf( object ):
 				frames.append( self.frames[k] )
 				tsSeen.add( t )
 		return times, frames
+
+#------------------------------------------------------------------------------
+# A FrameCircBuf with the pixels in shared memory so another process can read them without pickling.
+#
+# The frames list holds a reference (slot, seq) to each frame instead of the frame itself.
+# The references are sent to the reader, which copies the frame out of the slot.
+# seq counts the frames written.  A slot's seq is set to -1 while it is written, so a reader can
+# tell if a frame was overwritten before it could be copied.
+
+class SharedFrameCircBuf( FrameCircBuf ):
+	def __init__( self, bufSize, shape, dtype=np.uint8 ):
+		self.shape = tuple( shape )
+		self.dtype = np.dtype( dtype )
+		self.seqBytes = 8 * bufSize
+		self.shm = shared_memory.SharedMemory( create=True, size=self.seqBytes + bufSize * int(np.prod(self.shape)) * self.dtype.itemsize )
+		self.seqs = np.ndarray( (bufSize,), dtype=np.int64, buffer=self.shm.buf )
+		self.slots = np.ndarray( (bufSize,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.seqBytes )
+		self.seqs[:] = -1
+		self.seq = 0
+		super( SharedFrameCircBuf, self ).__init__( bufSize )
+
+	def getInfo( self ):
+		''' What a SharedFrameReader needs to attach to the buffer. '''
+		return {'name':self.shm.name, 'bufSize':self.bufSize, 'shape':self.shape, 'dtype':self.dtype.str}
+
+	def append( self, t, frame ):
+		if frame is not None:
+			iStart = self.iStart
+			self.seqs[iStart] = -1
+			self.slots[iStart] = frame
+			self.seqs[iStart] = self.seq
+			self.times[iStart] = t
+			self.frames[iStart] = (iStart, self.seq)
+			self.seq += 1
+			self.iStart = (iStart + 1) % self.bufSize
+
+	def close( self ):
+		self.seqs = self.slots = None
+		self.shm.close()
+		try:
+			self.shm.unlink()
+		except FileNotFoundError:
+			pass
+
+def attachSharedMemory( name ):
+	try:
+		return shared_memory.SharedMemory( name=name, track=False )	# Python 3.13+
+	except TypeError:
+		shm = shared_memory.SharedMemory( name=name )
+		# The writer owns the memory.  Otherwise the reader's resource tracker would unlink it too.
+		try:
+			resource_tracker.unregister( shm._name, 'shared_memory' )
+		except Exception:
+			pass
+		return shm
+
+class SharedFrameReader( object ):
+	''' Reads the frames of a SharedFrameCircBuf in another process. '''
+	def __init__( self, info ):
+		self.info = info
+		self.shm = attachSharedMemory( info['name'] )
+		bufSize, shape, dtype = info['bufSize'], tuple(info['shape']), np.dtype(info['dtype'])
+		self.seqs = np.ndarray( (bufSize,), dtype=np.int64, buffer=self.shm.buf )
+		self.slots = np.ndarray( (bufSize,) + shape, dtype=dtype, buffer=self.shm.buf, offset=8 * bufSize )
+		self.frames = 0
+		self.dropped = 0
+
+	def get( self, ref ):
+		''' Returns a copy of the frame, or None if it was overwritten before it could be read. '''
+		slot, seq = ref
+		if self.seqs[slot] == seq:
+			frame = self.slots[slot].copy()
+			if self.seqs[slot] == seq:
+				self.frames += 1
+				return frame
+		self.dropped += 1
+		return None
+
+	def close( self ):
+		self.seqs = self.slots = None
+		self.shm.close()
 		
 if __name__ == '__main__':
 	bufSize = 5*75
@@ -1,4 +1,5 @@
 import six
+import threading
 import collections
 
 class LRUCache( object ):
@@ -31,6 +32,70 @@ class LRUCache( object ):
 	def __getattr__( self, name ):
 		return getattr(self.cache, name)
 
+class SizedLRUCache( object ):
+	'''
+		LRU cache limited by the total size of the values instead of the number of entries.
+		Thread safe.  Keeps hit and miss counts.
+	'''
+	def __init__( self, sizeMax, sizeOf=len ):
+		self.sizeMax = sizeMax
+		self.sizeOf = sizeOf
+		self.cache = collections.OrderedDict()		# key -> (value, size)
+		self.size = 0
+		self.lock = threading.Lock()
+		self.resetStats()
+
+	def resetStats( self ):
+		self.hits = self.misses = self.evictions = 0
+
+	def get( self, key, default=None ):
+		with self.lock:
+			try:
+				value, size = self.cache.pop( key )
+			except KeyError:
+				self.misses += 1
+				return default
+			self.cache[key] = (value, size)
+			self.hits += 1
+			return value
+
+	def __setitem__( self, key, value ):
+		size = self.sizeOf( value )
+		with self.lock:
+			if key in self.cache:
+				self.size -= self.cache.pop(key)[1]
+			if size > self.sizeMax:
+				return
+			while self.cache and self.size + size > self.sizeMax:
+				self.size -= self.cache.popitem(False)[1][1]
+				self.evictions += 1
+			self.cache[key] = (value, size)
+			self.size += size
+
+	def __contains__( self, key ):
+		return key in self.cache
+
+	def __len__( self ):
+		return len( self.cache )
+
+	def clear( self ):
+		with self.lock:
+			self.cache.clear()
+			self.size = 0
+
+	def getStats( self ):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': len(self.cache),
+				'size': self.size,
+				'sizeMax': self.sizeMax,
+				'hits': self.hits,
+				'misses': self.misses,
+				'hitRate': float(self.hits) / lookups if lookups else 0.0,
+				'evictions': self.evictions,
+			}
+
 if __name__ == '__main__':
 	lru = LRUCache( 20 )
 	for i in six.moves.range(30):
@@ -41,3 +106,10 @@ if __name__ == '__main__':
 	six.print_( keys )
 	values = list( lru.values() )
 	six.print_( values )
+	
+	sized = SizedLRUCache( 100 )
+	for i in six.moves.range(30):
+		sized[i] = b'x' * 10
+	assert len(sized) == 10 and sized.size == 100
+	assert sized.get(0) is None and sized.get(29) is not None
+	six.print_( sized.getStats() )
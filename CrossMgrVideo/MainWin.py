@@ -15,6 +15,7 @@ import platform
 import webbrowser
 from six.moves.queue import Queue, Empty
 import CamServer
+from FrameCircBuf import SharedFrameReader
 from roundbutton import RoundButton
 
 from datetime import datetime, timedelta, time
@@ -23,6 +24,7 @@ now = datetime.now
 
 import Utils
 import CVUtil
+import EncodePool
 from SocketListener import SocketListener
 from Database import Database, DBWriter
 from ScaledBitmap import ScaledBitmap
@@ -844,6 +846,7 @@ class MainWin( wx.Frame ):
 				'last_name':u'Capture',
 			}
 		)
+		self.dbWriterQ.put( ('encode_mode', 'capture') )
 		self.camInQ.put( {'cmd':'start_capture', 'tStart':tNow-self.tdCaptureBefore} )
 	
 	def showLastTrigger( self ):
@@ -857,6 +860,7 @@ class MainWin( wx.Frame ):
 	
 	def onStopCapture( self, event ):
 		self.camInQ.put( {'cmd':'stop_capture'} )
+		self.dbWriterQ.put( ('encode_mode', 'trigger') )
 		triggers = self.db.getTriggers( self.tStartCapture, self.tStartCapture, self.captureCount )
 		if triggers:
 			id = triggers[0][0]
@@ -1035,6 +1039,14 @@ class MainWin( wx.Frame ):
 		lastFrame = None
 		lastPrimaryTime = now()
 		primaryCount = 0
+		frameReader = None		# Reads the frames from shared memory when the CamServer sends references.
+		
+		def getFrame( f ):
+			# Frame references can only be read with a reader.  Without one they are dropped.
+			if isinstance(f, tuple):
+				return frameReader.get( f ) if frameReader else None
+			return f
+		
 		while 1:
 			try:
 				msg = self.camReader.recv()
@@ -1044,10 +1056,23 @@ class MainWin( wx.Frame ):
 			cmd = msg['cmd']
 			if cmd == 'response':
 				for t, f in msg['ts_frames']:
-					self.dbWriterQ.put( ('photo', t, f) )
-					lastFrame = f
+					f = getFrame( f )
+					if f is not None:
+						self.dbWriterQ.put( ('photo', t, f) )
+						lastFrame = f
+			elif cmd == 'frame_buffer':
+				if frameReader:
+					frameReader.close()
+				try:
+					frameReader = SharedFrameReader( msg['info'] )
+				except OSError as e:
+					six.print_( 'processCamera: ', e )
+					frameReader = None
+					# Ask the CamServer to send the frames instead of references.
+					CamServer.sharedFrames = False
+					self.camInQ.put( {'cmd':'no_shared_frames'} )
 			elif cmd == 'update':
-				name, lastFrame = msg['name'], lastFrame if msg['frame'] is None else msg['frame']
+				name, lastFrame = msg['name'], lastFrame if msg['frame'] is None else getFrame(msg['frame'])
 				if lastFrame is not None:
 					if name == 'primary':
 						wx.CallAfter( self.primaryBitmap.SetBitmap, CVUtil.frameToBitmap(lastFrame) )
@@ -1065,8 +1090,11 @@ class MainWin( wx.Frame ):
 						else:
 							self.camInQ.put( {'cmd':'cancel_update', 'name':'focus'} )
 			elif cmd == 'snapshot':
-				lastFrame = lastFrame if msg['frame'] is None else msg['frame']
-				wx.CallAfter( self.updateSnapshot,  msg['ts'], lastFrame )
+				f = None if msg['frame'] is None else getFrame(msg['frame'])
+				if f is not None:
+					lastFrame = f
+				if lastFrame is not None:
+					wx.CallAfter( self.updateSnapshot,  msg['ts'], lastFrame )
 			elif cmd == 'terminate':
 				break
 		
@@ -1116,6 +1144,7 @@ class MainWin( wx.Frame ):
 				self.db = Database( dbName )
 			except:
 				self.db = Database()
+			CVUtil.frameCache.clear()	# The cache is keyed by timestamp, which is only unique within a database.
 			
 			self.dbWriterQ = Queue()
 			self.dbWriterThread = threading.Thread( target=DBWriter, args=(self.dbWriterQ, lambda: wx.CallAfter(self.delayRefreshTriggers), self.db.fname) )
@@ -1189,6 +1218,7 @@ class MainWin( wx.Frame ):
 		self.config.Write( 'FPS', self.targetFPS.GetLabel() )
 		self.config.Write( 'SecondsBefore', '{:.3f}'.format(self.tdCaptureBefore.total_seconds()) )
 		self.config.Write( 'SecondsAfter', '{:.3f}'.format(self.tdCaptureAfter.total_seconds()) )
+		self.config.Write( 'CaptureJpegQuality', '{}'.format(EncodePool.encodePolicies['capture']['quality']) )
 		self.config.Flush()
 	
 	def readOptions( self ):
@@ -1206,6 +1236,10 @@ class MainWin( wx.Frame ):
 			self.tdCaptureAfter = timedelta(seconds=abs(float(s_after)))
 		except:
 			pass
+		try:
+			EncodePool.setCaptureQuality( int(self.config.Read('CaptureJpegQuality', u'{}'.format(EncodePool.defaultQuality))) )
+		except ValueError:
+			pass
 		
 	def getCameraInfo( self ):
 		width, height = self.getCameraResolution()
@@ -1,6 +1,11 @@
+import os
+import threading
+from bisect import bisect_right
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+from LRUCache import SizedLRUCache
 from CVUtil import frameToBitmap, jpegToFrame
 
 def MakeComposite( tsJpgs, leftToRight, pixelsPerSec, scale, highQuality=False ):
@@ -10,7 +15,7 @@ def MakeComposite( tsJpgs, leftToRight, pixelsPerSec, scale, highQuality=False )
 	# Create a composite at full size, then rescale at the end.
 	tsFirst = tsJpgs[0][0]
 	times = [(ts - tsFirst).total_seconds() for ts, jpg in tsJpgs]
-	imgCur = jpegToFrame(tsJpgs[0][1])
+	imgCur = jpegToFrame(tsJpgs[0][1], tsJpgs[0][0])
 	heightPhoto, widthPhoto, layers = imgCur.shape
 	
 	if len(tsJpgs) == 1:
@@ -33,7 +38,7 @@ def MakeComposite( tsJpgs, leftToRight, pixelsPerSec, scale, highQuality=False )
 			dx = min( xLeftLast - xLeft, widthPhotoHalf )
 			imgComposite[:,xLeft:xLeft+dx] = imgCur[:,widthPhotoHalf:widthPhotoHalf+dx]
 			try:
-				imgCur = jpegToFrame(tsJpgs[i+1][1])
+				imgCur = jpegToFrame(tsJpgs[i+1][1], tsJpgs[i+1][0])
 			except IndexError:
 				break
 			xLeftLast = xLeft
@@ -44,7 +49,7 @@ def MakeComposite( tsJpgs, leftToRight, pixelsPerSec, scale, highQuality=False )
 			dx = min( xRight - xRightLast, widthPhotoHalf )
 			imgComposite[:,xRight-dx:xRight] = imgCur[:,widthPhotoHalf-dx:widthPhotoHalf]
 			try:
-				imgCur = jpegToFrame(tsJpgs[i+1][1])
+				imgCur = jpegToFrame(tsJpgs[i+1][1], tsJpgs[i+1][0])
 			except IndexError:
 				break
 			xRightLast = xRight
@@ -57,6 +62,154 @@ def MakeComposite( tsJpgs, leftToRight, pixelsPerSec, scale, highQuality=False )
 		)
 	return widthPhoto, heightPhoto, frameToBitmap(imgComposite)
 #---------------------------------------------------------------------------------
+# Tiled composite.
+#
+# The same composite as MakeComposite, built in tiles of tileWidth pixels at the display scale,
+# and only for the tiles that are asked for.  The geometry (which frame columns go where) is
+# computed once.  Frames are decoded on a thread pool at the smallest jpeg reduction good enough
+# for the scale, through the CVUtil frame cache, so changing the speed or direction does not
+# decode them again.  Each tile is rendered from 1/8 size frames first, then refined.
+# Rendered tiles are cached, so going back to an earlier speed or direction reuses them.
+
+decodeScales = (0.125, 0.25, 0.5, 1.0)
+previewScale = decodeScales[0]
+
+tileCacheBytesMax = 256*1024*1024
+tileCache = SizedLRUCache( tileCacheBytesMax, lambda tile: tile.nbytes )
+
+tilePool = None
+def getTilePool():
+	global tilePool
+	if tilePool is None:
+		tilePool = ThreadPoolExecutor( max_workers=max(2, min(8, os.cpu_count() or 2)) )
+	return tilePool
+
+class CompositeTiler( object ):
+	tileWidth = 256
+
+	def __init__( self, tsJpgs, leftToRight, pixelsPerSec, scale ):
+		self.tsJpgs = tsJpgs
+		self.scale = scale
+		self.key = (tsJpgs[0][0], tsJpgs[-1][0], len(tsJpgs), leftToRight, pixelsPerSec, scale)
+		self.lock = threading.Lock()
+		self.pending = set()
+		self.cancelled = False
+
+		frame = jpegToFrame( tsJpgs[0][1], tsJpgs[0][0] )
+		self.heightPhoto, self.widthPhoto = frame.shape[:2]
+		widthPhotoHalf = self.widthPhoto // 2
+
+		# The geometry of MakeComposite as (xDest, dx, iFrame, xSrc) slices.
+		tsFirst = tsJpgs[0][0]
+		times = [(ts - tsFirst).total_seconds() for ts, jpg in tsJpgs]
+		slices = []
+		if len(tsJpgs) == 1:
+			widthComposite = self.widthPhoto
+			slices.append( (0, self.widthPhoto, 0, 0) )
+		else:
+			extraSlice = int((times[1] - times[0]) if leftToRight else (times[-1] - times[-2]))
+			widthComposite = int((times[-1] + extraSlice)* pixelsPerSec) + 1
+			if leftToRight:
+				xLeftLast = widthComposite
+				for i, t in enumerate(times):
+					xLeft = widthComposite - extraSlice - int(t * pixelsPerSec)
+					dx = min( xLeftLast - xLeft, widthPhotoHalf )
+					slices.append( (xLeft, dx, i, widthPhotoHalf) )
+					xLeftLast = xLeft
+			else:
+				xRightLast = 0
+				for i, t in enumerate(times):
+					xRight = extraSlice + int(t * pixelsPerSec)
+					dx = min( xRight - xRightLast, widthPhotoHalf )
+					slices.append( (xRight-dx, dx, i, widthPhotoHalf-dx) )
+					xRightLast = xRight
+		self.slices = sorted( s for s in slices if s[1] > 0 )
+		self.sliceStarts = [s[0] for s in self.slices]
+		self.widthComposite = widthComposite
+
+		self.width = max( 1, int(round(widthComposite * scale)) )
+		self.height = max( 1, int(round(self.heightPhoto * scale)) )
+		self.tileCount = (self.width + self.tileWidth - 1) // self.tileWidth
+		self.finalScale = next( (d for d in decodeScales if d >= scale), 1.0 )
+		self.levels = (previewScale, self.finalScale) if self.finalScale != previewScale else (self.finalScale,)
+
+	def getVisibleTiles( self, xLeft, xRight ):
+		return range( max(0, xLeft // self.tileWidth), min(self.tileCount, (xRight + self.tileWidth - 1) // self.tileWidth) )
+
+	def renderTile( self, iTile, decodeScale ):
+		''' Returns the tile at the display scale, built from frames decoded at decodeScale. '''
+		x0 = iTile * self.tileWidth
+		x1 = min( x0 + self.tileWidth, self.width )
+		a, b = x0 / self.scale, x1 / self.scale		# Composite columns covered by the tile.
+
+		tile = None
+		i = max( 0, bisect_right(self.sliceStarts, a) - 1 )
+		for xDest, dx, iFrame, xSrc in self.slices[i:]:
+			if xDest >= b:
+				break
+			u0, u1 = max(xDest, a), min(xDest + dx, b)
+			if u1 <= u0:
+				continue
+			ts, jpg = self.tsJpgs[iFrame]
+			frame = jpegToFrame( jpg, ts, decodeScale )
+			if tile is None:
+				tile = np.full( (frame.shape[0], max(1, int(round((b - a) * decodeScale))), 3), 0xd3, np.uint8 )
+			p0, p1 = int(round((u0 - a) * decodeScale)), min( tile.shape[1], int(round((u1 - a) * decodeScale)) )
+			q0 = int(round((xSrc + u0 - xDest) * decodeScale))
+			n = min( p1 - p0, frame.shape[1] - q0 )
+			if n > 0:
+				tile[:, p0:p0+n] = frame[:tile.shape[0], q0:q0+n]
+
+		if tile is None:
+			return np.full( (self.height, x1 - x0, 3), 0xd3, np.uint8 )
+		if tile.shape[:2] != (self.height, x1 - x0):
+			tile = cv2.resize( tile, (x1 - x0, self.height), interpolation=cv2.INTER_AREA )
+		return tile
+
+	def getTile( self, iTile ):
+		''' Returns (tile, decodeScale) of the best tile rendered so far, or (None, None). '''
+		for decodeScale in reversed(self.levels):
+			tile = tileCache.get( (self.key, iTile, decodeScale) )
+			if tile is not None:
+				return tile, decodeScale
+		return None, None
+
+	def isFinal( self, iTile ):
+		return (self.key, iTile, self.finalScale) in tileCache
+
+	def doRender( self, iTile, decodeScale, callback ):
+		try:
+			if not self.cancelled:
+				tileCache[(self.key, iTile, decodeScale)] = self.renderTile( iTile, decodeScale )
+				if callback and not self.cancelled:
+					callback()
+		finally:
+			with self.lock:
+				self.pending.discard( (iTile, decodeScale) )
+
+	def requestTiles( self, iTiles, callback=None ):
+		''' Renders the tiles in the background, all the previews first.  callback is called from a worker thread. '''
+		pool = getTilePool()
+		for decodeScale in self.levels:
+			for iTile in iTiles:
+				k = (iTile, decodeScale)
+				with self.lock:
+					if k in self.pending or (self.key, iTile, decodeScale) in tileCache or self.isFinal(iTile):
+						continue
+					self.pending.add( k )
+				pool.submit( self.doRender, iTile, decodeScale, callback )
+
+	def cancel( self ):
+		self.cancelled = True
+
+	def getFrame( self ):
+		''' Returns the whole composite at the final quality. '''
+		def getFinal( iTile ):
+			tile, decodeScale = self.getTile( iTile )
+			return tile if decodeScale == self.finalScale else self.renderTile( iTile, self.finalScale )
+		return np.hstack( list(getTilePool().map(getFinal, range(self.tileCount))) )
+
+#---------------------------------------------------------------------------------
 '''
 
 import wx
@@ -0,0 +1,56 @@
+import os
+import sys
+import six
+import shutil
+import sqlite3
+from PhotoStore import PhotoStore, getPhotoDir
+
+#------------------------------------------------------------------------------
+# Move the photos of a database from the sqlite photo table to a PhotoStore.
+#
+# The photos are copied to a temporary directory which is renamed when complete, so an
+# interrupted migration leaves the database as it was and can be run again.
+# Run this when CrossMgrVideo is not running.
+#
+#	python MigratePhotos.py [database] [--keep]
+
+def MigratePhotos( fname=None, keepPhotos=False, chunkSize=500, progressCB=None ):
+	fname = fname or os.path.join( os.path.expanduser("~"), 'CrossMgrVideo.sqlite3' )
+	photoDir = getPhotoDir( fname )
+	conn = sqlite3.connect( fname, detect_types=sqlite3.PARSE_DECLTYPES, timeout=45.0 )
+
+	if not conn.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name='photo'" ).fetchone():
+		return 0
+
+	count = 0
+	if not os.path.isdir( photoDir ):
+		photoDirTmp = photoDir + '-migrating'
+		shutil.rmtree( photoDirTmp, ignore_errors=True )
+		store = PhotoStore( photoDirTmp )
+		total = conn.execute( 'SELECT COUNT(id) FROM photo' ).fetchone()[0]
+		idLast = -1
+		while True:
+			# Read by id to keep the memory bounded.  The store sorts the photos by ts.
+			rows = conn.execute( 'SELECT id,ts,jpg FROM photo WHERE id > ? ORDER BY id LIMIT ?', (idLast, chunkSize) ).fetchall()
+			if not rows:
+				break
+			idLast = rows[-1][0]
+			store.write( [(ts, jpg) for id, ts, jpg in rows if ts and jpg] )
+			count += len(rows)
+			if progressCB:
+				progressCB( count, total )
+		os.rename( photoDirTmp, photoDir )
+
+	if not keepPhotos:
+		with conn:
+			conn.execute( 'DELETE FROM photo' )
+		conn.execute( 'VACUUM' )
+	conn.close()
+	return count
+
+if __name__ == '__main__':
+	args = [a for a in sys.argv[1:] if not a.startswith('--')]
+	def progress( count, total ):
+		six.print_( '{}/{}'.format(count, total) )
+	count = MigratePhotos( args[0] if args else None, keepPhotos='--keep' in sys.argv, progressCB=progress )
+	six.print_( 'migrated {} photos'.format(count) )
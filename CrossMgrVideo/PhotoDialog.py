@@ -320,7 +320,7 @@ class PhotoDialog( wx.Dialog ):
 	def getPhoto( self ):
 		if self.jpg is None:
 			return None
-		return self.addPhotoHeaderToBitmap( CVUtil.jpegToBitmap(self.jpg) )
+		return self.addPhotoHeaderToBitmap( CVUtil.jpegToBitmap(self.jpg, self.ts) )
 		
 	def onClose( self, event ):
 		self.playStop()
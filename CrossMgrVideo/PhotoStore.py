@@ -0,0 +1,317 @@
+import os
+import six
+import mmap
+import glob
+import time
+import struct
+import bisect
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+#------------------------------------------------------------------------------
+# Photos stored in append-only files, one segment per hour, instead of BLOBs in sqlite.
+#
+#	<dirName>/YYYYMMDD/HH.jpgs		the jpegs, one after the other
+#	<dirName>/YYYYMMDD/HH.idx		(timestamp, offset, length) of each jpeg
+#	<dirName>/YYYYMMDD/HH.del		(timestamp from, timestamp to, .jpgs size) of deleted ranges, if any
+#
+# The jpeg is written before its index entry, so a reader never sees an entry without its data.
+# Ranges are deleted by removing whole segments where possible, otherwise by recording the range
+# in the .del file.  vacuum() rewrites the segments with deleted ranges to reclaim the space.
+#
+# The threads of a process each have their own PhotoStore (see Database.clone), so the stores of a
+# directory share a lock.  It is held while files are appended, read and replaced, never while a
+# segment is being rewritten, so vacuum() does not hold up the writer.
+
+epoch = datetime( 1970, 1, 1 )
+microsecond = timedelta( microseconds=1 )
+
+indexRecord = struct.Struct( '<qQI' )		# timestamp in microseconds, offset, length
+deleteRecord = struct.Struct( '<qqQ' )		# timestamp from, timestamp to, in microseconds, and the size of the .jpgs file when deleted
+
+def tsToUs( ts ):
+	return (ts - epoch) // microsecond
+
+def usToTs( us ):
+	return epoch + timedelta( microseconds=us )
+
+def getPhotoDir( fnameDB ):
+	return os.path.splitext(fnameDB)[0] + '.photos'
+
+def hourFloor( ts ):
+	return ts.replace( minute=0, second=0, microsecond=0 )
+
+def fileId( fname ):
+	''' Returns (size, inode) of the file, or (0, None) if it does not exist.  The inode changes when vacuum replaces the file. '''
+	try:
+		st = os.stat( fname )
+	except OSError:
+		return 0, None
+	return st.st_size, (st.st_dev, st.st_ino)
+
+locks = {}
+locksLock = threading.Lock()
+def getLock( dirName ):
+	with locksLock:
+		return locks.setdefault( os.path.abspath(dirName), threading.RLock() )
+
+class Segment( object ):
+	''' The index of one hour of photos, read incrementally as the file grows. '''
+	def __init__( self, base ):
+		self.base = base
+		self.index = []			# Sorted (tsUs, offset, length)
+		self.indexSize = 0
+		self.indexId = None
+		self.deleted = []		# (tsUsFrom, tsUsTo, offsetEnd)
+		self.deletedSize = 0
+		self.deletedId = None
+
+	def refresh( self ):
+		size, indexId = fileId( self.base + '.idx' )
+		if size < self.indexSize or indexId != self.indexId:		# Rewritten by vacuum.
+			self.index, self.indexSize, self.indexId = [], 0, indexId
+		if size > self.indexSize:
+			with open( self.base + '.idx', 'rb' ) as f:
+				f.seek( self.indexSize )
+				data = f.read( (size - self.indexSize) // indexRecord.size * indexRecord.size )
+			records = list( indexRecord.iter_unpack(data) )
+			inOrder = not self.index or not records or self.index[-1][0] <= records[0][0]
+			self.index.extend( records )
+			self.indexSize += len(data)
+			if not inOrder or any( records[i][0] > records[i+1][0] for i in six.moves.range(len(records)-1) ):
+				self.index.sort()
+
+		size, deletedId = fileId( self.base + '.del' )
+		if size != self.deletedSize or deletedId != self.deletedId:
+			try:
+				with open( self.base + '.del', 'rb' ) as f:
+					data = f.read()
+			except (IOError, OSError):		# Removed by vacuum.
+				data = b''
+			self.deleted = list( deleteRecord.iter_unpack(data[:len(data) // deleteRecord.size * deleteRecord.size]) )
+			self.deletedSize, self.deletedId = size, deletedId
+		return self
+
+	def isDeleted( self, e ):
+		# Photos written after the delete are not affected by it.
+		return any( a <= e[0] <= b and e[1] < offsetEnd for a, b, offsetEnd in self.deleted )
+
+	def entries( self, usLower, usUpper ):
+		''' Returns the index entries between usLower and usUpper, inclusive, without deleted or repeated timestamps. '''
+		index = self.index
+		entries = index[bisect.bisect_left(index, (usLower,)):bisect.bisect_right(index, (usUpper, 1<<64))]
+		if self.deleted:
+			entries = [e for e in entries if not self.isDeleted(e)]
+		return [e for i, e in enumerate(entries) if i == 0 or entries[i-1][0] != e[0]]
+
+class PhotoStore( object ):
+	def __init__( self, dirName ):
+		self.dirName = dirName
+		self.segments = {}		# base -> Segment
+		self.lock = getLock( dirName )
+		if not os.path.isdir( dirName ):
+			os.makedirs( dirName )
+
+	def getBase( self, tsHour ):
+		return os.path.join( self.dirName, tsHour.strftime('%Y%m%d'), tsHour.strftime('%H') )
+
+	def getSegment( self, base ):
+		try:
+			segment = self.segments[base]
+		except KeyError:
+			segment = self.segments[base] = Segment( base )
+		with self.lock:
+			return segment.refresh()
+
+	def getHours( self, tsLower, tsUpper ):
+		''' Returns (tsHour, base) of the segments that exist between tsLower and tsUpper. '''
+		hours = []
+		tsHour, tsEnd = hourFloor( tsLower ), hourFloor( tsUpper )
+		if (tsEnd - tsHour).days > 2:
+			# Long range.  List the segments rather than checking every hour.
+			for base in self.getAllBases():
+				tsHour = self.getBaseHour( base )
+				if hourFloor(tsLower) <= tsHour <= tsEnd:
+					hours.append( (tsHour, base) )
+			return hours
+		while tsHour <= tsEnd:
+			base = self.getBase( tsHour )
+			if os.path.exists( base + '.idx' ):
+				hours.append( (tsHour, base) )
+			tsHour += timedelta( hours=1 )
+		return hours
+
+	def getAllBases( self ):
+		return sorted( f[:-4] for f in glob.glob(os.path.join(self.dirName, '[0-9]'*8, '[0-9][0-9].idx')) )
+
+	def getBaseHour( self, base ):
+		day, hour = base.split(os.sep)[-2:]
+		return datetime.strptime( day + hour, '%Y%m%d%H' )
+
+	def write( self, tsJpgs ):
+		''' Append (ts, jpg) to the segments.  Callers are responsible for removing duplicates. '''
+		byBase = {}
+		for ts, jpg in tsJpgs:
+			byBase.setdefault( self.getBase(hourFloor(ts)), [] ).append( (ts, jpg) )
+		with self.lock:
+			for base, tsJpgsBase in six.iteritems(byBase):
+				dirName = os.path.dirname( base )
+				if not os.path.isdir( dirName ):
+					os.makedirs( dirName )
+				with open( base + '.jpgs', 'ab' ) as fData:
+					offset = fData.tell()
+					records = []
+					for ts, jpg in tsJpgsBase:
+						fData.write( jpg )
+						records.append( indexRecord.pack(tsToUs(ts), offset, len(jpg)) )
+						offset += len(jpg)
+				with open( base + '.idx', 'ab' ) as fIndex:
+					fIndex.write( b''.join(records) )
+
+	def getTimestamps( self, tsLower, tsUpper ):
+		usLower, usUpper = tsToUs( tsLower ), tsToUs( tsUpper )
+		return [usToTs(e[0]) for tsHour, base in self.getHours(tsLower, tsUpper) for e in self.getSegment(base).entries(usLower, usUpper)]
+
+	def getCount( self, tsLower, tsUpper ):
+		usLower, usUpper = tsToUs( tsLower ), tsToUs( tsUpper )
+		return sum( len(self.getSegment(base).entries(usLower, usUpper)) for tsHour, base in self.getHours(tsLower, tsUpper) )
+
+	def readEntries( self, base, entries ):
+		if not entries:
+			return []
+		with self.lock, open( base + '.jpgs', 'rb' ) as f:
+			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			try:
+				return [(usToTs(us), mm[offset:offset+length]) for us, offset, length in entries]
+			finally:
+				mm.close()
+
+	def getPhotos( self, tsLower, tsUpper ):
+		''' Returns (ts, jpg) between tsLower and tsUpper inclusive, sorted by ts. '''
+		usLower, usUpper = tsToUs( tsLower ), tsToUs( tsUpper )
+		tsJpgs = []
+		for tsHour, base in self.getHours( tsLower, tsUpper ):
+			tsJpgs.extend( self.readEntries(base, self.getSegment(base).entries(usLower, usUpper)) )
+		return tsJpgs
+
+	def getLastPhotos( self, count ):
+		tsJpgs = []
+		for base in reversed( self.getAllBases() ):
+			entries = self.getSegment( base ).entries( 0, 1<<62 )
+			tsJpgs[:0] = self.readEntries( base, entries[-(count - len(tsJpgs)):] )
+			if len(tsJpgs) >= count:
+				break
+		return tsJpgs
+
+	def removeSegment( self, base ):
+		self.segments.pop( base, None )
+		for ext in ('.idx', '.jpgs', '.del', '.old'):
+			try:
+				os.remove( base + ext )
+			except OSError:
+				pass
+		try:
+			os.rmdir( os.path.dirname(base) )	# Remove the day if it is empty.
+		except OSError:
+			pass
+
+	def deleteBetween( self, tsLower, tsUpper ):
+		''' Delete the photos between tsLower and tsUpper inclusive.  Segments entirely in the range are removed. '''
+		usLower, usUpper = tsToUs( tsLower ), tsToUs( tsUpper )
+		for tsHour, base in self.getHours( tsLower, tsUpper ):
+			if tsLower <= tsHour and tsHour + timedelta(hours=1) - microsecond <= tsUpper:
+				self.removeSegment( base )
+			elif self.getSegment( base ).entries( usLower, usUpper ):
+				with open( base + '.del', 'ab' ) as f:
+					f.write( deleteRecord.pack(usLower, usUpper, os.path.getsize(base + '.jpgs')) )
+
+	def expireBefore( self, ts ):
+		''' Remove all the segments of hours before ts. '''
+		tsHour = hourFloor( ts )
+		for base in self.getAllBases():
+			if self.getBaseHour(base) < tsHour:
+				self.removeSegment( base )
+
+	def vacuum( self, activeSeconds=120.0 ):
+		''' Rewrite the segments that have deleted ranges to reclaim the space.
+			Segments written to in the last activeSeconds are left for later, as are segments written to during the rewrite.
+		'''
+		tActive = time.time() - activeSeconds
+		for base in self.getAllBases():
+			tmp = os.path.join( os.path.dirname(base), 'vacuum' )
+			for f in (tmp + '.idx', tmp + '.jpgs', base + '.old'):
+				try:
+					os.remove( f )
+				except OSError:
+					pass
+			if not os.path.exists( base + '.del' ):
+				continue
+			try:
+				if os.path.getmtime( base + '.idx' ) > tActive:
+					continue
+			except OSError:
+				continue
+
+			segment = self.getSegment( base )
+			indexSize, indexId = segment.indexSize, segment.indexId
+			tsJpgs = self.readEntries( base, segment.entries(0, 1<<62) )
+			if tsJpgs:
+				self.writeSegment( tmp, tsJpgs )
+			with self.lock:
+				if fileId(base + '.idx') != (indexSize, indexId):
+					continue		# Written to or vacuumed since it was read.
+				self.segments.pop( base, None )
+				if not tsJpgs:
+					self.removeSegment( base )
+				elif self.replaceSegment( tmp, base ):
+					os.remove( base + '.del' )
+
+	def replaceSegment( self, tmp, base ):
+		''' Replace the segment's files with the rewritten ones.  Returns False, with the segment unchanged, if a file is open in
+			another process (Windows does not replace open files).
+		'''
+		try:
+			os.replace( base + '.jpgs', base + '.old' )
+		except OSError:
+			return False
+		try:
+			os.replace( tmp + '.jpgs', base + '.jpgs' )
+			os.replace( tmp + '.idx', base + '.idx' )
+		except OSError:
+			if os.path.exists( tmp + '.jpgs' ):
+				os.replace( base + '.old', base + '.jpgs' )
+			else:
+				os.replace( base + '.jpgs', tmp + '.jpgs' )
+				os.replace( base + '.old', base + '.jpgs' )
+			return False
+		try:
+			os.remove( base + '.old' )
+		except OSError:
+			pass		# Removed by the next vacuum.
+		return True
+
+	def writeSegment( self, base, tsJpgs ):
+		records = []
+		offset = 0
+		with open( base + '.jpgs', 'wb' ) as fData:
+			for ts, jpg in tsJpgs:
+				fData.write( jpg )
+				records.append( indexRecord.pack(tsToUs(ts), offset, len(jpg)) )
+				offset += len(jpg)
+		with open( base + '.idx', 'wb' ) as fIndex:
+			fIndex.write( b''.join(records) )
+
+	def getsize( self ):
+		size = 0
+		for dirPath, dirNames, fileNames in os.walk( self.dirName ):
+			for f in fileNames:
+				try:
+					size += os.path.getsize( os.path.join(dirPath, f) )
+				except OSError:
+					pass
+		return size
+
+	def remove( self ):
+		self.segments.clear()
+		shutil.rmtree( self.dirName, ignore_errors=True )
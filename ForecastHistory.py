@@ -1,6 +1,7 @@
 import wx
 import sys
 import six
+import heapq
 import bisect
 import operator
 import itertools
@@ -18,14 +19,151 @@ from EditEntry import CorrectNumber, SplitNumber, ShiftNumber, InsertNumber, Del
 from FixCategories import SetCategory
 from FtpWriteFile import realTimeFtpPublish
 
+class ArrivalRecord( object ):
+	__slots__ = ('raceTimes', 'interp', 'offset', 'expected', 'recorded', 'seq')
+	
+	def __init__( self, raceTimes, interp, offset, expected, recorded, seq ):
+		self.raceTimes	= raceTimes
+		self.interp		= interp
+		self.offset		= offset
+		self.expected	= expected
+		self.recorded	= recorded
+		self.seq		= seq
+
+class ArrivalIndex( object ):
+	"""
+	Next expected and last recorded entry of each finisher, kept sorted by Entry.key.
+	
+	A rider's entries only change when its results change or when the race time passes its
+	next race time.  Those times are kept in a heap, so a refresh only recomputes the riders
+	whose results changed or who were due since the last refresh.
+	"""
+	
+	lapMin = 1
+	
+	def __init__( self ):
+		self.reset()
+	
+	def reset( self, race=None, tCutoff=None ):
+		self.race = race
+		self.tCutoff = tCutoff
+		self.results = None
+		self.riders = {}			# num -> ArrivalRecord
+		self.expected = []			# [(Entry.key(), Entry)] sorted.
+		self.recorded = []
+		self.transitions = []		# heap of (race time, seq, num)
+		self.seq = itertools.count()
+	
+	@staticmethod
+	def insertEntry( lst, e ):
+		if e is not None:
+			bisect.insort( lst, (e.key(), e) )
+	
+	@staticmethod
+	def removeEntry( lst, e ):
+		if e is not None:
+			del lst[bisect.bisect_left(lst, (e.key(),))]
+	
+	def removeRider( self, num ):
+		record = self.riders.pop( num, None )
+		if record:
+			self.removeEntry( self.expected, record.expected )
+			self.removeEntry( self.recorded, record.recorded )
+	
+	def setRider( self, num, raceTimes, interp, offset, tCur ):
+		self.removeRider( num )
+		
+		Entry = Model.Entry
+		tCutoff = self.tCutoff
+		lapMin = self.lapMin
+		i = bisect.bisect_left( raceTimes, tCur - offset )
+		
+		# Get the next expected lap.  Consider that the rider could have been missed from the last lap.
+		eExpected = None
+		try:
+			lap = i
+			if lap > 1 and interp[lap-1] and raceTimes[lap-1] + offset >= tCutoff:
+				lap -= 1
+			t = raceTimes[lap] + offset if interp[lap] else None
+		except IndexError:
+			t = None
+		if t is not None and lap >= lapMin:
+			eExpected = Entry( num, lap, t, interp[lap] )
+		
+		# Get the last recorded lap.
+		eRecorded = None
+		try:
+			lap = i - 1
+			while lap > 0 and interp[lap] and raceTimes[lap-1] + offset >= tCutoff:
+				lap -= 1
+			t = raceTimes[lap] + offset if (lap == 0 or not interp[lap]) else None
+		except IndexError:
+			t = None
+		if t is not None and lap >= lapMin:
+			eRecorded = Entry( num, lap, t, interp[lap] )
+		
+		self.insertEntry( self.expected, eExpected )
+		self.insertEntry( self.recorded, eRecorded )
+		seq = next( self.seq )
+		self.riders[num] = ArrivalRecord( raceTimes, interp, offset, eExpected, eRecorded, seq )
+		
+		# The entries change when the race time passes the next race time.
+		if i < len(raceTimes):
+			heapq.heappush( self.transitions, (raceTimes[i] + offset, seq, num) )
+	
+	def update( self, race, results, tCur, tCutoff=0.0 ):
+		if race is not self.race or tCutoff != self.tCutoff:
+			self.reset( race, tCutoff )
+		
+		# Check for changed results.
+		if results is not self.results:
+			self.results = results
+			Finisher = Model.Rider.Finisher
+			isTimeTrial = race.isTimeTrial
+			riders = self.riders
+			finishers = set()
+			for rr in results:
+				if not rr.raceTimes or rr.status != Finisher:
+					continue
+				num = rr.num
+				finishers.add( num )
+				offset = (getattr(rr,'startTime',0.0) or 0.0) if isTimeTrial else 0.0
+				record = riders.get( num )
+				if (record is None or record.offset != offset or
+						not (record.raceTimes is rr.raceTimes or record.raceTimes == rr.raceTimes) or
+						not (record.interp is rr.interp or record.interp == rr.interp)):
+					self.setRider( num, rr.raceTimes, rr.interp, offset, tCur )
+			for num in [num for num in riders if num not in finishers]:
+				self.removeRider( num )
+		
+		# Recompute the riders whose next race time has passed.
+		transitions = self.transitions
+		due = set()
+		while transitions and transitions[0][0] <= tCur:
+			t, seq, num = heapq.heappop( transitions )
+			record = self.riders.get( num )
+			if record and record.seq == seq:
+				due.add( num )
+		for num in due:
+			record = self.riders[num]
+			self.setRider( num, record.raceTimes, record.interp, record.offset, tCur )
+	
+	def getExpected( self, count=None ):
+		return [e for k, e in (self.expected if count is None else self.expected[:count])]
+	
+	def getRecorded( self, count=None ):
+		return [e for k, e in (self.recorded if count is None else self.recorded[-count:])]
+
+arrivalIndex = ArrivalIndex()
+
 @Model.memoize
 def getExpectedRecorded( tCutoff=0.0 ):
 	race = Model.race
 	if not race:
+		arrivalIndex.reset()
 		return [], []
 	Entry = Model.Entry
 	Finisher = Model.Rider.Finisher
-	bisect_left = bisect.bisect_left
 	
 	tCur = race.lastRaceTime()
 	
@@ -54,40 +192,17 @@ def getExpectedRecorded( tCutoff=0.0 ):
 					expected.append( e )
 				else:
 					recorded.append( e )
-				
-	lapMin = 1
-	for rr in results:
-		if not rr.raceTimes or rr.status != Finisher:
-			continue
-		offset = (getattr(rr,'startTime',0.0) or 0.0) if race.isTimeTrial else 0.0
-		
-		i = bisect_left( rr.raceTimes, tCur - offset )
-		
-		# Get the next expected lap.  Consider that the rider could have been missed from the last lap.
-		try:
-			lap = i
-			if lap > 1 and rr.interp[lap-1] and rr.raceTimes[lap-1] + offset >= tCutoff:
-				lap -= 1
-			t = rr.raceTimes[lap] + offset if rr.interp[lap] else None
-		except IndexError:
-			t = None
-		if t is not None and lap >= lapMin:
-			expected.append( Entry(rr.num, lap, t, rr.interp[lap]) )
-		
-		# Get the last recorded lap.
-		try:
-			lap = i - 1
-			while lap > 0 and rr.interp[lap] and rr.raceTimes[lap-1] + offset >= tCutoff:
-				lap -= 1
-			t = rr.raceTimes[lap] + offset if (lap == 0 or not rr.interp[lap]) else None
-		except IndexError:
-			t = None
-		if t is not None and lap >= lapMin:
-			recorded.append( Entry(rr.num, lap, t, rr.interp[lap]) )
+	
+	arrivalIndex.update( race, results, tCur, tCutoff )
+	if not expected and not recorded:
+		return arrivalIndex.getExpected(), arrivalIndex.getRecorded()
 	
 	expected.sort( key=Entry.key )
 	recorded.sort( key=Entry.key )
-	return expected, recorded
+	return (
+		list( heapq.merge(expected, arrivalIndex.getExpected(), key=Entry.key) ),
+		list( heapq.merge(recorded, arrivalIndex.getRecorded(), key=Entry.key) ),
+	)
 	
 # Define columns for recorded and expected grids.
 iRecordedNumCol, iRecordedNoteCol, iRecordedTimeCol, iRecordedGapCol, iRecordedLapCol, iRecordedNameCol, iRecordedWaveCol, iRecordedColMax = range(8)
@@ -1,5 +1,5 @@
 import Model
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 from math import floor
 import re
 import six
@@ -8,6 +8,7 @@ import copy
 import Utils
 import itertools
 import operator
+import threading
 from datetime import timedelta, datetime
 from collections import deque, defaultdict
 
@@ -224,50 +225,15 @@ def FixPulled( riderResults, race, category ):
 	
 	riderResults[:] = riderResultsNew
 
-def _GetResultsCore( category ):
-	Finisher = Model.Rider.Finisher
-	PUL = Model.Rider.Pulled
-	NP = Model.Rider.NP
-	rankStatus = { Finisher, PUL }
-	
-	riderResults = []
-	race = Model.race
-	if not race:
-		return tuple()
-	
-	isRunning = race.isRunning()
+def _GetCategoryWinningTimesLaps( race, categoryTimesNums, getRiderEntries, category=None ):
 	isTimeTrial = race.isTimeTrial
-	
-	roadRaceFinishTimes = race.roadRaceFinishTimes
-	estimateLapsDownFinishTime = race.estimateLapsDownFinishTime
-	allCategoriesFinishAfterFastestRidersLastLap = race.allCategoriesFinishAfterFastestRidersLastLap
-	winAndOut = race.winAndOut
-	riders = race.riders
-	raceStartSeconds = (
-		race.startTime.hour*60.0*60.0 + race.startTime.minute*60.0 + race.startTime.second + race.startTime.microsecond / 1000000.0 if race.startTime
-		else Utils.StrToSeconds(race.scheduledStart) * 60.0
-	)
-	
-	entries = race.interpolate()
-	
-	# Group finish times are defined as times which are separated from the previous time by at least 1 second.
-	groupFinishTimes = [0 if not entries else floor(entries[0].t)]
-	if roadRaceFinishTimes and not isTimeTrial:
-		groupFinishTimes.extend( [floor(entries[i].t) for i in range(1, len(entries)) if entries[i].t - entries[i-1].t >= 1.0] )
-		groupFinishTimes.extend( [sys.float_info.max] * 5 )
-	
-	allRiderTimes = defaultdict( list )
-	for e in entries:
-		allRiderTimes[e.num].append( e )
-	
-	startOffset = category.getStartOffsetSecs() if category else 0.0
 	raceSeconds = race.minutes * 60.0
 	
 	# Enforce All Categories Finish After Fastest Rider's Last Lap
 	fastestRidersLastLapTime = None
-	if allCategoriesFinishAfterFastestRidersLastLap and not isTimeTrial:
+	if race.allCategoriesFinishAfterFastestRidersLastLap and not isTimeTrial:
 		resultBest = (0, sys.float_info.max)
-		for c, (times, nums) in six.iteritems(race.getCategoryTimesNums()):
+		for c, (times, nums) in six.iteritems(categoryTimesNums):
 			if not times:
 				continue
 			try:
@@ -283,7 +249,7 @@ def _GetResultsCore( category ):
 				
 	# Get the number of race laps for each category.
 	categoryWinningTime, categoryWinningLaps = {}, {}
-	for c, (times, nums) in six.iteritems(race.getCategoryTimesNums()):
+	for c, (times, nums) in six.iteritems(categoryTimesNums):
 		if category and c != category:
 			continue
 		
@@ -301,8 +267,7 @@ def _GetResultsCore( category ):
 				else:
 					winningLaps = bisect_left( times, raceSeconds, hi=len(times)-1 )
 					if winningLaps >= 2:
-						winner = riders[nums[winningLaps]]
-						entries = winner.interpolate()
+						entries = getRiderEntries( nums[winningLaps] )
 						if entries[winningLaps].interp:
 							lastLapTime = times[winningLaps] - times[winningLaps-1]
 							if (times[winningLaps] - raceSeconds) > lastLapTime / 2.0:
@@ -313,6 +278,53 @@ def _GetResultsCore( category ):
 				categoryWinningTime[c] = raceSeconds
 				categoryWinningLaps[c] = None
 	
+	return categoryWinningTime, categoryWinningLaps
+
+def _GetResultsCore( category, getRiderEntries=None, categoryTimesNums=None, categoryWinningTimesLaps=None ):
+	# If given, getRiderEntries, categoryTimesNums and categoryWinningTimesLaps must match what is computed from race.interpolate().
+	Finisher = Model.Rider.Finisher
+	PUL = Model.Rider.Pulled
+	NP = Model.Rider.NP
+	rankStatus = { Finisher, PUL }
+	
+	riderResults = []
+	race = Model.race
+	if not race:
+		return tuple()
+	
+	isRunning = race.isRunning()
+	isTimeTrial = race.isTimeTrial
+	
+	roadRaceFinishTimes = race.roadRaceFinishTimes
+	estimateLapsDownFinishTime = race.estimateLapsDownFinishTime
+	winAndOut = race.winAndOut
+	riders = race.riders
+	raceStartSeconds = (
+		race.startTime.hour*60.0*60.0 + race.startTime.minute*60.0 + race.startTime.second + race.startTime.microsecond / 1000000.0 if race.startTime
+		else Utils.StrToSeconds(race.scheduledStart) * 60.0
+	)
+	
+	# Group finish times are defined as times which are separated from the previous time by at least 1 second.
+	if roadRaceFinishTimes and not isTimeTrial:
+		entries = race.interpolate()
+		groupFinishTimes = [0 if not entries else floor(entries[0].t)]
+		groupFinishTimes.extend( [floor(entries[i].t) for i in range(1, len(entries)) if entries[i].t - entries[i-1].t >= 1.0] )
+		groupFinishTimes.extend( [sys.float_info.max] * 5 )
+	
+	if getRiderEntries is None:
+		allRiderTimes = defaultdict( list )
+		for e in race.interpolate():
+			allRiderTimes[e.num].append( e )
+		getRiderEntries = allRiderTimes.__getitem__
+	if categoryTimesNums is None:
+		categoryTimesNums = race.getCategoryTimesNums()
+	
+	raceSeconds = race.minutes * 60.0
+	
+	if categoryWinningTimesLaps is None:
+		categoryWinningTimesLaps = _GetCategoryWinningTimesLaps( race, categoryTimesNums, getRiderEntries, category )
+	categoryWinningTime, categoryWinningLaps = categoryWinningTimesLaps
+	
 	highPrecision = Model.highPrecisionTimes()
 	getCategory = race.getCategory
 	for rider in list(six.itervalues(race.riders)):
@@ -325,7 +337,7 @@ def _GetResultsCore( category ):
 		
 		cutoffTime = categoryWinningTime.get(riderCategory, raceSeconds)
 		
-		riderTimes = allRiderTimes[rider.num]
+		riderTimes = getRiderEntries( rider.num )
 		times = [e.t for e in riderTimes]
 		interp = [e.interp for e in riderTimes]
 		
@@ -540,6 +552,128 @@ def _GetResultsCore( category ):
 	
 	return tuple(riderResults)
 	
+class IncrementalResults( object ):
+	"""
+	Keeps per-rider interpolated entries and per-category results live between race changes.
+	
+	Race.setChanged records the bibs affected by each change in Model.raceChanges.
+	When only rider times were added or deleted, only those riders' categories are
+	re-ranked.  Any other change recomputes everything.
+	Results are the same as _GetResultsCore computed from race.interpolate().
+	"""
+	
+	def __init__( self ):
+		self.lock = Model.memoize.rlock		# Share the memoize lock to avoid lock order problems.
+		self.reset()
+	
+	def reset( self, race=None ):
+		self.race = race
+		self.serial = None
+		self.categoryTimesNums = {}		# wave category -> (leader times, leader nums)
+		self.categoryEntryTimes = {}	# wave category -> sorted times of all entries in the category.
+		self.categoryResults = {}		# category -> (key, results)
+		self.winningTimesLaps = None
+	
+	def update( self, race ):
+		changed = Model.raceChanges.since( self.serial ) if race is self.race else None
+		if changed is None:
+			self.reset( race )
+		elif changed:
+			getCategory = race.getCategory
+			for num in changed:
+				category = getCategory( num )
+				self.categoryTimesNums.pop( category, None )
+				self.categoryEntryTimes.pop( category, None )
+				self.categoryResults.pop( category, None )
+			self.categoryResults.pop( None, None )
+			self.winningTimesLaps = None
+		self.serial = Model.raceChanges.serial
+	
+	def getRiderEntries( self, num ):
+		# Rider.interpolate() caches its result until the rider changes.
+		return self.race.riders[num].interpolate()
+	
+	def getCategoryTimesNums( self ):
+		# Same as race.getCategoryTimesNums(), but only recomputed for categories that changed.
+		race = self.race
+		getCategory = race.getCategory
+		categoryNums = defaultdict( list )
+		for num in six.iterkeys(race.riders):
+			category = getCategory( num )
+			if category is not None and category not in self.categoryEntryTimes:
+				categoryNums[category].append( num )
+		
+		Model.Rider.interpolateRiders( race.riders[num] for nums in six.itervalues(categoryNums) for num in nums )
+		for category, nums in six.iteritems(categoryNums):
+			lapLeader = {}
+			entryTimes = []
+			for num in nums:
+				for e in self.getRiderEntries( num ):
+					entryTimes.append( e.t )
+					if e.lap and (e.lap not in lapLeader or (e.t, e.num) < lapLeader[e.lap]):
+						lapLeader[e.lap] = (e.t, e.num)
+			entryTimes.sort()
+			self.categoryEntryTimes[category] = entryTimes
+			
+			times, nums = [0.0], [None]
+			for lap in six.moves.range(1, len(lapLeader)+1):
+				t, num = lapLeader[lap]
+				times.append( t )
+				nums.append( num )
+			if len(times) > 1:
+				self.categoryTimesNums[category] = (times, nums)
+			else:
+				self.categoryTimesNums.pop( category, None )
+		
+		return self.categoryTimesNums
+	
+	def getWinningTimesLaps( self ):
+		if self.winningTimesLaps is None:
+			self.winningTimesLaps = _GetCategoryWinningTimesLaps( self.race, self.getCategoryTimesNums(), self.getRiderEntries )
+		return self.winningTimesLaps
+		
+	def getKey( self, category ):
+		race = self.race
+		categoryWinningTime, categoryWinningLaps = self.getWinningTimesLaps()
+		categories = [category] if category else sorted( self.categoryEntryTimes, key=Model.Category.key )
+		key = [race.isRunning()]
+		key.extend( (categoryWinningTime.get(c), categoryWinningLaps.get(c)) for c in categories )
+		if race.isRunning():
+			# Results while running depend on which recorded times are before the current race time.
+			t = race.curRaceTime()
+			key.extend( bisect_right(self.categoryEntryTimes.get(c, []), t) for c in categories )
+		if race.roadRaceFinishTimes and not race.isTimeTrial:
+			# Group finish times depend on every rider in the race.
+			key.append( self.serial )
+		return tuple( key )
+	
+	def getResults( self, category ):
+		race = Model.race
+		if not race:
+			return tuple()
+		with self.lock:
+			self.update( race )
+			key = self.getKey( category )
+			try:
+				keyCached, results = self.categoryResults[category]
+				if keyCached == key:
+					return results
+			except KeyError:
+				pass
+			results = _GetResultsCore( category, self.getRiderEntries, self.getCategoryTimesNums(), self.getWinningTimesLaps() )
+			self.categoryResults[category] = (key, results)
+			return results
+	
+	def getCached( self, category ):
+		''' Returns the results last computed for the category, or None.  The tuple is replaced whenever the results change. '''
+		with self.lock:
+			try:
+				return self.categoryResults[category][1]
+			except KeyError:
+				return None
+
+incrementalResults = IncrementalResults()
+
 def GetNonWaveCategoryResults( category ):
 	race = Model.race
 	if not race:
@@ -640,7 +774,7 @@ def GetResultsWithData( category ):
 		if singleCategory:
 			return GetResults( singleCategory )
 
-	riderResults = _GetResultsCore( category )
+	riderResults = incrementalResults.getResults( category )
 	
 	# Add the linked external data.
 	try:
@@ -656,6 +790,8 @@ def GetResultsWithData( category ):
 	if not excelLink or not riderResults:
 		return riderResults
 	
+	# Don't change the cached results.
+	riderResults = tuple( copy.copy(rr) for rr in riderResults )
 	for rr in riderResults:
 		for f in externalFields:
 			try:
@@ -705,12 +841,9 @@ def GetResultsWithData( category ):
 	return riderResults
 
 def GetResults( category ):
-	# If the spreadsheet changed, clear the cache to update the results with new data.
+	# If the spreadsheet changed, ExcelLink.read clears the cache to update the results with new data.
 	try:
-		excelLink = Model.race.excelLink
-		externalInfo = excelLink.read()
-		if excelLink.readFromFile:
-			Model.resetCache()
+		Model.race.excelLink.read()
 	except Exception as e:
 		pass
 		
@@ -955,17 +1088,31 @@ def GetCategoryDetails( ignoreEmptyCategories=True, publishOnly=False ):
 
 	return catDetails
 
-def GetAnimationData( category=None, getExternalData=False ):
+def GetAnimationData( category=None, getExternalData=False, cache=None ):
+	'''
+		If given, cache is category -> (results, animation data) from the previous call.
+		The data of a category is reused while incrementalResults has not replaced its results.
+	'''
 	animationData = {}
 	ignoreFields = {'pos', 'num', 'gap', 'gapValue', 'laps', 'lapTimes', 'full_name', 'short_name'}
 	statusNames = Model.Rider.statusNames
+	cacheNew = {}
 	
 	with UnstartedRaceWrapper( getExternalData ):
-		with Model.LockRace() as race:
+		with Model.LockRace() as race, incrementalResults.lock:
 			riders = race.riders
 			for cat in ([category] if category else race.getCategories()):
 				results = GetResults( cat )
 				
+				source = incrementalResults.getCached( cat )
+				if cache is not None and source is not None:
+					sourceCached, data = cache.get( cat, (None, None) )
+					if sourceCached is source:
+						cacheNew[cat] = (source, data)
+						animationData.update( data )
+						continue
+				
+				data = {}
 				for rr in results:
 					info = {
 						'flr': race.getCategory(rr.num).firstLapRatio,
@@ -989,8 +1136,15 @@ def GetAnimationData( category=None, getExternalData=False ):
 						else:
 							info[a] = getattr( rr, a )
 					
-					animationData[rr.num] = info
-		
+					data[rr.num] = info
+				
+				if source is not None:
+					cacheNew[cat] = (source, data)
+				animationData.update( data )
+	
+	if cache is not None:
+		cache.clear()
+		cache.update( cacheNew )
 	return animationData
 
 def GetRaceName():
@@ -999,6 +1153,14 @@ def GetRaceName():
 versionCountStart = 10000
 versionCount = versionCountStart
 resultsBaseline = { 'cmd': 'baseline', 'categoryDetails':{}, 'info':{}, 'reference':{} }
+
+# Recent RAM updates, so a client that reconnects can get the versions it missed instead of a new baseline.
+ramHistoryMax = 64
+ramHistory = deque( maxlen=ramHistoryMax )
+
+# The RAM updates are computed on the ResultsPublisher thread and read from the WebSocket thread.
+ramLock = threading.RLock()
+animationDataCache = {}
 def getReferenceInfo():
 	global versionCount
 	race = Model.race
@@ -1018,11 +1180,13 @@ def getReferenceInfo():
 
 def ResetVersionRAM():
 	global versionCountStart, versionCount
-	# If we decrease the versionCountStart, nothing can have a version + 1.
-	versionCountStart -= 100
-	if versionCountStart <= 0:
-		versionCountStart = 10000
-	versionCount = versionCountStart
+	with ramLock:
+		# If we decrease the versionCountStart, nothing can have a version + 1.
+		versionCountStart -= 100
+		if versionCountStart <= 0:
+			versionCountStart = 10000
+		versionCount = versionCountStart
+		ramHistory.clear()
 	
 def GetResultsRAM():
 	global versionCount, resultsBaseline
@@ -1032,35 +1196,55 @@ def GetResultsRAM():
 		return None
 	
 	categoryDetails = { c['name']:c for c in GetCategoryDetails(True, True) }
-	info = GetAnimationData( None, True )
+	# Only the categories with new results are converted.  The others keep the same info dicts, so comparing them is quick.
+	info = GetAnimationData( None, True, animationDataCache )
 	raceName = GetRaceName()
 	
-	if (	resultsBaseline['info'] == info and
-			resultsBaseline['categoryDetails'] == categoryDetails and
-			resultsBaseline['reference'].get('raceIsRunning',None) == race.isRunning() and
-			resultsBaseline['reference'].get('raceIsUnstarted',None) == race.isUnstarted() and
-			resultsBaseline['reference'].get('raceName',None) == raceName and
-			resultsBaseline['reference'].get('raceStartTime',None) == race.startTime
-		):
-		return None
+	with ramLock:
+		if (	resultsBaseline['info'] == info and
+				resultsBaseline['categoryDetails'] == categoryDetails and
+				resultsBaseline['reference'].get('raceIsRunning',None) == race.isRunning() and
+				resultsBaseline['reference'].get('raceIsUnstarted',None) == race.isUnstarted() and
+				resultsBaseline['reference'].get('raceName',None) == raceName and
+				resultsBaseline['reference'].get('raceStartTime',None) == race.startTime
+			):
+			return None
 
-	versionCount += 1
-	resultsBaseline['reference'] = getReferenceInfo()
+		versionCount += 1
+		resultsBaseline['reference'] = getReferenceInfo()
 
-	ram = {
-		'cmd':			'ram',
-		'categoryRAM':	Utils.dict_compare( categoryDetails, resultsBaseline['categoryDetails'] ),
-		'infoRAM':		Utils.dict_compare( info, resultsBaseline['info'] ),
-		'reference':    resultsBaseline['reference'],
-	}
-	
-	resultsBaseline['categoryDetails'] = categoryDetails
-	resultsBaseline['info'] = info	
-	return ram
+		ram = {
+			'cmd':			'ram',
+			'categoryRAM':	Utils.dict_delta( categoryDetails, resultsBaseline['categoryDetails'] ),
+			'infoRAM':		Utils.dict_delta( info, resultsBaseline['info'] ),
+			'reference':    resultsBaseline['reference'],
+		}
+		
+		resultsBaseline['categoryDetails'] = categoryDetails
+		resultsBaseline['info'] = info	
+		ramHistory.append( ram )
+		return ram
 	
 def GetResultsBaseline():
-	resultsBaseline['reference'] = getReferenceInfo()
-	return resultsBaseline
+	with ramLock:
+		resultsBaseline['reference'] = getReferenceInfo()
+		return dict( resultsBaseline )		# The publisher replaces the values rather than changing them.
+
+def GetResultsSince( version ):
+	'''
+		Returns the RAM updates after version, oldest first, or None if they are no longer available
+		and the client needs a baseline.
+	'''
+	raceName = GetRaceName()
+	with ramLock:
+		if version == versionCount:
+			return [] if resultsBaseline['reference'].get('raceName',None) == raceName else None
+		rams = list( ramHistory )
+	for i, ram in enumerate(rams):
+		if ram['reference']['versionCount'] == version + 1:
+			rams = rams[i:]
+			return rams if all( r['reference']['raceName'] == raceName for r in rams ) else None
+	return None
 	
 @Model.memoize
 def GetResultMap( category ):
@@ -0,0 +1,202 @@
+import itertools
+
+try:
+	import numpy as np
+	enabled = True
+except ImportError:
+	enabled = False
+
+#------------------------------------------------------------------------------
+# Vectorized version of Rider.getCleanLapTimes, Rider.getExpectedLapTime and the
+# autocorrect path of Rider._interpolate for many riders at once.
+#
+# The riders' times are concatenated into one array and processed segment by segment
+# with the same floating point operations as the scalar code, so the results are identical.
+
+minRiders = 16		# Below this, the scalar code is faster.
+
+def segmentIds( counts ):
+	return np.repeat( np.arange(len(counts)), counts )
+
+def segmentStarts( counts ):
+	starts = np.zeros( len(counts), dtype=np.int64 )
+	np.cumsum( counts[:-1], out=starts[1:] )
+	return starts
+
+def Interpolate( timesList, startOffsets, mustBeRepeatIntervals, categoryLaps, firstLapRatios, stopTimes, dnfPulledTimes, pMin, pMax, entriesMax ):
+	'''
+		Returns a list of iTimes [(t, interp), ...] for each rider, or None if the rider must
+		be done by the scalar code.
+
+		timesList:				sorted race times of each rider (must not be empty).
+		startOffsets:			start offset of each rider's wave.
+		mustBeRepeatIntervals:	repeat reads closer than this are ignored.
+		categoryLaps:			category laps (0 if none).
+		firstLapRatios:			first lap distance ratio (1.0 if none).
+		stopTimes:				stop time of each rider (already limited by the DNF/Pulled time).
+		dnfPulledTimes:			DNF/Pulled time of each rider, or None.
+	'''
+	n = len(timesList)
+	results = [[] for i in range(n)]
+	if not n:
+		return results
+
+	counts = np.fromiter( (len(times) for times in timesList), dtype=np.int64, count=n )
+	startOffsets = np.asarray( startOffsets, dtype=np.float64 )
+	rep = np.asarray( mustBeRepeatIntervals, dtype=np.float64 )
+	categoryLaps = np.asarray( categoryLaps, dtype=np.int64 )
+	firstLapRatios = np.asarray( firstLapRatios, dtype=np.float64 )
+	stopTimes = np.asarray( stopTimes, dtype=np.float64 )
+	dnf = np.array( [np.inf if t is None else t for t in dnfPulledTimes], dtype=np.float64 )
+
+	#-----------------------------------------------------------------------
+	# Clean lap times: start offset followed by the times further than the repeat interval from the previous one kept.
+	yCounts = counts + 1
+	yStarts = segmentStarts( yCounts )
+	ySeg = segmentIds( yCounts )
+	y = np.empty( int(yCounts.sum()), dtype=np.float64 )
+	isStart = np.zeros( len(y), dtype=bool )
+	isStart[yStarts] = True
+	y[yStarts] = startOffsets
+	y[~isStart] = np.fromiter( itertools.chain.from_iterable(timesList), dtype=np.float64, count=int(counts.sum()) )
+
+	keep = np.ones( len(y), dtype=bool )
+	keep[1:] = y[1:] - y[:-1] > rep[ySeg[1:]]
+	keep[yStarts] = True
+
+	# Where a time was dropped, the following times must be compared to the last one kept.
+	for r in np.unique( ySeg[~keep] ).tolist():
+		s, e = yStarts[r], yStarts[r] + yCounts[r]
+		seg = y[s:e].tolist()
+		interval = rep[r]
+		last = seg[0]
+		segKeep = [True]
+		for t in seg[1:]:
+			k = t - last > interval
+			segKeep.append( k )
+			if k:
+				last = t
+		keep[s:e] = segKeep
+
+	# Limit to the category laps.
+	rank = np.cumsum( keep ) - np.repeat( np.concatenate(([0], np.cumsum(keep)[yStarts[1:] - 1])), yCounts )
+	maxLen = np.where( categoryLaps > 0, categoryLaps, 999999 ) + 1
+	keep &= rank <= maxLen[ySeg]
+
+	c = y[keep]
+	cSeg = ySeg[keep]
+	cCounts = np.bincount( cSeg, minlength=n )
+
+	valid = cCounts >= 2
+	validMask = valid[cSeg]
+	c = c[validMask]
+	cSeg = cSeg[validMask]
+	riders = np.nonzero( valid )[0]
+	if not len(riders):
+		return results
+	m = cCounts[riders]
+	rIndex = np.full( n, -1, dtype=np.int64 )
+	rIndex[riders] = np.arange( len(riders) )
+	cSeg = rIndex[cSeg]
+	cStarts = segmentStarts( m )
+	pos = np.arange( len(c) ) - cStarts[cSeg]		# Position within the rider's times.
+
+	#-----------------------------------------------------------------------
+	# Expected lap time: median of the lap times ignoring the first lap (first lap adjusted by distance if only one).
+	expected = np.empty( len(riders), dtype=np.float64 )
+	two = m == 2
+	expected[two] = (c[cStarts[two] + 1] - c[cStarts[two]]) / firstLapRatios[riders[two]]
+
+	dMask = pos >= 2
+	d = c[1:] - c[:-1]
+	dMask = dMask[1:]
+	dVals = d[dMask]
+	dSeg = cSeg[1:][dMask]
+	order = np.lexsort( (dVals, dSeg) )
+	dSorted = dVals[order]
+	q = m - 2
+	more = q > 0
+	qStarts = segmentStarts( q )
+	mid = qStarts + q // 2
+	odd = (q & 1) == 1
+	oddMore = more & odd
+	evenMore = more & ~odd
+	expected[oddMore] = dSorted[mid[oddMore]]
+	expected[evenMore] = (dSorted[mid[evenMore] - 1] + dSorted[mid[evenMore]]) / 2.0
+
+	# Leave anything unusual to the scalar code.
+	ok = np.isfinite( expected ) & (expected > 0.0)
+
+	#-----------------------------------------------------------------------
+	# Fill missing laps: an interval of about 2 or 3 expected laps gets 1 or 2 interpolated times.
+	e = expected[cSeg[1:]]
+	fill = np.zeros( len(c), dtype=np.int64 )
+	interior = pos[1:] >= 1
+	m1 = interior & (e * 1.0 + e * pMin < d) & (d < e * 1.0 + e * pMax)
+	m2 = interior & ~m1 & (e * 2.0 + e * pMin < d) & (d < e * 2.0 + e * pMax)
+	fill[1:][m1] = 1
+	fill[1:][m2] = 2
+
+	fillCum = np.cumsum( fill )
+	outIndex = np.arange( len(c) ) + fillCum
+	out1Len = len(c) + int(fillCum[-1])
+	v1 = np.empty( out1Len, dtype=np.float64 )
+	f1 = np.zeros( out1Len, dtype=bool )
+	v1[outIndex] = c
+
+	src = np.repeat( np.arange(len(c)), fill )
+	if len(src):
+		groupStarts = np.repeat( fillCum - fill, fill )
+		j = np.arange( len(src) ) - groupStarts + 1
+		tStart = c[src - 1]
+		interp = (c[src] - tStart) / (fill[src] + 1.0)
+		fillIndex = outIndex[src] - fill[src] + j - 1
+		v1[fillIndex] = tStart + interp * j
+		f1[fillIndex] = True
+
+	seg1 = np.repeat( cSeg, fill + 1 )
+	counts1 = np.bincount( seg1, minlength=len(riders) )
+
+	#-----------------------------------------------------------------------
+	# Pad out to one entry exceeding the stop time.
+	ends1 = segmentStarts( counts1 ) + counts1 - 1
+	tLast = v1[ends1]
+	st = stopTimes[riders]
+	pad = (tLast < st) & (counts1 < entriesMax) & ok
+	tBegin = tLast + expected
+	with np.errstate( invalid='ignore', divide='ignore' ):
+		iMax = np.trunc( np.ceil(st - tBegin) / expected )
+	iMax = np.where( pad, iMax, 0.0 )
+	iMax = np.maximum( 1, iMax.astype(np.int64) )
+	iMax = np.minimum( iMax, entriesMax - counts1 )
+	iMax[~pad] = 0
+
+	counts2 = counts1 + iMax
+	starts2 = segmentStarts( counts2 )
+	v2 = np.empty( int(counts2.sum()), dtype=np.float64 )
+	f2 = np.ones( len(v2), dtype=bool )
+	index1 = np.arange( len(v1) ) - segmentStarts( counts1 )[seg1] + starts2[seg1]
+	v2[index1] = v1
+	f2[index1] = f1
+	padSeg = np.repeat( np.arange(len(riders)), iMax )
+	if len(padSeg):
+		i = np.arange( len(padSeg) ) - segmentStarts( iMax )[padSeg]
+		v2[starts2[padSeg] + counts1[padSeg] + i] = tBegin[padSeg] + expected[padSeg] * i
+
+	#-----------------------------------------------------------------------
+	# Remove entries after the DNF/Pulled time.
+	seg2 = np.repeat( np.arange(len(riders)), counts2 )
+	keep2 = v2 <= dnf[riders][seg2]
+	counts3 = np.bincount( seg2[keep2], minlength=len(riders) )
+	v3 = v2[keep2].tolist()
+	f3 = f2[keep2].tolist()
+
+	k = 0
+	for ri, r in enumerate(riders.tolist()):
+		count = int(counts3[ri])
+		if not ok[ri]:
+			results[r] = None
+		elif count >= 2:
+			results[r] = list( zip(v3[k:k+count], f3[k:k+count]) )
+		k += count
+	return results
@@ -27,6 +27,7 @@ import platform
 import zipfile
 import base64
 import hashlib
+import uuid
 from six.moves.urllib.parse import quote
 from collections import defaultdict
 
@@ -68,6 +69,7 @@ from UnmatchedTagsGantt	import UnmatchedTagsGantt
 import FtpWriteFile
 from FtpWriteFile		import realTimeFtpPublish
 from SetAutoCorrect		import SetAutoCorrectDialog
+from CacheStats			import CacheStatsDialog
 from DNSManager			import DNSManagerDialog
 from USACExport			import USACExport
 from UCIExport			import UCIExport
@@ -94,6 +96,10 @@ import AlienImport
 import ImpinjImport
 import IpicoImport
 import OutputStreamer
+import RaceJournal
+import ChipIngest
+from TagResolver import tagResolver
+from RaceWriter import raceWriter
 import GpxImport
 from Undo import undo
 from Printing			import CrossMgrPrintout, CrossMgrPrintoutPNG, CrossMgrPrintoutPDF, CrossMgrPodiumPrintout, getRaceCategories
@@ -738,6 +744,9 @@ class MainWin( wx.Frame ):
 
 		item = self.toolsMenu.Append( wx.ID_ANY, _("&Reload Checklist..."), _("Reload the Checklist from the Checklist File") )
 		self.Bind(wx.EVT_MENU, self.menuReloadChecklist, item )
+
+		item = self.toolsMenu.Append( wx.ID_ANY, _("Cache S&tatistics..."), _("Show the Cache Statistics of the Results Calculations") )
+		self.Bind(wx.EVT_MENU, self.menuCacheStats, item )
 		
 		self.toolsMenu.AppendSeparator()
 		item = self.toolsMenu.Append( wx.ID_ANY, _("&Playback..."), _("Playback this race from original data.") )
@@ -752,9 +761,16 @@ class MainWin( wx.Frame ):
 		
 		item = self.menuItemPlaySounds = self.optionsMenu.Append( wx.ID_ANY, _("&Play Sounds"), _("Play Sounds"), wx.ITEM_CHECK )
 		self.playSounds = self.config.ReadBool('playSounds', True)
+		raceWriter.fsync = self.config.ReadBool('fsyncRaceFile', False)
+		raceWriter.minInterval = self.config.ReadDouble('raceWriteIntervalSeconds', raceWriter.minInterval)
 		self.menuItemPlaySounds.Check( self.playSounds )
 		self.Bind( wx.EVT_MENU, self.menuPlaySounds, item )
 		
+		item = self.menuItemCompactTimes = self.optionsMenu.Append( wx.ID_ANY, _("Compact Rider &Times"), _("Store Rider Times compactly (for very long races and large fields)"), wx.ITEM_CHECK )
+		Model.Rider.compactTimes = self.config.ReadBool('compactRiderTimes', False)
+		self.menuItemCompactTimes.Check( Model.Rider.compactTimes )
+		self.Bind( wx.EVT_MENU, self.menuCompactTimes, item )
+		
 		item = self.menuItemSyncCategories = self.optionsMenu.Append( wx.ID_ANY, _("Sync &Categories between Tabs"), _("Sync Categories between Tabs"), wx.ITEM_CHECK )
 		self.Bind( wx.EVT_MENU, self.menuSyncCategories, item )
 		
@@ -894,14 +910,17 @@ class MainWin( wx.Frame ):
 		if not race.tagNums:
 			return
 		
+		tagResolver.setTagNums( race.tagNums )
 		requests = []
 		for tag, dt in event.tagTimes:
 			if race.startTime > dt:
 				continue
 			
 			try:
-				num = race.tagNums[tag]
-			except (KeyError, TypeError, ValueError):
+				num = tagResolver.resolve( tag )
+			except (TypeError, ValueError, AttributeError):
+				continue
+			if num is None:
 				continue
 			
 			requests.append( (num, (dt - race.startTime).total_seconds()) )
@@ -1112,6 +1131,16 @@ class MainWin( wx.Frame ):
 		self.playSounds = self.menuItemPlaySounds.IsChecked()
 		self.config.WriteBool( 'playSounds', self.playSounds )
 		
+	def menuCompactTimes( self, event ):
+		compact = self.menuItemCompactTimes.IsChecked()
+		self.config.WriteBool( 'compactRiderTimes', compact )
+		with Model.LockRace() as race:
+			if race:
+				race.setCompactTimes( compact )
+				race.setChanged()
+			else:
+				Model.Rider.compactTimes = compact
+		
 	def menuLaunchExcelAfterPublishingResults( self, event ):
 		self.launchExcelAfterPublishingResults = self.menuItemLaunchExcelAfterPublishingResults.IsChecked()
 		self.config.WriteBool( 'launchExcelAfterPublishingResults', self.launchExcelAfterPublishingResults )
@@ -1386,6 +1415,11 @@ class MainWin( wx.Frame ):
 			pass
 		self.refresh()
 	
+	def menuCacheStats( self, event ):
+		dlg = CacheStatsDialog( self )
+		dlg.ShowModal()
+		dlg.Destroy()
+	
 	def getGraphicFName( self ):
 		defaultFName = os.path.join(Utils.getImageFolder(), 'CrossMgrHeader.png')
 		graphicFName = self.config.Read( 'graphic', defaultFName )
@@ -2523,7 +2557,7 @@ class MainWin( wx.Frame ):
 		if race:
 			try:
 				race.resetAllCaches()
-				self.writeRace()
+				self.writeRace( wait=True )
 				Model.writeModelUpdate()
 				self.config.Flush()
 			except Exception as e:
@@ -2555,14 +2589,32 @@ class MainWin( wx.Frame ):
 		self.doCleanup()
 		wx.Exit()
 
-	def writeRace( self, doCommit = True ):
+	def getJournal( self, race ):
+		# Returns the journal of the current race file, and whether it was just created.
+		journal = Model.journal
+		if journal and journal.race is race and journal.raceFileName == self.fileName:
+			return journal, False
+		if journal:
+			journal.close()
+		if not race.journalId:
+			race.journalId = uuid.uuid4().hex
+		race.journalSeq = 0
+		Model.journal = RaceJournal.RaceJournal( self.fileName, race )
+		return Model.journal, True
+	
+	def writeRace( self, doCommit = True, snapshot = True, wait = False ):
 		if doCommit:
 			self.commit()
 		with Model.LockRace() as race:
-			if race is not None:
-				with open(self.fileName, 'wb') as fp:
-					pickle.dump( race, fp, 2 )
-				race.setChanged( False )
+			if race is None:
+				return
+			journal, isNew = self.getJournal( race )
+			if snapshot or isNew or race.snapshotRequired or journal.needsCompact():
+				# The snapshot is written in the background.  Its journal records are dropped after it is on disk.
+				raceWriter.write( self.fileName, race, journal )
+			race.setChanged( False )
+		if wait:
+			raceWriter.flush()
 
 	def setActiveCategories( self ):
 		with Model.LockRace() as race:
@@ -2913,7 +2965,7 @@ class MainWin( wx.Frame ):
 		self.refresh()
 		Model.resetCache()
 		ResetExcelLinkCache()
-		self.writeRace()
+		self.writeRace( wait=True )
 		Model.writeModelUpdate()
 		self.closeFindDialog()
 		
@@ -2927,10 +2979,17 @@ class MainWin( wx.Frame ):
 					fp.seek( 0 )
 					race = ModuleUnpickler( fp, module='CrossMgr', encoding='latin1', errors='replace' ).load()
 				race.sortLap = None			# Remove results lap sorting to avoid confusion.
+				records = RaceJournal.ReadRecords( fileName, race )
+				if records:
+					RaceJournal.Replay( race, records )
+					Utils.writeLog( u'openRace: replayed {} journal records'.format(len(records)) )
 				isFinished = race.isFinished()
 				race.tagNums = None
 				race.resetAllCaches()
 				race.lastOpened = now()
+				if Model.journal:
+					Model.journal.close()
+				Model.journal = RaceJournal.RaceJournal( fileName, race, records ) if race.journalId else None
 				Model.setRace( race )
 			
 			ChipReader.chipReaderCur.reset( race.chipReaderType )
@@ -3129,6 +3188,7 @@ class MainWin( wx.Frame ):
 			isTimeTrial = False
 
 		# Delete any pre-existing Simulation directory.
+		raceWriter.flush()
 		try:
 			shutil.rmtree( simulationDir, ignore_errors=True )
 		except:
@@ -3901,10 +3961,8 @@ Computers fail, screw-ups happen.  Always use a manual backup.
 			return False
 		
 		race = Model.race
-		
-		for num, t in self.numTimes:
-			race.addTime( num, t, doSetChanged=False )
-		race.setChanged()
+		with undo.recordingReads():
+			race.addTimes( self.numTimes )
 		
 		OutputStreamer.writeNumTimes( self.numTimes )
 		
@@ -3946,24 +4004,7 @@ Computers fail, screw-ups happen.  Always use a manual backup.
 		if not race.tagNums:
 			return False
 		
-		for d in data:
-			if d[0] != 'data':
-				continue
-			tag = d[1]
-			dt = d[2]
-			try:
-				num = race.tagNums[tag]
-			except KeyError:
-				if race.isRunning() and race.startTime <= dt:
-					race.addUnmatchedTag( tag, (dt - race.startTime).total_seconds() )
-				continue
-			except (TypeError, ValueError):
-				race.missingTags.add( tag )
-				continue
-				
-			# Only process times after the start of the race.
-			if race.isRunning() and race.startTime <= dt:
-				self.numTimes.append( (num, (dt - race.startTime).total_seconds()) )
+		self.numTimes.extend( ChipIngest.ResolveTags(race, data) )
 		
 		# Ensure that we don't update too often if riders arrive in a bunch.
 		if not self.callLaterProcessRfidRefresh:
@@ -4041,7 +4082,7 @@ Computers fail, screw-ups happen.  Always use a manual backup.
 
 		self.secondCount += 1
 		if self.secondCount % 45 == 0 and race.isChanged():
-			self.writeRace()
+			self.writeRace( snapshot=False )
 			
 		if doRefresh:
 			self.nonBusyRefresh()
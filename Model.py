@@ -17,11 +17,13 @@ import functools
 import operator
 import traceback
 import threading
+from array import array
 from os.path import commonprefix
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 
 import Utils
 import Version
+import InterpolateBatch
 from BatchPublishAttrs import setDefaultRaceAttr
 import minimal_intervals
 from InSortedIntervalList import InSortedIntervalList
@@ -40,36 +42,77 @@ class memoize(object):
 	If called later with the same arguments, the cached value is returned, and
 	not re-evaluated.
 	
+	The cached functions depend on the times, categories and status of the race, so any change
+	to the race clears all of them.  Within a race version, each function keeps at most maxEntries
+	values and evicts the least recently used.
+	Hits, misses, evictions and recompute time are counted per function (see getStats).
+	
 	Does NOT work with kwargs.
 	"""
-   
-	cache = {}
+	
+	maxEntriesDefault = 256
+	
+	registry = []
 	rlock = threading.RLock()
 	
 	@classmethod
 	def clear( cls ):
-		cls.cache = {}
-   
-	def __init__(self, func):
+		with cls.rlock:
+			for m in cls.registry:
+				m.cache.clear()
+	
+	@classmethod
+	def getStats( cls ):
+		''' Return (name, entries, hits, misses, evictions, recomputeSeconds) for each function. '''
+		with cls.rlock:
+			return [
+				(m.name, len(m.cache), m.hits, m.misses, m.evictions, m.recomputeSeconds)
+				for m in cls.registry
+			]
+	
+	@classmethod
+	def resetStats( cls ):
+		with cls.rlock:
+			for m in cls.registry:
+				m.hits = m.misses = m.evictions = 0
+				m.recomputeSeconds = 0.0
+	
+	def __init__(self, func, maxEntries = None):
 		# print( 'memoize:', func.__name__ )
 		self.func = func
+		self.name = u'{}.{}'.format( func.__module__, func.__name__ )
+		self.maxEntries = maxEntries or self.maxEntriesDefault
+		self.cache = OrderedDict()
+		self.hits = self.misses = self.evictions = 0
+		self.recomputeSeconds = 0.0
+		with self.rlock:
+			memoize.registry.append( self )
 		
 	def __call__(self, *args):
 		# print( self.func.__name__, args )
-		try:
-			return memoize.cache[self.func.__name__][args]
-		except KeyError:
-			with self.rlock:
-				value = self.func(*args)
-				memoize.cache.setdefault(self.func.__name__, {})[args] = value
+		cache = self.cache
+		with self.rlock:
+			try:
+				value = cache[args]
+				self.hits += 1
+				cache.move_to_end( args )
 				return value
-		except TypeError:
-			with self.rlock:
+			except KeyError:
+				pass
+			except TypeError:
 				# uncachable -- for instance, passing a list as an argument.
 				# Better to not cache than to blow up entirely.
 				return self.func(*args)
-		with self.rlock:
-			return self.func(*args)
+			
+			self.misses += 1
+			tStart = time.time()
+			value = self.func(*args)
+			self.recomputeSeconds += time.time() - tStart
+			cache[args] = value
+			while len(cache) > self.maxEntries:
+				cache.popitem( last=False )
+				self.evictions += 1
+			return value
 			
 	def __repr__(self):
 		"""Return the function's docstring."""
@@ -79,29 +122,78 @@ class memoize(object):
 		"""Support instance methods."""
 		return functools.partial(self.__call__, obj)
 
+#------------------------------------------------------------------------------
+class RaceChanges(object):
+	"""
+	Records which riders were touched by each change to the race.
+	
+	Consumers remember the last serial they have seen and call since() to get
+	the bibs changed after it.  None means "assume everything changed".
+	Listeners are called after each change on the thread that made it, and must return quickly.
+	"""
+	
+	logMax = 512
+	
+	def __init__( self ):
+		self.serial = 0
+		self.fullSerial = 0		# Serial of the last change that was not limited to specific riders.
+		self.log = deque( maxlen=self.logMax )
+		self.listeners = []
+		
+	def record( self, nums=None ):
+		self.serial += 1
+		if nums is None:
+			self.fullSerial = self.serial
+		self.log.append( (self.serial, frozenset(nums) if nums is not None else None) )
+		for listener in self.listeners:
+			listener()
+		
+	def since( self, serial ):
+		if serial == self.serial:
+			return set()
+		if serial is None or not self.log or self.log[0][0] > serial + 1:
+			return None
+		changed = set()
+		for s, nums in self.log:
+			if s <= serial:
+				continue
+			if nums is None:
+				return None
+			changed |= nums
+		return changed
+
+raceChanges = RaceChanges()
+
 #------------------------------------------------------------------------------
 # Define a global current race.
 race = None
 
+# RaceJournal of the current race file (set by the main window).
+journal = None
+
+# Functions called with (race, op, num, t) after the journal for each Race.addTime (op 'a') and Race.deleteTime (op 'd').
+timeOpListeners = []
+
 def getRace():
 	global race
 	return race
 
 def newRace():
 	global race
-	memoize.clear()
+	resetCache()
 	race = Race()
 	return race
 
 def setRace( r ):
 	global race
-	memoize.clear()
+	resetCache()
 	race = r
 	if race:
 		race.setChanged()
 
 def resetCache():
 	memoize.clear()
+	raceChanges.record()
 
 class LockRace:
 	def __enter__(self):
@@ -600,14 +692,30 @@ class Rider(object):
 	pulledLapsToGo = None
 	pulledSequence = None
 	
+	version = 0						# Incremented when the rider's times or status change.  Not pickled.
+	
+	compactTimes = False			# If True, store times in array('d') in memory.  They are always pickled as a list (see __getstate__).
+	
 	def __init__( self, num ):
 		self.num = num
 		self.times = []
 		self.status = Rider.Finisher
 		self.tStatus = None
 	
+	@property
+	def times( self ):
+		return self._times
+	
+	@times.setter
+	def times( self, times ):
+		if self.compactTimes:
+			self._times = array( 'd', times )
+		else:
+			self._times = list(times) if isinstance(times, array) else times
+	
 	def clearCache( self ):
-		for attr in ('_iTimesLast', '_entriesLast'):
+		self.version += 1
+		for attr in ('_iTimesLast', '_entriesLast', '_interpolateLast'):
 			try:
 				delattr( self, attr )
 			except AttributeError:
@@ -629,19 +737,31 @@ class Rider(object):
 		state = self.__dict__.copy()		
 		state.pop( '_iTimesLast', None )
 		state.pop( '_entriesLast', None )
+		state.pop( '_interpolateLast', None )
+		state.pop( 'version', None )
+		# Always pickle times as a list so the file can be read without compact times.
+		times = state.pop( '_times', [] )
+		state['times'] = times.tolist() if isinstance(times, array) else times
 		return state
+	
+	def __setstate__( self, state ):
+		times = state.pop( 'times', [] )
+		self.__dict__.update( state )
+		self.times = times
 
 	def __repr__( self ):
 		return u'{} ({})'.format( self.num, self.statusNames[self.status] )
 		
 	def setAutoCorrect( self, on = True ):
 		self.autocorrectLaps = on
+		self.version += 1
 		
 	def addTime( self, t ):
 		# All times in race time seconds.
 		if t < 0.0:		# Don't add negative race times.
 			return
-			
+		
+		self.version += 1
 		try:
 			if t > self.times[-1]:
 				self.times.append( t )
@@ -654,9 +774,22 @@ class Rider(object):
 		if i >= len(self.times) or self.times[i] != t:
 			self.times.insert( i, t )
 
+	def addTimes( self, times ):
+		times = sorted( t for t in times if t >= 0.0 )
+		if not times:
+			return
+		if (not self.times or times[0] > self.times[-1]) and all( a < b for a, b in zip(times, times[1:]) ):
+			# All the times are new laps.
+			self.version += 1
+			self.times.extend( times )
+		else:
+			for t in times:
+				self.addTime( t )
+	
 	def deleteTime( self, t ):
 		try:
 			self.times.remove( t )
+			self.version += 1
 		except ValueError:
 			pass
 
@@ -714,6 +847,7 @@ class Rider(object):
 				tStatus = race.lastRaceTime() if race else None
 		self.status = status
 		self.tStatus = tStatus
+		self.version += 1
 	
 	def getMustBeRepeatInterval( self ):
 		minPossibleLapTime = race.minPossibleLapTime
@@ -846,7 +980,64 @@ class Rider(object):
 		self._iTimesLast = iTimes
 		return self._entriesLast
 			
+	def getInterpolateKey( self, stopTime ):
+		# The result depends on this rider, the race settings and the median lap time of the category.
+		return (
+			self.version, raceChanges.fullSerial, stopTime,
+			self.getMustBeRepeatInterval() if race and self.times else None,
+		)
+	
+	@staticmethod
+	def interpolateRiders( riders, stopTime = maxInterpolateTime ):
+		''' Fill the interpolate() cache of many riders at once with the vectorized code. '''
+		if not InterpolateBatch.enabled or not race:
+			return
+		
+		batch, params = [], []
+		for rider in riders:
+			if not rider.times or rider.status in (Rider.DNS, Rider.DQ) or not rider.autocorrectLaps:
+				continue
+			key = rider.getInterpolateKey( stopTime )
+			try:
+				if rider._interpolateLast[0] == key:
+					continue
+			except AttributeError:
+				pass
+			
+			st, dnfPulledTime = stopTime, None
+			if rider.status in (Rider.DNF, Rider.Pulled):
+				dnfPulledTime = rider.tStatus if rider.tStatus is not None else rider.times[-1]
+				st = min(st, dnfPulledTime + 0.01)
+			category = race.getCategory( rider.num )
+			batch.append( (rider, key) )
+			params.append( (
+				rider.times, race.getStartOffset(rider.num), key[3],
+				(category._numLaps or 0) if category else 0,
+				category.firstLapRatio if category else 1.0,
+				st, dnfPulledTime,
+			) )
+		
+		if len(batch) < InterpolateBatch.minRiders:
+			return
+		
+		results = InterpolateBatch.Interpolate( *zip(*params), pMin=Rider.pMin, pMax=Rider.pMax, entriesMax=Rider.entriesMax )
+		for (rider, key), iTimes in zip(batch, results):
+			if iTimes is not None:
+				rider._interpolateLast = (key, rider.getEntries(iTimes))
+	
 	def interpolate( self, stopTime = maxInterpolateTime ):
+		# Reuse the last result if nothing it depends on has changed.
+		key = self.getInterpolateKey( stopTime )
+		try:
+			if self._interpolateLast[0] == key:
+				return self._interpolateLast[1]
+		except AttributeError:
+			pass
+		entries = self._interpolate( stopTime )
+		self._interpolateLast = (key, entries)
+		return entries
+	
+	def _interpolate( self, stopTime ):
 		if not self.times or self.status in (Rider.DNS, Rider.DQ):
 			return self.getEntries( [] )
 		
@@ -1079,6 +1270,10 @@ class Race( object ):
 	automaticManual = 0
 	
 	isChangedFlag = False
+	snapshotRequired = True		# True if there are changes that are not in the journal.
+	journalId = None
+	journalSeq = 0
+	
 	isTimeTrial = False
 	roadRaceFinishTimes = False
 	estimateLapsDownFinishTime = False
@@ -1203,7 +1398,7 @@ class Race( object ):
 		
 		self.tagNums = None
 		self.lastOpened = datetime.datetime.now()
-		memoize.clear()
+		resetCache()
 	
 	def getFileName( self, raceNum=None, includeMemo=True ):
 		return Utils.GetFileName(
@@ -1277,7 +1472,7 @@ class Race( object ):
 		return 'km/h' if self.distanceUnit == Race.UnitKm else 'mph'
 	
 	def resetCache( self ):
-		memoize.clear()
+		resetCache()
 	
 	def hasRiders( self ):
 		return len(self.riders) > 0
@@ -1285,10 +1480,14 @@ class Race( object ):
 	def isChanged( self ):
 		return self.isChangedFlag
 
-	def setChanged( self, changed = True ):
+	def setChanged( self, changed = True, nums = None ):
+		# If nums is given, only the times of those riders changed.
 		self.isChangedFlag = changed
 		if changed:
 			memoize.clear()
+			raceChanges.record( nums )
+			if nums is None:
+				self.snapshotRequired = True
 			self.lastChangedTime = time.time()
 			
 	def raceTimeToClockTime( self, t=None ):
@@ -1362,14 +1561,27 @@ class Race( object ):
 			return (self.finishTime - self.startTime).total_seconds()
 		return self.curRaceTime()
 
+	def recordTimeOp( self, op, num, t ):
+		self.recordTimeOps( op, ((num, t),) )
+	
+	def recordTimeOps( self, op, numTimes ):
+		if journal and journal.race is self:
+			journal.appendMany( op, numTimes )
+		for listener in timeOpListeners:
+			for num, t in numTimes:
+				listener( self, op, num, t )
+	
 	def addTime( self, num, t = None, doSetChanged = True ):
 		if t is None:
 			t = self.curRaceTime()
+		self.recordTimeOp( 'a', num, t )
 		
+		startTime = self.startTime
 		if self.isTimeTrial:
 			r = self.getRider(num)
 			if r.firstTime is None:
 				r.firstTime = t
+				r.version += 1
 			else:
 				r.addTime( t - r.firstTime )
 		else:
@@ -1382,6 +1594,7 @@ class Race( object ):
 					r = self.getRider(num)
 					if r.firstTime is None:
 						r.firstTime = t
+						r.version += 1
 					else:
 						r.addTime( t )
 						
@@ -1391,6 +1604,7 @@ class Race( object ):
 					r = self.getRider(num)
 					if r.firstTime is None:
 						r.firstTime = t
+						r.version += 1
 					else:
 						r.addTime( t )
 						
@@ -1400,9 +1614,29 @@ class Race( object ):
 				self.getRider(num).addTime( t )
 		
 		if doSetChanged:
-			self.setChanged()
+			# A reset start clock changes everyone's times.
+			self.setChanged( nums=[num] if self.startTime == startTime else None )
 		return t
 
+	def addTimes( self, numTimes, doSetChanged = True ):
+		''' Add a batch of (num, t).  Sends one change notification for the whole batch. '''
+		startTime = self.startTime
+		if self.isTimeTrial or (self.enableJChipIntegration and (self.resetStartClockOnFirstTag or self.skipFirstTagRead)):
+			# The first read of a rider has a special meaning in these modes.
+			for num, t in numTimes:
+				self.addTime( num, t, doSetChanged=False )
+		else:
+			self.recordTimeOps( 'a', numTimes )
+			numRiderTimes = defaultdict( list )
+			for num, t in numTimes:
+				numRiderTimes[num].append( t )
+			for num, times in six.iteritems(numRiderTimes):
+				self.getRider(num).addTimes( times )
+		
+		if doSetChanged and numTimes:
+			# A reset start clock changes everyone's times.
+			self.setChanged( nums=[num for num, t in numTimes] if self.startTime == startTime else None )
+	
 	def importTime( self, num, t ):
 		self.getRider(num).addTime( t )
 		
@@ -1487,9 +1721,10 @@ class Race( object ):
 	def deleteTime( self, num, t ):
 		if not num in self.riders:
 			return
+		self.recordTimeOp( 'd', num, t )
 		rider = self.riders[num]
 		rider.deleteTime( t )
-		self.setChanged()
+		self.setChanged( nums=[num] )
 		
 	def hasRiderTimes( self ):
 		return any( r.hasTimes() for r in six.itervalues(self.riders) )
@@ -1542,6 +1777,7 @@ class Race( object ):
 
 	@memoize
 	def interpolate( self ):
+		Rider.interpolateRiders( six.itervalues(self.riders) )
 		return sorted(
 			itertools.chain.from_iterable( rider.interpolate() for rider in six.itervalues(self.riders) ),
 			key=Entry.key
@@ -2333,6 +2569,11 @@ class Race( object ):
 		for rider in six.itervalues(self.riders):
 			rider.clearCache()
 	
+	def setCompactTimes( self, compact = True ):
+		Rider.compactTimes = compact
+		for rider in six.itervalues(self.riders):
+			rider.times = rider.times		# Converts to the current representation.
+	
 	def getRaceIntro( self ):
 		intro = [
 			u'{}:{}'.format(self.name, self.raceNum),
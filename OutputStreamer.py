@@ -1,9 +1,13 @@
 import io
 import os
+import re
 import six
+import glob
+import mmap
 import time
 import math
 import atexit
+import bisect
 import datetime
 import threading
 from six.moves.queue import Queue, Empty
@@ -18,6 +22,10 @@ streamer = None
 
 terminateMessage = '<<<terminate>>>'
 
+flushSeconds = 1.0						# Longest time written data waits in the buffer.
+rotateBytes = 64 * 1024 * 1024			# Start a new segment when the stream file is this big.
+rotateSeconds = 6 * 60 * 60				# Start a new segment after this many seconds.
+
 def formatTimeHHMMSS( secs ):
 	return Utils.formatTime(
 		secs,
@@ -25,31 +33,85 @@ def formatTimeHHMMSS( secs ):
 		forceHours=True, twoDigitHours=True,
 	)
 
+class StreamWriter( object ):
+	'''
+		Keeps the stream file open, and moves it to a numbered segment when it gets too big or too old.
+		The segments are read back in order followed by the current file (see getSegmentFileNames).
+	'''
+	def __init__( self, fname ):
+		self.fname = fname
+		self.f = None
+		self.size = 0
+		self.tOpen = None
+		self.tFlush = None			# When buffered data must be flushed.
+
+	def open( self ):
+		self.f = io.open( self.fname, 'a', encoding='utf-8' )
+		self.size = self.f.tell()
+		self.tOpen = time.time()
+
+	def write( self, s ):
+		if not self.f:
+			self.open()
+		self.f.write( s )
+		self.size += len(s)
+		if self.tFlush is None:
+			self.tFlush = time.time() + flushSeconds
+		if self.size >= rotateBytes or (rotateSeconds and time.time() - self.tOpen >= rotateSeconds):
+			self.rotate()
+
+	def flush( self ):
+		if self.f:
+			self.f.flush()
+		self.tFlush = None
+
+	def close( self ):
+		if self.f:
+			self.f.close()
+			self.f = None
+		self.tFlush = None
+
+	def rotate( self ):
+		self.close()
+		segments = getSegmentFileNames( self.fname )[:-1]
+		os.rename( self.fname, getSegmentFileName(self.fname, getSegmentNumber(segments[-1]) + 1 if segments else 1) )
+
 def Server( q, fname ):
+	writer = StreamWriter( fname )
 	keepGoing = True
 	while keepGoing:
 		# Read all available messages from the queue.
+		# Don't wait past the time the buffered data must be flushed.
 		messages = []
 		while 1:
 			try:
-				m = q.get( not messages )
+				if messages:
+					m = q.get( False )
+				elif writer.tFlush is None:
+					m = q.get()
+				else:
+					m = q.get( True, max(0.0, writer.tFlush - time.time()) )
 				if m == terminateMessage:
 					keepGoing = False
-					q.task_done()
 					break
 				messages.append( m )
 			except Empty:
 				break
 				
-		# Write all messages to the stream file.
-		if messages:
-			try:
-				with io.open(fname, 'a') as f:
-					f.write( u''.join(messages) )
-				for m in messages:
-					q.task_done()
-			except IOError as e:
-				pass
+		# Write all messages to the stream file.  Close it before acknowledging the terminate message.
+		try:
+			if messages:
+				writer.write( u''.join(messages) )
+			if not keepGoing:
+				writer.close()
+			elif writer.tFlush is not None and time.time() >= writer.tFlush:
+				writer.flush()
+		except (IOError, OSError) as e:
+			writer.close()
+		for m in messages:
+			q.task_done()
+		if not keepGoing:
+			q.task_done()
 
 def StopStreamer():
 	global q
@@ -70,13 +132,31 @@ def getFileName( fname = None ):
 		fname = fname[:-4]
 	return fname + 'Input.csv'
 	
+def getSegmentFileName( fname, n ):
+	base, ext = os.path.splitext( fname )
+	return u'{}-{:04d}{}'.format( base, n, ext )
+
+reSegmentNumber = re.compile( r'-(\d+)\.[^.]*$' )
+def getSegmentNumber( fname ):
+	return int( reSegmentNumber.search(fname).group(1) )
+
+def getSegmentFileNames( fname = None ):
+	''' Returns the rotated segments of the stream file in order, followed by the stream file itself. '''
+	if not fname:
+		fname = getFileName()
+	base, ext = os.path.splitext( fname )
+	segments = [f for f in glob.glob(glob.escape(base) + u'-*' + ext) if reSegmentNumber.search(f)]
+	segments.sort( key=getSegmentNumber )
+	return segments + [fname]
+	
 def DeleteStreamerFile( fname = None ):
 	if not fname:
 		fname = getFileName()
-	try:
-		os.remove( fname )
-	except:
-		pass
+	for f in getSegmentFileNames( fname ):
+		try:
+			os.remove( f )
+		except:
+			pass
 
 def StartStreamer( fname = None ):
 	global q
@@ -153,41 +233,149 @@ def writeNumTimes( numTimes ):
 	else:
 		Utils.writeLog( 'writeNumTimes failure: numTimes={}'.format(numTimes) )
 
-def ReadStreamFile( fname = None ):
-	if not fname:
-		fname = getFileName()
-	
-	startTime = None
-	finishTime = None
-	numTimes = []
-	try:
-		with io.open(fname, 'r', encoding='utf-8') as f:
-			for line in f:
-				line = line.strip()
-				if not line or line[0] == '#':
-					continue
+class StreamReader( object ):
+	'''
+		Fast reader for stream files, for recovering and replaying long races.
+		
+		Each file is mapped into memory and scanned as bytes.
+		The reader remembers how far it got in each file, so read() can be called again to tail a file
+		that is still being written and only the new lines are parsed.
+		Files are tracked by device and inode, not by name, so a file renamed to a segment by
+		StreamWriter.rotate keeps its offset, and the new stream file is read from the start.
+		Every indexStep times, the latest race time and position in numTimes are added to an index, so
+		replay can start at any race time without a scan of the times before it.
+	'''
+	indexStep = 1024
+
+	def __init__( self, fname = None ):
+		self.fname = fname or getFileName()
+		self.offsets = {}			# (st_dev, st_ino) -> offset of the first unread byte.
+		self.startTime = None
+		self.finishTime = None
+		self.numTimes = []
+		self.index = []				# (max race time so far, position in numTimes)
+
+	def reset( self ):
+		self.finishTime = None
+		self.numTimes = []
+		self.index = []
+
+	def readFile( self, f ):
+		try:
+			st = os.fstat( f.fileno() )
+			key = (st.st_dev, st.st_ino)
+			offset = self.offsets.get( key, 0 )
+			if st.st_size < offset:		# Smaller than when we last read it, so it must be a new file.
+				offset = 0
+			if st.st_size <= offset:
+				return
+			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			try:
+				end = mm.rfind( b'\n', offset ) + 1		# Only read complete lines.
+				if end <= offset:
+					return
+				data = mm[offset:end]
+			finally:
+				mm.close()
+		except (IOError, OSError, ValueError):
+			return
+		self.offsets[key] = end
+		self.parse( data )
+
+	def openFiles( self ):
+		# Open all the files, then check that the file names have not changed.
+		# Otherwise a rotate between listing and opening could skip the new segment.
+		while True:
+			fnames = getSegmentFileNames( self.fname )
+			files = []
+			for fname in fnames:
+				try:
+					files.append( io.open(fname, 'rb') )
+				except (IOError, OSError):
+					pass
+			if getSegmentFileNames( self.fname ) == fnames:
+				return files
+			for f in files:
+				f.close()
+
+	reTime = re.compile( br'^time,([^,\r\n]*),([^,\r\n]*)', re.M )
+
+	def parseTimes( self, data ):
+		numTimes = self.numTimes
+		fields = self.reTime.findall( data )
+		try:
+			# Times are almost always in Excel format (days).
+			numTimes.extend( [(int(num), float(timeStr) * DaySeconds) for num, timeStr in fields] )
+		except ValueError:
+			for num, timeStr in fields:
 				try:
-					fields = line.split(',')
-					if fields[0] == 'time':
-						timeStr = fields[2]
-						if ':' in timeStr:
-							t = Utils.StrToSeconds(timeStr)		# Convert from a time format.
-						else:
-							t = float(timeStr) * DaySeconds		# Convert from Excel format, (days to race seconds).
-						numTimes.append( (int(fields[1]), t) )
-					elif fields[0] == 'start':
-						startTime = gt( fields[1] )
-						finishTime = None		# Reset the finishTime and numTimes on start.
-						numTimes = []
-					elif fields[0] == 'end':
-						finishTime = gt( fields[1] )
-				except (ValueError, IndexError):
+					if b':' in timeStr:
+						t = Utils.StrToSeconds(timeStr.decode())	# Convert from a time format.
+					else:
+						t = float(timeStr) * DaySeconds				# Convert from Excel format, (days to race seconds).
+					numTimes.append( (int(num), t) )
+				except ValueError:
 					pass
-	except IOError:
-		pass
-	if startTime is None and numTimes:
-		startTime = datetime.datetime.now() - datetime.timedelta( seconds = numTimes[0][1] )
-	return startTime, finishTime, numTimes
+
+	def parse( self, data ):
+		# Start and end lines are rare.  Find them, then parse the times between them in one pass.
+		controls = []
+		for tag in (b'start,', b'end,'):
+			i = data.find( tag )
+			while i >= 0:
+				if i == 0 or data[i-1:i] == b'\n':
+					controls.append( (i, tag) )
+				i = data.find( tag, i + 1 )
+		controls.sort()
+		
+		i = 0
+		for pos, tag in controls:
+			self.parseTimes( data[i:pos] )
+			i = data.find( b'\n', pos )
+			if i < 0:
+				i = len(data)
+			try:
+				t = gt( data[pos + len(tag):i].split(b',')[0].strip().decode() )
+			except ValueError:
+				continue
+			if tag == b'start,':
+				self.reset()		# Reset the finishTime and numTimes on start.
+				self.startTime = t
+			else:
+				self.finishTime = t
+		self.parseTimes( data[i:] )
+
+	def updateIndex( self ):
+		# Index the running maximum time at the end of each full block.
+		numTimes, index, indexStep = self.numTimes, self.index, self.indexStep
+		tMax = index[-1][0] if index else 0.0
+		for i in range(index[-1][1] if index else 0, len(numTimes) - indexStep + 1, indexStep):
+			tMax = max( tMax, max(t for num, t in numTimes[i:i + indexStep]) )
+			index.append( (tMax, i + indexStep) )
+
+	def read( self ):
+		''' Reads any new data in the stream files.  Returns (startTime, finishTime, numTimes). '''
+		files = self.openFiles()
+		try:
+			for f in files:
+				self.readFile( f )
+		finally:
+			for f in files:
+				f.close()
+		startTime = self.startTime
+		if startTime is None and self.numTimes:
+			startTime = datetime.datetime.now() - datetime.timedelta( seconds = self.numTimes[0][1] )
+		return startTime, self.finishTime, self.numTimes
+
+	def replay( self, tStart = 0.0 ):
+		''' Returns the (num, t) read since the start of the race, with t >= tStart, in the order they were written. '''
+		self.updateIndex()
+		i = bisect.bisect_left( self.index, (tStart, -1) )
+		pos = self.index[i-1][1] if i > 0 else 0		# All times before pos are < tStart.
+		return [(num, t) for num, t in self.numTimes[pos:] if t >= tStart]
+
+def ReadStreamFile( fname = None ):
+	return StreamReader( fname ).read()
 	
 @atexit.register
 def CleanupStreamer():
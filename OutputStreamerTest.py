@@ -0,0 +1,53 @@
+import os
+import six
+import shutil
+import tempfile
+import datetime
+from OutputStreamer import StreamWriter, StreamReader, getSegmentFileNames, DaySeconds
+
+#------------------------------------------------------------------------------
+# Check that a StreamReader tailing the stream file sees every time exactly once when
+# the StreamWriter rotates the file to a segment between reads.
+#
+#	python OutputStreamerTest.py
+
+def writeTimes( writer, nums ):
+	for num in nums:
+		writer.write( u'time,{},{:.15e},"00:00:{:02d}.000"\n'.format(num, num / DaySeconds, num) )
+	writer.flush()
+
+def test_tail_across_rotate():
+	dirName = tempfile.mkdtemp()
+	try:
+		fname = os.path.join( dirName, 'RaceInput.csv' )
+		writer = StreamWriter( fname )
+		reader = StreamReader( fname )
+
+		writer.write( u'start,{}\n'.format(datetime.datetime(2020, 1, 1, 10, 0, 0, 1).isoformat()) )
+		writeTimes( writer, six.moves.range(1, 11) )
+		startTime, finishTime, numTimes = reader.read()
+		assert [num for num, t in numTimes] == list(six.moves.range(1, 11))
+
+		writer.rotate()
+		writeTimes( writer, six.moves.range(11, 14) )
+		assert len(getSegmentFileNames(fname)) == 2
+		startTime, finishTime, numTimes = reader.read()
+		assert [num for num, t in numTimes] == list(six.moves.range(1, 14))
+
+		# Rotate again before the reader sees the times written to the last file.
+		writeTimes( writer, six.moves.range(14, 16) )
+		writer.rotate()
+		writeTimes( writer, six.moves.range(16, 18) )
+		startTime, finishTime, numTimes = reader.read()
+		assert [num for num, t in numTimes] == list(six.moves.range(1, 18))
+		assert [num for num, t in reader.replay(14.5)] == [15, 16, 17]
+
+		# A new reader sees the same times.
+		writer.close()
+		assert StreamReader( fname ).read()[2] == numTimes
+	finally:
+		shutil.rmtree( dirName, ignore_errors=True )
+
+if __name__ == '__main__':
+	test_tail_across_rotate()
+	six.print_( 'passed' )
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+import six
+import Model
+from SimulateData import SimulateData
+from GetResults import GetResults, GetCategoryDetails, GetAnimationData
+from ForecastHistory import getExpectedRecorded
+from RaceWriter import raceWriter
+
+#------------------------------------------------------------------------------
+# Headless benchmark of the race hot paths on races generated by SimulateData.
+#
+# Each scenario builds a race from the simulated reads, then times adding the reads,
+# computing the results, the expected/recorded arrivals, the category details, the
+# html payload and writing the race file.  Peak memory is measured in a second pass.
+# The results are written as json so runs can be compared:
+#
+#	python RaceBenchmark.py --suite standard --output before.json
+#	python RaceBenchmark.py --suite standard --output after.json --compare before.json
+
+suites = {
+	'quick': [
+		dict(riders=100, raceMinutes=10),
+		dict(riders=500, raceMinutes=20, waves=4),
+		dict(riders=500, raceMinutes=20, timeTrial=True),
+	],
+	'standard': [
+		dict(riders=100, raceMinutes=1),
+		dict(riders=100, raceMinutes=10),
+		dict(riders=1000, raceMinutes=20, waves=4),
+		dict(riders=1000, raceMinutes=20, timeTrial=True),
+		dict(riders=5000, raceMinutes=50, waves=8),
+	],
+	'huge': [
+		dict(riders=20000, raceMinutes=20, waves=10),
+		dict(riders=5000, raceMinutes=100, waves=4),
+		dict(riders=20000, raceMinutes=100, waves=10),
+	],
+}
+
+regressionRatio = 1.25		# Report timings this much slower than the baseline.
+regressionMinSeconds = 0.05	# Shorter timings are too noisy to compare.
+
+def scenarioName( riders, raceMinutes, waves=2, timeTrial=False ):
+	return '{}-riders-{}-min-{}'.format( riders, raceMinutes, 'tt' if timeTrial else '{}-waves'.format(waves) )
+
+def timeIt( f ):
+	t = time.perf_counter()
+	r = f()
+	return time.perf_counter() - t, r
+
+def makeRace( data, timeTrial ):
+	race = Model.newRace()
+	race.name = 'Benchmark'
+	race.minutes = data['raceMinutes']
+	race.setCategories( data['categories'] )
+	race.isTimeTrial = timeTrial
+	race.startTime = datetime.datetime.now()
+	lapTimes = data['lapTimes']
+	if timeTrial:
+		# Start the riders 10 seconds apart and shift their times by their start.
+		firstTime = {num: i * 10.0 for i, num in enumerate(sorted(set(num for t, num in lapTimes)))}
+		for num, t in six.iteritems(firstTime):
+			race.getRider( num ).firstTime = t
+		lapTimes = sorted( (t + firstTime[num], num) for t, num in lapTimes )
+	return race, lapTimes
+
+def addTimes( race, lapTimes ):
+	for t, num in lapTimes:
+		race.addTime( num, t )
+
+def getResults( race ):
+	Model.memoize.clear()
+	return [GetResults(c) for c in race.getCategories(startWaveOnly=False)]
+
+def getHtmlPayload():
+	# The part of the html page that depends on the race.  The rest of the page is a template.
+	Model.memoize.clear()
+	payload = {'data': GetAnimationData(None, True), 'catDetails': GetCategoryDetails(True, True)}
+	return len( json.dumps(payload, default=str, separators=(',',':')) )
+
+def getForecast( race, tCur ):
+	# Forecast as if we were at tCur in the race.
+	race.curRaceTime = race.lastRaceTime = lambda: tCur
+	try:
+		return getExpectedRecorded()
+	finally:
+		del race.curRaceTime, race.lastRaceTime
+
+def writeRace( race, dirName ):
+	raceWriter.write( os.path.join(dirName, 'Benchmark.cmn'), race )
+	raceWriter.flush()
+
+def runScenario( riders, raceMinutes, waves=2, timeTrial=False ):
+	data = SimulateData( riders=riders, raceMinutes=raceMinutes, waves=waves )
+	race, lapTimes = makeRace( data, timeTrial )
+	Model.setRace( race )
+	tMid = lapTimes[len(lapTimes) // 2][0]
+
+	timings = {}
+	timings['addTime'], r = timeIt( lambda: addTimes(race, lapTimes) )
+	timings['GetResults'], r = timeIt( lambda: getResults(race) )
+	Model.memoize.clear()
+	timings['getExpectedRecorded'], r = timeIt( lambda: getForecast(race, tMid) )
+	race.addTime( lapTimes[-1][1], tMid + 0.5 )		# A new read, then forecast again.
+	timings['getExpectedRecordedAfterRead'], r = timeIt( lambda: getForecast(race, tMid + 1.0) )
+	Model.memoize.clear()
+	timings['GetCategoryDetails'], r = timeIt( lambda: GetCategoryDetails(True, True) )
+	timings['htmlPayload'], payloadBytes = timeIt( getHtmlPayload )
+
+	dirName = tempfile.mkdtemp( prefix='RaceBenchmark' )
+	try:
+		timings['writeRace'], r = timeIt( lambda: writeRace(race, dirName) )
+		fileBytes = os.path.getsize( os.path.join(dirName, 'Benchmark.cmn') )
+	finally:
+		shutil.rmtree( dirName, ignore_errors=True )
+	Model.setRace( None )
+
+	# Measure memory in a separate pass, as tracing slows everything down.
+	tracemalloc.start()
+	race, lapTimes = makeRace( data, timeTrial )
+	Model.setRace( race )
+	addTimes( race, lapTimes )
+	raceBytes = tracemalloc.get_traced_memory()[0]
+	getResults( race )
+	peakBytes = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	Model.setRace( None )
+
+	return {
+		'params': dict(riders=riders, raceMinutes=raceMinutes, waves=waves, timeTrial=timeTrial),
+		'reads': len(lapTimes),
+		'timings': timings,
+		'payloadBytes': payloadBytes,
+		'fileBytes': fileBytes,
+		'raceMB': raceBytes / (1024.0*1024.0),
+		'peakMB': peakBytes / (1024.0*1024.0),
+	}
+
+def compare( results, baseline ):
+	''' Prints the timings next to the baseline.  Returns the number of regressions. '''
+	regressions = 0
+	for name, r in six.iteritems(results['scenarios']):
+		b = baseline['scenarios'].get( name )
+		if not b:
+			continue
+		print( name )
+		for k, t in six.iteritems(r['timings']):
+			tBase = b['timings'].get( k )
+			if not tBase:
+				continue
+			ratio = t / tBase
+			flag = ''
+			if ratio > regressionRatio and max(t, tBase) >= regressionMinSeconds:
+				flag = '  <<< slower'
+				regressions += 1
+			print( '    {:<28}{:>10.3f}{:>10.3f}{:>8.2f}x{}'.format(k, tBase, t, ratio, flag) )
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser( description='Benchmark the race hot paths on simulated races.' )
+	parser.add_argument( '--suite', default='quick', choices=sorted(suites.keys()) )
+	parser.add_argument( '--output', help='json file for the results' )
+	parser.add_argument( '--compare', help='json file of an earlier run to compare with' )
+	args = parser.parse_args()
+
+	results = {
+		'suite': args.suite,
+		'timestamp': datetime.datetime.now().isoformat(),
+		'python': sys.version.split()[0],
+		'platform': platform.platform(),
+		'scenarios': {},
+	}
+	for params in suites[args.suite]:
+		name = scenarioName( **params )
+		r = results['scenarios'][name] = runScenario( **params )
+		print( '{:<36} {:>8} reads   {:>8.1f} MB peak'.format(name, r['reads'], r['peakMB']) )
+		for k, t in six.iteritems(r['timings']):
+			print( '    {:<28}{:>10.3f}'.format(k, t) )
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump( results, f, indent=1, sort_keys=True )
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load( f )
+		return 1 if compare( results, baseline ) else 0
+	return 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
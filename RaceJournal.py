@@ -0,0 +1,138 @@
+import os
+import io
+import time
+import threading
+import Utils
+
+#------------------------------------------------------------------------------
+# The race file is a pickled snapshot of the race.
+# Tag reads and time deletions are appended to a journal file next to it as they happen,
+# so a write costs one line instead of the whole race.
+# When the race is opened, the journal records newer than the snapshot are replayed onto it.
+#
+# Journal format (text, one record per line):
+#
+#	CrossMgrJournal <race.journalId>
+#	<seq> a <num> <raceTime>		# race.addTime( num, raceTime )
+#	<seq> d <num> <raceTime>		# race.deleteTime( num, raceTime )
+#
+# The snapshot stores the seq of the last record it contains in race.journalSeq.
+# A partially written last line (from a crash) is ignored.
+
+Header = 'CrossMgrJournal'
+AddTime, DeleteTime = 'a', 'd'
+
+def GetJournalFileName( raceFileName ):
+	return raceFileName + 'j'
+
+def formatRecord( seq, op, num, t ):
+	return u'{} {} {} {}\n'.format( seq, op, num, repr(float(t)) )
+
+def parseRecord( line ):
+	seq, op, num, t = line.split()
+	if op not in (AddTime, DeleteTime):
+		raise ValueError( 'unknown journal op "{}"'.format(op) )
+	return int(seq), op, int(num), float(t)
+
+def ReadRecords( raceFileName, race ):
+	''' Returns the journal records of this race newer than its snapshot. '''
+	try:
+		with io.open( GetJournalFileName(raceFileName), 'r', encoding='utf-8', newline='\n' ) as fp:
+			lines = fp.readlines()
+	except (IOError, OSError):
+		return []
+
+	if not lines or lines[0].split() != [Header, u'{}'.format(race.journalId)]:
+		return []
+
+	records = []
+	for line in lines[1:]:
+		if not line.endswith( '\n' ):
+			break				# Incomplete write.
+		try:
+			record = parseRecord( line )
+		except ValueError as e:
+			Utils.writeLog( u'RaceJournal: ReadRecords: skipping "{}" ({})'.format(line.strip(), e) )
+			continue
+		if record[0] > race.journalSeq:
+			records.append( record )
+	return records
+
+def Replay( race, records ):
+	for seq, op, num, t in records:
+		if op == AddTime:
+			race.addTime( num, t, doSetChanged=False )
+		else:
+			race.deleteTime( num, t )
+	if records:
+		race.resetAllCaches()
+
+#------------------------------------------------------------------------------
+class RaceJournal( object ):
+	compactRecords = 1000			# Compact when this many records have been written since the snapshot...
+	compactSeconds = 10.0*60.0		# ... or when the oldest one is this old.
+
+	def __init__( self, raceFileName, race, records = None ):
+		self.raceFileName = raceFileName
+		self.fileName = GetJournalFileName( raceFileName )
+		self.race = race
+		self.lock = threading.Lock()
+		self.lines = [formatRecord(*r) for r in (records or [])]
+		self.seq = records[-1][0] if records else race.journalSeq
+		self.tFirst = time.time() if records else None
+		self.fp = None
+		self.rewrite()
+
+	def rewrite( self ):
+		# Caller must hold the lock or have exclusive access.
+		if self.fp:
+			self.fp.close()
+		fnameTmp = self.fileName + '.tmp'
+		with io.open( fnameTmp, 'w', encoding='utf-8', newline='\n' ) as fp:
+			fp.write( u'{} {}\n'.format(Header, self.race.journalId) )
+			fp.write( u''.join(self.lines) )
+		os.replace( fnameTmp, self.fileName )
+		self.fp = io.open( self.fileName, 'a', encoding='utf-8', newline='\n' )
+
+	def append( self, op, num, t ):
+		self.appendMany( op, ((num, t),) )
+	
+	def appendMany( self, op, numTimes ):
+		with self.lock:
+			if not self.fp:
+				return
+			lines = []
+			for num, t in numTimes:
+				self.seq += 1
+				lines.append( formatRecord(self.seq, op, num, t) )
+			try:
+				self.fp.write( u''.join(lines) )
+				self.fp.flush()
+			except (IOError, OSError) as e:
+				Utils.writeLog( u'RaceJournal: append: "{}"'.format(e) )
+				return
+			self.lines.extend( lines )
+			if self.tFirst is None:
+				self.tFirst = time.time()
+
+	def needsCompact( self ):
+		with self.lock:
+			return bool(self.lines) and (
+				len(self.lines) >= self.compactRecords or
+				time.time() - self.tFirst >= self.compactSeconds
+			)
+
+	def trim( self, seq ):
+		''' Called after a snapshot containing the records up to seq has been written. '''
+		with self.lock:
+			if not self.fp:
+				return
+			self.lines = [line for line in self.lines if int(line.split(None, 1)[0]) > seq]
+			self.tFirst = time.time() if self.lines else None
+			self.rewrite()
+
+	def close( self ):
+		with self.lock:
+			if self.fp:
+				self.fp.close()
+				self.fp = None
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+import six.moves.cPickle as pickle
+import Utils
+import Model
+
+#------------------------------------------------------------------------------
+# Writes race files from a background thread.
+#
+# The worker pickles the race with the race locked when it takes the request off the queue, so
+# a burst of changes is pickled once, and not on the caller's thread.  It writes the bytes to a
+# temporary file and renames it over the race file, so a crash never leaves a partially written race.
+# Requests for the same file that arrive while a write is pending replace it, and writes to a file
+# are at least minInterval seconds apart, so a burst of changes results in one write.
+#
+# The snapshot records the journal seq it contains, and the journal is trimmed to it once the
+# snapshot is on disk.  If the write fails, race.snapshotRequired is set again so the next
+# writeRace retries it.
+
+class RaceWriter( object ):
+	minInterval = 2.0			# Minimum seconds between writes of the same file.
+	fsync = False				# Flush the race file to the disk before renaming it.
+	slowWriteSeconds = 0.25		# Log writes that take longer than this.
+
+	def __init__( self ):
+		self.condition = threading.Condition()
+		self.pending = OrderedDict()		# fileName -> (race, journal)
+		self.busy = False
+		self.lastWrite = {}					# fileName -> time of last write
+		self.latency = deque( maxlen=100 )	# (snapshotSeconds, writeSeconds)
+		self.writeCount = 0
+		self.coalesceCount = 0
+		self.thread = None
+
+	def write( self, fileName, race, journal = None ):
+		''' Queue a write of the race. '''
+		with self.condition:
+			if fileName in self.pending:
+				self.coalesceCount += 1
+			self.pending[fileName] = (race, journal)
+			if not self.thread or not self.thread.is_alive():
+				self.thread = threading.Thread( target=self.run, name='RaceWriter' )
+				self.thread.daemon = True
+				self.thread.start()
+			self.condition.notify_all()
+
+	def flush( self ):
+		''' Wait until all queued writes are on disk. '''
+		with self.condition:
+			self.lastWrite.clear()			# Don't delay the pending writes.
+			self.condition.notify_all()
+			while self.pending or self.busy:
+				self.condition.wait()
+
+	def getStats( self ):
+		with self.condition:
+			latency = list( self.latency )
+		return {
+			'writes': self.writeCount,
+			'coalesced': self.coalesceCount,
+			'lastSnapshotSeconds': latency[-1][0] if latency else None,
+			'lastWriteSeconds': latency[-1][1] if latency else None,
+			'maxSnapshotSeconds': max( s for s, w in latency ) if latency else None,
+			'maxWriteSeconds': max( w for s, w in latency ) if latency else None,
+		}
+
+	def snapshot( self, race, journal ):
+		''' Returns the pickled race, and the journal seq it contains. '''
+		with Model.lock:
+			seq = None
+			if journal is not None:
+				seq = race.journalSeq = journal.seq
+			race.snapshotRequired = False
+			return pickle.dumps( race, 2 ), seq
+
+	def writeFile( self, fileName, data ):
+		fnameTmp = fileName + '.tmp'
+		with open(fnameTmp, 'wb') as fp:
+			fp.write( data )
+			if self.fsync:
+				fp.flush()
+				os.fsync( fp.fileno() )
+		os.replace( fnameTmp, fileName )
+
+	def run( self ):
+		while True:
+			with self.condition:
+				while True:
+					if not self.pending:
+						self.condition.wait()
+						continue
+					tNow = time.time()
+					fileName = next( iter(self.pending) )
+					tWait = self.lastWrite.get( fileName, 0.0 ) + self.minInterval - tNow
+					if tWait <= 0.0:
+						break
+					self.condition.wait( tWait )
+				race, journal = self.pending.pop( fileName )
+				self.busy = True
+
+			t = time.time()
+			tSnapshot = 0.0
+			try:
+				data, seq = self.snapshot( race, journal )
+				tSnapshot = time.time() - t
+				self.writeFile( fileName, data )
+				if journal is not None:
+					journal.trim( seq )
+			except Exception as e:
+				Utils.logException( e, sys.exc_info() )
+				with Model.lock:
+					race.snapshotRequired = True
+			tWrite = time.time() - t - tSnapshot
+
+			if tWrite > self.slowWriteSeconds:
+				Utils.writeLog( u'RaceWriter: slow write: {:.3f}s "{}"'.format(tWrite, fileName) )
+
+			with self.condition:
+				self.busy = False
+				self.writeCount += 1
+				self.latency.append( (tSnapshot, tWrite) )
+				self.lastWrite[fileName] = time.time()
+				self.condition.notify_all()
+
+# Global singleton for this module.
+raceWriter = RaceWriter()
@@ -8,7 +8,8 @@ import sys
 import six
 import cgi
 import copy
-import string
+import threading
+import six.moves.cPickle as pickle
 StringIO = six.StringIO
 import Utils
 from Utils import tag
@@ -19,6 +20,7 @@ from ReadPropertiesFromExcel import ReadPropertiesFromExcel
 from ReadCategoriesFromExcel import sheetName as CategorySheetName
 from ReadPropertiesFromExcel import sheetName as PropertySheetName
 import MatchingCategory
+from TagResolver import GetCleanTag, FixJChipTag, FixOrionTag, NormalizeTag, tagResolver
 import HelpSearch
 
 with Utils.SuspendTranslation():
@@ -533,24 +535,6 @@ class GetExcelLink( object ):
 		
 #----------------------------------------------------------------------------------
 
-JChipTagLength = 6
-OrionTagLength = 16
-
-if six.PY2:
-	trantab = string.maketrans( 'lOo', '100' ) # Translate lower-case l's to ones and Os to zeros. 
-	def GetCleanTag( tag ):
-		return six.text_type(tag).translate(trantab, ' \t\n\r')	# Also, remove any extra spaces.
-else:
-	trantab = str.maketrans( 'lOo', '100', ' \t\n\r' ) # Translate lower-case l's to ones and Os to zeros. Also, remove any extra spaces.
-	def GetCleanTag( tag ):
-		return six.text_type(tag).translate(trantab)
-
-def FixJChipTag( tag ):
-	return GetCleanTag(tag).zfill(JChipTagLength)
-	
-def FixOrionTag( tag ):
-	return GetCleanTag(tag).zfill(OrionTagLength)
-
 def GetFixTag( externalInfo ):
 	# Check if we have JChip or Orion tags.
 	countJChip, countOrion = 0, 0
@@ -579,6 +563,47 @@ def FixTagFormat( externalInfo ):
 				continue
 			edata[tagName] = fixTagFunc( tag )
 
+def GetRiderTags( edata, tagFields ):
+	for tagName in tagFields:
+		try:
+			t = NormalizeTag( edata[tagName] )
+		except (KeyError, ValueError):
+			continue
+		if t:
+			yield t
+
+def MakeTagNums( externalInfo, tagFields, tags=None ):
+	''' Returns the tag to bib map.  If tags is given, only for those tags. '''
+	tagNums = {}
+	for tagName in tagFields:
+		tn = {}
+		for num, edata in six.iteritems(externalInfo):
+			for t in GetRiderTags( edata, (tagName,) ):
+				if tags is None or t in tags:
+					tn[t] = num
+		tagNums.update( tn )
+	return tagNums
+
+def UpdateTagNums( tagNums, infoOld, infoNew, nums, tagFields ):
+	'''
+		Update tagNums for the bibs in nums from infoOld to infoNew.
+		The tags of those bibs are looked up again in all the bibs, so a tag shared with an unchanged bib gets the same bib as MakeTagNums.
+	'''
+	tags = set()
+	for info in (infoOld, infoNew):
+		for num in nums:
+			edata = info.get( num )
+			if edata:
+				tags.update( GetRiderTags(edata, tagFields) )
+	if not tags:
+		return
+	tagNumsNew = MakeTagNums( infoNew, tagFields, tags )
+	for t in tags:
+		try:
+			tagNums[t] = tagNumsNew[t]
+		except KeyError:
+			tagNums.pop( t, None )
+
 def GetTagNums( forceUpdate = False ):
 	race = Model.race
 	if not race:
@@ -595,19 +620,9 @@ def GetTagNums( forceUpdate = False ):
 		except:
 			race.tagNums = {}
 		else:
-			if excelLink.readFromFile or not getattr(race, 'tagNums', None) or forceUpdate:
-				race.tagNums = {}
-				for tagName in TagFields:
-					if excelLink.hasField( tagName ):
-						tn = {}
-						for num, edata in six.iteritems(externalInfo):
-							try:
-								tag = Utils.removeDiacritic(six.text_type(edata[tagName] or '')).lstrip('0').upper()
-							except (KeyError, ValueError):
-								continue
-							if tag:
-								tn[tag] = num
-						race.tagNums.update( tn )
+			# ExcelLink.read keeps the tagNums up to date with the changes in the sheet.
+			if not getattr(race, 'tagNums', None) or forceUpdate:
+				race.tagNums = MakeTagNums( externalInfo, excelLink.getTagFields() )
 	return race.tagNums
 
 def UnmatchedTagsUpdate():
@@ -615,20 +630,9 @@ def UnmatchedTagsUpdate():
 	if not race or not race.unmatchedTags:
 		return
 	
-	tagNums = GetTagNums( forceUpdate=True )
-	tagsFound = False
-	for tag, times in six.iteritems(race.unmatchedTags):
-		try:
-			num = tagNums[tag]
-		except KeyError:
-			continue
-		
-		for t in times:
-			race.addTime( num, t )
-		tagsFound = True
-	
-	if tagsFound:
-		race.unmatchedTags = { tag: times for tag, times in six.iteritems(race.unmatchedTags) if tag not in tagNums }
+	# Add the times of the tags now in the sheet in one batch.
+	tagResolver.setTagNums( GetTagNums() )
+	tagResolver.reconcile( race )
 	
 #-----------------------------------------------------------------------------------------------------
 # Cache the Excel sheet so we don't have to re-read if it has not changed.
@@ -643,6 +647,121 @@ def ResetExcelLinkCache():
 	stateCache = None
 	infoCache = None
 	errorCache = None
+	sheetParser.reset()
+
+def DiffInfo( infoOld, infoNew ):
+	''' Returns the bibs added, changed and removed from infoOld to infoNew. '''
+	added, changed = [], []
+	for num, data in six.iteritems(infoNew):
+		try:
+			if infoOld[num] != data:
+				changed.append( num )
+		except KeyError:
+			added.append( num )
+	removed = [num for num in infoOld if num not in infoNew]
+	return added, changed, removed
+
+#-----------------------------------------------------------------------------------------------------
+# Keep the last parse of the sheet in a file next to the race, so reopening the race does not parse the sheet again.
+# The rows of the categories and properties sheets are kept too, so the saved parse can be applied before the start.
+sheetCacheVersion = 2
+sheetCacheSheets = (CategorySheetName, PropertySheetName)
+
+class SheetCacheReader( object ):
+	''' The saved sheets, read like an Excel reader. '''
+	def __init__( self, sheetNames, sheets ):
+		self.sheetNames = sheetNames
+		self.sheets = sheets
+	
+	def sheet_names( self ):
+		return self.sheetNames
+	
+	def iter_list( self, sname, date_as_tuple=False ):
+		return iter( self.sheets[sname] )
+
+def GetSheetCacheFileName():
+	fileName = Utils.getFileName()
+	return fileName + 'x' if fileName else None
+
+def ReadSheetCache( cacheFileName, key ):
+	''' Returns (info, errors, reader) saved for the sheet with this key, or None. '''
+	try:
+		with open(cacheFileName, 'rb') as fp:
+			version, keyCache, info, errors, sheetNames, sheets = pickle.load( fp )
+	except Exception:
+		return None
+	if version != sheetCacheVersion or keyCache != key:
+		return None
+	return info, errors, SheetCacheReader( sheetNames, sheets )
+
+def WriteSheetCache( cacheFileName, key, info, errors, reader ):
+	fnameTmp = cacheFileName + '.tmp'
+	try:
+		sheetNames = reader.sheet_names()
+		sheets = { sname: list(reader.iter_list(sname)) for sname in sheetCacheSheets if sname in sheetNames }
+		with open(fnameTmp, 'wb') as fp:
+			pickle.dump( (sheetCacheVersion, key, info, errors, list(sheetNames), sheets), fp, 2 )
+		os.replace( fnameTmp, cacheFileName )
+	except Exception as e:
+		Utils.logException( e, sys.exc_info() )
+
+class SheetParser( object ):
+	'''
+		Parses a changed sign-on sheet in a background thread.
+		ExcelLink.read keeps returning the previous info until the parse is done, then applies the changes.
+	'''
+	def __init__( self ):
+		self.lock = threading.Lock()
+		self.reset()
+	
+	def reset( self ):
+		with self.lock:
+			self.state = None
+			self.result = None
+			self.thread = None
+	
+	def get( self, excelLink, state ):
+		''' Returns the parse of the sheet in this state if done, otherwise starts it and returns None. '''
+		with self.lock:
+			if self.state == state:
+				if self.result is not None:
+					result, self.result = self.result, None
+					self.state = None
+					return result
+				if self.thread and self.thread.is_alive():
+					return None
+			self.state = state
+			self.result = None
+			self.thread = threading.Thread( target=self.run, args=(copy.copy(excelLink), state, GetSheetCacheFileName()), name='SheetParser' )
+			self.thread.daemon = True
+			self.thread.start()
+			return None
+	
+	def run( self, excelLink, state, cacheFileName ):
+		try:
+			cacheKey = excelLink.getCacheKey()
+			reader = GetExcelReader( excelLink.fileName )
+			result = (reader,) + excelLink.parse( reader )
+			if cacheFileName and excelLink.sheetName in reader.sheet_names():
+				WriteSheetCache( cacheFileName, cacheKey, result[1], result[2], reader )
+		except Exception as e:
+			Utils.logException( e, sys.exc_info() )
+			result = (None, {}, [])
+		with self.lock:
+			if self.state != state:
+				return
+			self.result = result
+		if wx.GetApp():
+			wx.CallAfter( onSheetParsed )
+
+def onSheetParsed():
+	race = Model.race
+	if race and getattr(race, 'excelLink', None):
+		race.excelLink.read()
+		if race.excelLink.readFromFile:
+			Utils.refresh()
+
+sheetParser = SheetParser()
 
 class ExcelLink( object ):
 	OpenCode = 0
@@ -654,6 +773,8 @@ class ExcelLink( object ):
 	
 	initCategoriesFromExcel = False
 	
+	backgroundRead = True	# Parse changes to the sheet in a background thread.
+	
 	def __init__( self ):
 		self.fileName = None
 		self.sheetName = None
@@ -701,6 +822,9 @@ class ExcelLink( object ):
 	def getFields( self ):
 		return [f for f in Fields if self.hasField(f)]
 	
+	def getTagFields( self ):
+		return [f for f in TagFields if self.hasField(f)]
+	
 	def get( self ):
 		# Check the cache, but don't bother with the modification date of the file for performance.
 		global stateCache
@@ -749,9 +873,15 @@ class ExcelLink( object ):
 	def updateFilenameToMostRecent( self ):
 		self.fileName = (self.getMostRecentFilename() or self.fileName)
 		
+	def getState( self ):
+		return (os.path.getmtime(self.fileName), self.fileName, self.sheetName, self.fieldCol)
+	
+	def getCacheKey( self ):
+		st = os.stat( self.fileName )
+		return (self.fileName, st.st_mtime, st.st_size, self.sheetName, sorted(six.iteritems(self.fieldCol)))
+	
 	def read( self, alwaysReturnCache = False ):
 		# Check the cache.  Return the last info if the file has not been modified, and the name, sheet and fields are the same.
-		global stateCache
 		global infoCache
 		global errorCache
 		
@@ -759,27 +889,60 @@ class ExcelLink( object ):
 		if alwaysReturnCache and infoCache is not None:
 			return infoCache
 
+		state = None
 		if stateCache and infoCache:
 			try:
-				state = (os.path.getmtime(self.fileName), self.fileName, self.sheetName, self.fieldCol)
+				state = self.getState()
 				if state == stateCache:
 					return infoCache
 			except:
 				pass
+			
+			# If only the file changed, parse it in the background and return the previous info until it is done.
+			if self.backgroundRead and state and state[1:] == stateCache[1:]:
+				result = sheetParser.get( self, state )
+				if result is None:
+					return infoCache
+				reader, info, errors = result
+				if reader is not None:
+					self.readFromFile = True
+					return self.apply( state, reader, info, errors )
 	
 		# Read the sheet and return the rider data.
-		self.readFromFile = True
+		cacheFileName = GetSheetCacheFileName()
 		try:
+			state = self.getState()
+			cacheKey = self.getCacheKey()
+			
+			# Use the saved parse if the sheet has the same time and size.
+			if cacheFileName:
+				cached = ReadSheetCache( cacheFileName, cacheKey )
+				if cached:
+					info, errors, reader = cached
+					return self.apply( state, reader, info, errors )
+			
+			self.readFromFile = True
 			reader = GetExcelReader( self.fileName )
 			if self.sheetName not in reader.sheet_names():
 				infoCache = {}
 				errorCache = []
 				return {}
-		except (IOError, ValueError):
+		except (IOError, OSError, ValueError):
+			self.readFromFile = True
 			infoCache = {}
 			errorCache = []
 			return {}
 		
+		info, errors = self.parse( reader )
+		if cacheFileName:
+			WriteSheetCache( cacheFileName, cacheKey, info, errors, reader )
+		return self.apply( state, reader, info, errors )
+	
+	def parse( self, reader ):
+		''' Returns the rider info and errors from the sheet.  Does not change any global state so it can run in another thread. '''
+		if self.sheetName not in reader.sheet_names():
+			return {}, []
+		
 		info = {}
 		rowInfo = []
 		hasTags = False
@@ -921,24 +1084,45 @@ class ExcelLink( object ):
 							)
 						)
 		
-		stateCache = (os.path.getmtime(self.fileName), self.fileName, self.sheetName, self.fieldCol)
+		return info, errors
+	
+	def apply( self, state, reader, info, errors ):
+		''' Make the parsed sheet current and apply the changes to the race.  The reader (or the saved sheets) is only needed before the start of the race. '''
+		global stateCache
+		global infoCache
+		global errorCache
+		
+		# Find the changed bibs if this is a new version of the same sheet.
+		changedNums = None
+		if stateCache and infoCache is not None and stateCache[1:] == state[1:]:
+			added, changed, removed = DiffInfo( infoCache, info )
+			changedNums = added + changed + removed
+		infoOld = infoCache
+		
+		stateCache = state
 		infoCache = info
 		errorCache = errors
 		
-		# Clear the tagNums cache
-		try:
-			Model.race.tagNums = None
-		except AttributeError:
-			pass
+		# Update the tagNums for the changed bibs.  Otherwise, clear the tagNums cache.
+		race = Model.race
+		if race:
+			tagNums = getattr( race, 'tagNums', None )
+			if changedNums is None or not tagNums:
+				race.tagNums = None
+			else:
+				UpdateTagNums( tagNums, infoOld, info, changedNums, self.getTagFields() )
 		
 		# Do not read categories or properties after the race has started to avoid overwriting local changes.
 		if Model.race and Model.race.startTime:
 			self.hasCategoriesSheet = False
 			self.hasPropertiesSheet = False
-			UnmatchedTagsUpdate()
+			raceChanged = False
+			if changedNums is None or changedNums:
+				UnmatchedTagsUpdate()
 		else:
 			self.hasCategoriesSheet = ReadCategoriesFromExcel( reader )
 			self.hasPropertiesSheet = ReadPropertiesFromExcel( reader )
+			raceChanged = True
 			
 		if not self.hasCategoriesSheet and self.initCategoriesFromExcel and (
 				self.hasField('EventCategory') or any( self.hasField(f) for f in CustomCategoryFields )):
@@ -946,9 +1130,13 @@ class ExcelLink( object ):
 			for bib, fields in infoCache.items():
 				MatchingCategory.AddToMatchingCategory( bib, fields )
 			MatchingCategory.EpilogMatchingCategory()
+			raceChanged = True
 			
 		try:
-			Model.race.resetAllCaches()
+			if raceChanged:
+				Model.race.resetAllCaches()
+			elif changedNums is None or changedNums:
+				Model.resetCache()	# Only the rider info changed.
 		except:
 			pass
 		
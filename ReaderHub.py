@@ -0,0 +1,303 @@
+import time
+import errno
+import asyncio
+import datetime
+import threading
+from collections import deque
+import Utils
+
+#------------------------------------------------------------------------------
+# One asyncio event loop in a background thread serving any number of chip reader
+# connections, on any number of ports.
+# The hub accepts connections from readers that push their reads (JChip, and the Impinj and
+# Alien bridges, which speak JChip).  Readers that CrossMgr connects to and polls (RaceResult,
+# Ultra) keep their own listener threads.
+#
+# Each connection has its own LineProtocol instance, which splits the received bytes into
+# lines in place and sends the results to the ReadRing in one batch.
+# If the UI thread falls behind and the ring fills past highWater, the connections stop
+# reading from their sockets (TCP flow control then holds back the readers) until the
+# ring drains below lowWater.
+
+class ConnectionStats( object ):
+	def __init__( self, protocol ):
+		self.protocol = protocol
+		self.peer = None
+		self.reader = None					# Name the reader reports, if any.
+		self.tConnect = time.time()
+		self.tDisconnect = None
+		self.bytes = 0
+		self.lines = 0
+		self.reads = 0
+		self.errors = 0
+		self.pauses = 0
+		self.batches = 0
+		self.batchSecondsTotal = 0.0
+		self.batchSecondsMax = 0.0
+		self.lagLast = None					# Seconds from the read time to its arrival here.
+		self.lagMax = None
+
+	def addLag( self, lag ):
+		self.lagLast = lag
+		if self.lagMax is None or lag > self.lagMax:
+			self.lagMax = lag
+
+	def asDict( self ):
+		seconds = max( (self.tDisconnect or time.time()) - self.tConnect, 0.001 )
+		return {
+			'protocol': self.protocol,
+			'peer': self.peer,
+			'reader': self.reader,
+			'connected': self.tDisconnect is None,
+			'seconds': seconds,
+			'bytes': self.bytes,
+			'lines': self.lines,
+			'reads': self.reads,
+			'readsPerSecond': self.reads / seconds,
+			'errors': self.errors,
+			'pauses': self.pauses,
+			'batchSecondsAvg': self.batchSecondsTotal / self.batches if self.batches else None,
+			'batchSecondsMax': self.batchSecondsMax,
+			'lagLast': self.lagLast,
+			'lagMax': self.lagMax,
+		}
+
+class LineProtocol( asyncio.Protocol ):
+	'''
+		Base class of delimited line reader protocols.
+		Subclasses implement handleLine( line ) and call emit() and log() to send results to the UI.
+	'''
+	name = 'Reader'
+	delimiter = b'\r'
+	encoding = 'utf-8'
+	maxLineLength = 64 * 1024		# Discard the buffer if there is no delimiter by then.
+
+	def __init__( self, hub ):
+		self.hub = hub
+		self.transport = None
+		self.buffer = bytearray()
+		self.out = []
+		self.tReceived = None
+		self.stats = ConnectionStats( self.name )
+
+	def getName( self ):
+		return self.stats.reader or u'<unknown>'
+
+	def emit( self, item ):
+		self.out.append( item )
+
+	def log( self, category, message ):
+		self.out.append( (category, message) )
+		Utils.writeLog( u'{}: {}: {}'.format(self.name, category, message) )
+
+	def flush( self ):
+		if self.out:
+			self.hub.put( self, self.out )
+			self.out = []
+
+	def write( self, message ):
+		if self.transport and not self.transport.is_closing():
+			self.transport.write( message.encode() )
+
+	def close( self ):
+		if self.transport:
+			self.transport.close()
+
+	def connection_made( self, transport ):
+		self.transport = transport
+		self.stats.peer = transport.get_extra_info( 'peername' )
+		self.hub.connectionMade( self )
+		self.log( 'connection', 'established {}'.format(self.stats.peer) )
+		self.flush()
+
+	def connection_lost( self, exc ):
+		if exc:
+			self.log( 'connection', 'error: {}'.format(exc) )
+		self.log( 'connection', 'disconnected: {}'.format(self.getName()) )
+		self.flush()
+		self.hub.connectionLost( self )
+
+	def data_received( self, data ):
+		t = time.perf_counter()
+		self.tReceived = datetime.datetime.now()
+		stats = self.stats
+		stats.bytes += len(data)
+
+		buffer = self.buffer
+		buffer += data
+		end = buffer.rfind( self.delimiter )
+		if end < 0:
+			if len(buffer) > self.maxLineLength:
+				stats.errors += 1
+				self.log( 'error', 'no delimiter in {} bytes'.format(len(buffer)) )
+				self.flush()
+				del buffer[:]
+			return
+
+		# Decode each line straight from the buffer without copying the bytes first.
+		delimiter, encoding = self.delimiter, self.encoding
+		view = memoryview( buffer )
+		try:
+			i = 0
+			while i <= end:
+				j = buffer.find( delimiter, i, end + 1 )
+				line = str( view[i:j], encoding, 'replace' ).strip()
+				i = j + len(delimiter)
+				if not line:
+					continue
+				stats.lines += 1
+				try:
+					self.handleLine( line )
+				except (ValueError, KeyError, IndexError) as e:
+					stats.errors += 1
+					self.log( 'exception', '{}: {}'.format(line, e) )
+		finally:
+			view.release()
+		del buffer[:end + len(delimiter)]
+
+		self.flush()
+		self.endBatch()
+
+		t = time.perf_counter() - t
+		stats.batches += 1
+		stats.batchSecondsTotal += t
+		if t > stats.batchSecondsMax:
+			stats.batchSecondsMax = t
+
+	def handleLine( self, line ):
+		''' Called with each non-empty line, decoded and stripped.  Subclasses override this to parse it; the base class ignores it. '''
+		pass
+
+	def endBatch( self ):
+		pass
+
+class ReaderHub( object ):
+	highWater = 0.75		# Fraction of the ring capacity at which the connections stop reading.
+	lowWater = 0.25			# Fraction of the ring capacity at which they start again.
+	checkInterval = 0.05	# Seconds between checks of the ring while paused.
+	retrySeconds = 2.0		# Wait before trying a port that is still in use.
+	closedMax = 64			# Stats of closed connections kept.
+
+	def __init__( self, q, name = 'Reader Hub' ):
+		self.q = q
+		self.name = name
+		self.loop = None
+		self.thread = None
+		self.serverSpecs = []
+		self.servers = []
+		self.connections = set()
+		self.paused = set()
+		self.closed = deque( maxlen=self.closedMax )
+		self.readerNames = {}		# Reader name -> protocol, shared by all ports.
+
+	def addServer( self, protocolClass, host, port ):
+		''' Listen for connections of protocolClass readers.  May be called while running. '''
+		self.serverSpecs.append( (protocolClass, host, port) )
+		if self.loop:
+			asyncio.run_coroutine_threadsafe( self.startServer(protocolClass, host, port), self.loop )
+
+	def start( self ):
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread( target=self.run, name=self.name )
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop( self ):
+		if not self.loop:
+			return
+		if self.thread.is_alive():
+			self.loop.call_soon_threadsafe( self.loop.stop )
+			self.thread.join()
+		self.loop = None
+		self.thread = None
+
+	def isRunning( self ):
+		return self.thread is not None and self.thread.is_alive()
+
+	def getStats( self ):
+		''' Returns a list of stats dicts of the open connections followed by the recently closed ones. '''
+		connections = list( self.connections )
+		closed = list( self.closed )
+		return [p.stats.asDict() for p in connections] + [s.asDict() for s in closed]
+
+	#-----------------------------------------------------------------------
+	# Called on the event loop.
+
+	def run( self ):
+		loop = self.loop
+		asyncio.set_event_loop( loop )
+		loop.set_exception_handler( self.onException )
+		for protocolClass, host, port in self.serverSpecs:
+			loop.create_task( self.startServer(protocolClass, host, port) )
+		try:
+			loop.run_forever()
+		finally:
+			for p in list(self.connections):
+				p.close()
+			for server in self.servers:
+				server.close()
+			try:
+				loop.run_until_complete( asyncio.sleep(0) )	# Let the transports close.
+				for task in asyncio.all_tasks( loop ):
+					task.cancel()
+				loop.run_until_complete( asyncio.sleep(0) )
+			finally:
+				loop.close()
+
+	def onException( self, loop, context ):
+		e = context.get( 'exception' )
+		if e:
+			Utils.logException( e, (type(e), e, e.__traceback__) )
+		else:
+			Utils.writeLog( u'{}: {}'.format(self.name, context.get('message')) )
+
+	async def startServer( self, protocolClass, host, port ):
+		while True:
+			try:
+				server = await self.loop.create_server( lambda: protocolClass(self), host, port, reuse_address=True )
+			except OSError as e:
+				if e.errno in (errno.EADDRINUSE, 48):
+					await asyncio.sleep( self.retrySeconds )
+					continue
+				raise
+			self.servers.append( server )
+			return server
+
+	def connectionMade( self, protocol ):
+		self.connections.add( protocol )
+
+	def connectionLost( self, protocol ):
+		self.connections.discard( protocol )
+		self.paused.discard( protocol )
+		if self.readerNames.get( protocol.stats.reader ) is protocol:
+			del self.readerNames[protocol.stats.reader]
+		protocol.stats.tDisconnect = time.time()
+		self.closed.append( protocol.stats )
+
+	def setReaderName( self, protocol, name ):
+		''' Returns the connection previously used by this reader, if any. '''
+		previous = self.readerNames.get( name )
+		self.readerNames[name] = protocol
+		protocol.stats.reader = name
+		return previous if previous is not protocol else None
+
+	def put( self, protocol, items ):
+		q = self.q
+		q.putMany( items )
+		if q.qsize() >= q.capacity * self.highWater and protocol.transport and protocol not in self.paused:
+			protocol.transport.pause_reading()
+			protocol.stats.pauses += 1
+			if not self.paused:
+				self.loop.call_later( self.checkInterval, self.checkResume )
+			self.paused.add( protocol )
+
+	def checkResume( self ):
+		if not self.paused:
+			return
+		if self.q.qsize() > self.q.capacity * self.lowWater:
+			self.loop.call_later( self.checkInterval, self.checkResume )
+			return
+		for p in self.paused:
+			if p.transport and not p.transport.is_closing():
+				p.transport.resume_reading()
+		self.paused.clear()
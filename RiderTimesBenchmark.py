@@ -0,0 +1,75 @@
+import sys
+import time
+import random
+import tracemalloc
+import six
+import six.moves.cPickle as pickle
+import Model
+
+#------------------------------------------------------------------------------
+# Compare memory, pickle size and speed of list and array('d') rider times.
+#
+#	python RiderTimesBenchmark.py [riders] [laps]
+
+def makeRace( riders, laps, compactTimes ):
+	Model.Rider.compactTimes = compactTimes
+	race = Model.newRace()
+	race.setCategories( [{'name':'Open', 'catStr':'1-{}'.format(riders), 'startOffset':'00:00', 'distance':1.0}] )
+	rng = random.Random( 1 )
+	for num in six.moves.range(1, riders+1):
+		rider = race.getRider( num )
+		lapTime = rng.uniform( 240.0, 360.0 )
+		t = 0.0
+		for lap in six.moves.range(laps):
+			t += lapTime * rng.uniform( 0.95, 1.05 )
+			rider.addTime( t )
+	return race
+
+def timeIt( f ):
+	t = time.perf_counter()
+	f()
+	return time.perf_counter() - t
+
+def benchmark( riders, laps, compactTimes ):
+	tracemalloc.start()
+	tBuild = timeIt( lambda: makeRace(riders, laps, compactTimes) )
+	race = Model.race
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	# Insert a time in the middle of every rider's laps.
+	rng = random.Random( 2 )
+	def insert():
+		for rider in six.itervalues(race.riders):
+			rider.addTime( rider.times[len(rider.times)//2] + rng.uniform(-1.0, 1.0) )
+	tInsert = timeIt( insert )
+
+	tClean = timeIt( lambda: [rider.getCleanLapTimes() for rider in six.itervalues(race.riders)] )
+	tInterpolate = timeIt( lambda: [rider.interpolate() for rider in six.itervalues(race.riders)] )
+
+	tPickle = time.perf_counter()
+	data = pickle.dumps( race, 2 )
+	tPickle = time.perf_counter() - tPickle
+	tUnpickle = timeIt( lambda: pickle.loads(data) )
+
+	return {
+		'memoryMB': memory / (1024.0*1024.0),
+		'pickleMB': len(data) / (1024.0*1024.0),
+		'build': tBuild,
+		'insert': tInsert,
+		'getCleanLapTimes': tClean,
+		'interpolate': tInterpolate,
+		'pickle': tPickle,
+		'unpickle': tUnpickle,
+	}
+
+if __name__ == '__main__':
+	riders = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	laps = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+	results = [(name, benchmark(riders, laps, compactTimes)) for name, compactTimes in (('list', False), ('array', True))]
+	keys = list( results[0][1].keys() )
+	print( 'riders={} laps={}'.format(riders, laps) )
+	print( '{:<18}'.format('') + ''.join( '{:>12}'.format(name) for name, r in results ) )
+	for k in keys:
+		print( '{:<18}'.format(k) + ''.join( '{:>12.3f}'.format(r[k]) for name, r in results ) )
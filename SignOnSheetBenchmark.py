@@ -0,0 +1,92 @@
+import sys
+import time
+import random
+import datetime
+import Model
+from ReadSignOnSheet import ExcelLink, DiffInfo, MakeTagNums, UpdateTagNums, Fields
+
+#------------------------------------------------------------------------------
+# Compare a full reload of a sign-on sheet with the incremental update of the race
+# when a few rows change, as happens when the registration desk saves the sheet.
+#
+#	python SignOnSheetBenchmark.py [rows] [changes]
+
+headers = ['Bib#', 'LastName', 'FirstName', 'Team', 'Category', 'Gender', 'Tag', 'Tag2']
+
+class SyntheticReader( object ):
+	sheetName = 'Registration'
+
+	def __init__( self, rows ):
+		self.rows = rows
+
+	def sheet_names( self ):
+		return [self.sheetName]
+
+	def iter_list( self, sname, date_as_tuple=False ):
+		yield headers
+		for row in self.rows:
+			yield row
+
+def makeRows( count, rng ):
+	return [
+		[num, u'Last{}'.format(num), u'First{}'.format(num), u'Team{}'.format(num % 97), u'Cat{}'.format(num % 7),
+			rng.choice(('M', 'F')), u'{:06X}'.format(0xA00000 + num), u'{:06X}'.format(0xB00000 + num)]
+		for num in range(1, count + 1)
+	]
+
+def changeRows( rows, changes, rng ):
+	rows = [list(row) for row in rows]
+	for row in rng.sample( rows, changes ):
+		row[3] = u'NewTeam'
+		row[6] = u'{:06X}'.format(0xC00000 + row[0])
+	del rows[:changes]
+	numMax = max( row[0] for row in rows )
+	rows.extend( makeRows(numMax + changes, rng)[numMax:] )
+	return rows
+
+def timeIt( f ):
+	t = time.perf_counter()
+	r = f()
+	return time.perf_counter() - t, r
+
+def benchmark( count, changes ):
+	rng = random.Random( 1 )
+	race = Model.newRace()
+	race.startTime = datetime.datetime.now()		# Don't read categories and properties.
+
+	link = ExcelLink()
+	link.setSheetName( SyntheticReader.sheetName )
+	link.setFieldCol( {f: headers.index(f) if f in headers else -1 for f in Fields} )
+	race.excelLink = link
+
+	rows = makeRows( count, rng )
+	reader = SyntheticReader( rows )
+	tParse, (info, errors) = timeIt( lambda: link.parse(reader) )
+	link.apply( (0.0, None, link.sheetName, link.fieldCol), reader, info, errors )
+	tagFields = link.getTagFields()
+	race.tagNums = MakeTagNums( info, tagFields )
+
+	reader = SyntheticReader( changeRows(rows, changes, rng) )
+	infoNew, errors = link.parse( reader )
+	tDiff, (added, changed, removed) = timeIt( lambda: DiffInfo(info, infoNew) )
+	tagNums = dict( race.tagNums )
+	tUpdate, r = timeIt( lambda: UpdateTagNums(tagNums, info, infoNew, added + changed + removed, tagFields) )
+	tRebuild, tagNumsNew = timeIt( lambda: MakeTagNums(infoNew, tagFields) )
+	assert tagNums == tagNumsNew
+	tApply, r = timeIt( lambda: link.apply( (1.0, None, link.sheetName, link.fieldCol), reader, infoNew, errors ) )
+
+	return [
+		('rows', count),
+		('added/changed/removed', '{}/{}/{}'.format(len(added), len(changed), len(removed))),
+		('parse', tParse),
+		('diff', tDiff),
+		('tagNums rebuild', tRebuild),
+		('tagNums update', tUpdate),
+		('apply', tApply),
+	]
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	changes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+	for name, v in benchmark( count, changes ):
+		print( '{:<24}{:>12}'.format(name, '{:.4f}'.format(v) if isinstance(v, float) else v) )
@@ -3,11 +3,11 @@ import random
 import bisect
 from Names import GetNameTeam
 
-def SimulateData( riders=200 ):
+def SimulateData( riders=200, raceMinutes=8, waves=2, seed=10101021 ):
 	# Generate random rider events.
-	random.seed( 10101021 )
+	# Riders are split evenly into waves.  Each wave starts startOffset seconds after the previous one and is 15% slower.
+	random.seed( seed )
 
-	raceMinutes = 8
 	mean = 8*60.0 / 8	# Average lap time.
 	var = mean/20.0		# Variance between riders.
 	lapsTotal = int(raceMinutes * 60 / mean + 3)
@@ -19,18 +19,16 @@ def SimulateData( riders=200 ):
 			break
 	numStart = nMid - riders//2
 	startOffset = 10
+	waveStarts = [numStart + riders * w // waves for w in six.moves.range(1, waves)]	# First bib of each wave after the first.
 
 	lapTimes = []
 	riderInfo = []
 	for num in six.moves.range(numStart,numStart+riders+1):
 		t = 0
-		if num < numStart + riders // 2:
-			mu = random.normalvariate( mean, mean/20.0 )			# Rider's random average lap time.
-			riderInfo.append( [num] + list(GetNameTeam(True)) )
-		else:
-			mu = random.normalvariate( mean * 1.15, mean/20.0 )		# These riders are slower, on average.
-			riderInfo.append( [num] + list(GetNameTeam(False)) )
-			t += startOffset										# Account for offset start.
+		wave = bisect.bisect_right( waveStarts, num )
+		mu = random.normalvariate( mean * (1.0 + 0.15 * wave), mean/20.0 )	# Rider's random average lap time.  Later waves are slower.
+		riderInfo.append( [num] + list(GetNameTeam(wave % 2 == 0)) )
+		t += startOffset * wave									# Account for offset start.
 		for laps in six.moves.range(lapsTotal):
 			t += random.normalvariate( mu, var/2.0 )	# Rider's lap time.
 			if random.random() > errorPercent:		# Respect error rate.
@@ -70,9 +68,15 @@ def SimulateData( riders=200 ):
 			lastLapFinishers.append( (t, n) )
 			
 	lapTimes.extend( lastLapFinishers )
+	names = ['Junior', 'Senior'] if waves == 2 else ['Wave {}'.format(w+1) for w in six.moves.range(waves)]
+	bounds = [numStart] + waveStarts + [numStart + riders + 1]
 	categories = [
-		{'name':'Junior', 'catStr':'{}-{}'.format(nMid-riders//2,nMid-1), 'startOffset':'00:00', 'distance':0.5, 'gender':'Men', 'numLaps':5},
-		{'name':'Senior', 'catStr':'{}-{}'.format(nMid,nMid+riders//2), 'startOffset':'00:{:02d}'.format(startOffset), 'distance':0.5, 'gender':'Women', 'numLaps':4}
+		{
+			'name':names[w], 'catStr':'{}-{}'.format(bounds[w], bounds[w+1]-1),
+			'startOffset':'{:02d}:{:02d}'.format(*divmod(startOffset * w, 60)), 'distance':0.5,
+			'gender':'Men' if w % 2 == 0 else 'Women', 'numLaps':max(1, lapsTotal - 6 - w),
+		}
+		for w in six.moves.range(waves)
 	]
 	
 	return {
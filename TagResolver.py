@@ -0,0 +1,110 @@
+import six
+import Utils
+
+#------------------------------------------------------------------------------
+# Chip tags in the sign-on sheet and from the readers come in different formats:
+# JChip tags are 6 hex digits, Orion tags 16 decimal digits, both zero filled,
+# and people type l and O for 1 and 0 (fixed in the sheet tags for those readers).
+# The sheet tags and the reader tags are reduced to the same key by NormalizeTag before matching.
+
+JChipTagLength = 6
+OrionTagLength = 16
+
+if six.PY2:
+	import string
+	trantab = string.maketrans( 'lOo', '100' ) # Translate lower-case l's to ones and Os to zeros.
+	def GetCleanTag( tag ):
+		return six.text_type(tag).translate(trantab, ' \t\n\r')	# Also, remove any extra spaces.
+else:
+	trantab = str.maketrans( 'lOo', '100', ' \t\n\r' ) # Translate lower-case l's to ones and Os to zeros. Also, remove any extra spaces.
+	def GetCleanTag( tag ):
+		return six.text_type(tag).translate(trantab)
+
+def FixJChipTag( tag ):
+	return GetCleanTag(tag).zfill(JChipTagLength)
+
+def FixOrionTag( tag ):
+	return GetCleanTag(tag).zfill(OrionTagLength)
+
+def NormalizeTag( tag ):
+	''' Returns the key of a tag in race.tagNums.  The same for a tag in the JChip or Orion format or with leading zeros removed. '''
+	return Utils.removeDiacritic(six.text_type(tag or '')).lstrip('0').upper()
+
+class TagResolver( object ):
+	'''
+		Resolves chip tags from the readers to bibs.
+
+		race.tagNums is keyed by NormalizeTag of every tag field in the sheet, so a bib can have any number of tags.
+		Each tag sent by a reader is normalized the first time it is seen, so a read is resolved in two dict lookups.
+	'''
+	normalizedMax = 1 << 16		# Limit the memory used by unknown tags.
+
+	def __init__( self ):
+		self.tagNums = {}
+		self.normalized = {}
+		self.resetStats()
+
+	def resetStats( self ):
+		self.hits = 0
+		self.misses = 0
+		self.reconciled = 0
+
+	def setTagNums( self, tagNums ):
+		self.tagNums = tagNums or {}
+
+	def getKey( self, tag ):
+		try:
+			return self.normalized[tag]
+		except KeyError:
+			if len(self.normalized) >= self.normalizedMax:
+				self.normalized.clear()
+			key = self.normalized[tag] = NormalizeTag( tag )		# The same as the sheet keys (see ReadSignOnSheet.GetRiderTags).
+			return key
+
+	def resolve( self, tag ):
+		''' Returns the bib of the tag, or None.  Raises TypeError or ValueError for an invalid tag. '''
+		num = self.tagNums.get( self.getKey(tag) )
+		if num is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return num
+
+	def getTags( self, num ):
+		return sorted( tag for tag, n in six.iteritems(self.tagNums) if n == num )
+
+	def reconcile( self, race ):
+		'''
+			Add the times of unmatched tags that now match a bib to the race in one update.
+			Returns the number of times added.
+		'''
+		if not race.unmatchedTags:
+			return 0
+		getKey, tagNums = self.getKey, self.tagNums
+		numTimes = []
+		unmatchedTags = {}
+		for tag, times in six.iteritems(race.unmatchedTags):
+			num = tagNums.get( getKey(tag) )
+			if num is None:
+				unmatchedTags[tag] = times
+			else:
+				numTimes.extend( (num, t) for t in times )
+		if numTimes:
+			race.unmatchedTags = unmatchedTags
+			race.addTimes( numTimes )
+			self.reconciled += len(numTimes)
+		return len(numTimes)
+
+	def getStats( self ):
+		lookups = self.hits + self.misses
+		return {
+			'tags': len(self.tagNums),
+			'bibs': len(set(six.itervalues(self.tagNums))),
+			'hits': self.hits,
+			'misses': self.misses,
+			'hitRatio': float(self.hits) / lookups if lookups else None,
+			'reconciled': self.reconciled,
+		}
+
+# Global singleton for this module.
+tagResolver = TagResolver()
@@ -0,0 +1,27 @@
+import six
+from TagResolver import TagResolver
+from ReadSignOnSheet import MakeTagNums
+
+#------------------------------------------------------------------------------
+# Check that the tags from the readers are resolved with the same keys as the sign-on sheet tags.
+#
+#	python TagResolverTest.py
+
+def test_resolve_sheet_tags():
+	externalInfo = {
+		101: {'Tag': 'KXO4512'},
+		102: {'Tag': 'E2000 1234'},
+		103: {'Tag': '000A1B2C', 'Tag2': '1234567890123456'},
+	}
+	tagResolver = TagResolver()
+	tagResolver.setTagNums( MakeTagNums(externalInfo, ('Tag', 'Tag2')) )
+	assert tagResolver.resolve( 'KXO4512' ) == 101
+	assert tagResolver.resolve( 'E2000 1234' ) == 102
+	assert tagResolver.resolve( 'a1b2c' ) == 103
+	assert tagResolver.resolve( '0A1B2C' ) == 103
+	assert tagResolver.resolve( '001234567890123456' ) == 103
+	assert tagResolver.resolve( 'UNKNOWN' ) is None
+
+if __name__ == '__main__':
+	test_resolve_sheet_tags()
+	six.print_( 'passed' )
@@ -17,6 +17,7 @@ import Utils
 import Model
 from threading import Thread as Process
 from six.moves.queue import Queue, Empty
+from ChipIngest import ReadRing
 import JChip
 
 ChipReaderEvent, EVT_CHIP_READER = JChip.ChipReaderEvent, JChip.EVT_CHIP_READER
@@ -256,13 +257,7 @@ def Server( q, shutdownQ, HOST, PORT, startTime ):
 		pass
 		
 def GetData():
-	data = []
-	while 1:
-		try:
-			data.append( q.get_nowait() )
-		except (Empty, AttributeError):
-			break
-	return data
+	return q.drain() if q else []
 
 def StopListener():
 	global q
@@ -301,7 +296,7 @@ def StartListener( startTime=now(), HOST=None, PORT=None ):
 		HOST = (HOST or Model.race.chipReaderIpAddr)
 		PORT = (PORT or Model.race.chipReaderPort)
 	
-	q = Queue()
+	q = ReadRing()
 	shutdownQ = Queue()
 	listener = Process( target = Server, args=(q, shutdownQ, HOST, PORT, startTime) )
 	listener.name = 'Ultra Listener'
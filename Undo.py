@@ -1,64 +1,210 @@
 import Model
 from Utils import updateUndoStatus
 from Utils import logCall
+import six
 import six.moves.cPickle as pickle
-import pickletools
+from contextlib import contextmanager
+
+#------------------------------------------------------------------------------
+# Undo states are stored as differences.
+#
+# The race is split into parts that are pickled independently: one per rider, one for each
+# large independent attribute, and one for the rest of the race attributes.
+# Each step between two saved states keeps only the parts that changed (before and after),
+# so an edit to one rider costs one rider, not the whole race.
+#
+# Times added by the chip reads (inside recordingReads) after a state was saved are recorded.
+# They are replayed onto the riders restored by an undo or redo, so undo also works while the race
+# is running without losing the tag reads that came in since.  Time edits made by the user are not
+# recorded, so undo reverses them.
+# The race attributes updated by the tag reads and the file save are not part of the undo state.
+
+class UndoStep( object ):
+	__slots__ = ('diff', 'ops', 'size')
+
+	def __init__( self, diff, ops ):
+		self.diff = diff		# key -> (before, after).  None means the part does not exist.
+		self.ops = ops			# (op, num, t) recorded between the before and after states.
+		self.size = sum( len(b or b'') + len(a or b'') for b, a in six.itervalues(diff) ) + 64*len(ops)
 
 class Undo( object ):
-	def __init__( self ):
+	maxDepth = 200						# Maximum number of undo steps.
+	memoryBudget = 64*1024*1024			# Maximum bytes held by the undo steps.
+	separateAttrs = ('geoTrack',)		# Large race attributes that are not referenced by anything else.
+	liveAttrs = (						# Race attributes that are kept as they are on undo and redo.
+		'unmatchedTags', 'missingTags', 'tagNums',
+		'isChangedFlag', 'lastChangedTime',
+		'snapshotRequired', 'journalId', 'journalSeq',
+	)
+
+	def __init__( self, maxDepth = None, memoryBudget = None ):
+		if maxDepth is not None:
+			self.maxDepth = maxDepth
+		if memoryBudget is not None:
+			self.memoryBudget = memoryBudget
+		self.replaying = False
+		self.recording = False
 		self.clear()
+		Model.timeOpListeners.append( self.onTimeOp )
 
 	def clear( self ):
-		self.undoStack = []
+		self.steps = []			# steps[i] goes from state i to state i+1.
+		self.top = None			# Parts of the state the race is in (state iCur).
+		self.race = None
+		self.iCur = None
 		self.iUndo = None
+		self.ops = []			# Time ops since state iCur was saved or restored.
+		self.size = 0
+
+	def numStates( self ):
+		return len(self.steps) + 1 if self.top is not None else 0
+
+	def getParts( self, race ):
+		parts = { ('r', num): pickle.dumps(rider, 2) for num, rider in six.iteritems(race.riders) }
+		state = race.__dict__.copy()
+		state.pop( 'riders', None )
+		for a in self.liveAttrs:
+			state.pop( a, None )
+		for a in self.separateAttrs:
+			if a in state:
+				parts[('a', a)] = pickle.dumps( state.pop(a), 2 )
+		parts[('race',)] = pickle.dumps( state, 2 )
+		return parts
+
+	def setParts( self, race, parts ):
+		for key, data in six.iteritems(parts):
+			if key[0] == 'r':
+				if data is None:
+					race.riders.pop( key[1], None )
+				else:
+					race.riders[key[1]] = pickle.loads( data )
+			elif key[0] == 'a':
+				if data is None:
+					race.__dict__.pop( key[1], None )
+				else:
+					setattr( race, key[1], pickle.loads(data) )
+			else:
+				state = pickle.loads( data )
+				for a in list(race.__dict__):
+					if a != 'riders' and a not in self.separateAttrs and a not in self.liveAttrs and a not in state:
+						del race.__dict__[a]
+				race.__dict__.update( state )
+
+			if data is None:
+				self.top.pop( key, None )
+			else:
+				self.top[key] = data
+
+	@contextmanager
+	def recordingReads( self ):
+		''' Time ops made in the block are reads from the chip readers, and are replayed on undo and redo. '''
+		self.recording = True
+		try:
+			yield
+		finally:
+			self.recording = False
 	
-	def getState( self ):
-		with Model.LockRace() as race:
-			if not race or race.isRunning():
-				return None
-			return pickletools.optimize( pickle.dumps(race, 2) )
-	
+	def onTimeOp( self, race, op, num, t ):
+		if self.recording and not self.replaying and race is self.race:
+			self.ops.append( (op, num, t) )
+
+	def replayOps( self, race, keys, ops ):
+		# The ops are already in the journal.  Don't write them again.
+		self.replaying = True
+		journal, Model.journal = Model.journal, None
+		try:
+			for op, num, t in ops:
+				if ('r', num) not in keys:
+					continue
+				if op == 'a':
+					race.addTime( num, t, doSetChanged=False )
+				else:
+					race.deleteTime( num, t )
+		finally:
+			Model.journal = journal
+			self.replaying = False
+
 	def pushState( self ):
 		''' Save the state of the model and remove any redo states. '''
 		if self.iUndo is not None:
-			del self.undoStack[self.iUndo+1:]
+			removed = self.steps[self.iUndo:]
+			del self.steps[self.iUndo:]
+			self.ops = [op for step in removed for op in step.ops] + self.ops
+			self.size -= sum( step.size for step in removed )
 			self.iUndo = None
 			return False
-			
-		self.iUndo = None
-		sNew = self.getState()
-		if not sNew or (self.undoStack and self.undoStack[-1] == sNew):
+
+		with Model.LockRace() as race:
+			if not race:
+				return False
+			if race is not self.race:
+				self.clear()
+				self.race = race
+			parts = self.getParts( race )
+
+		if self.top is None:
+			self.top, self.iCur, self.ops = parts, 0, []
+			updateUndoStatus()
+			return True
+
+		diff = {}
+		for key, data in six.iteritems(parts):
+			before = self.top.get( key )
+			if before != data:
+				diff[key] = (before, data)
+		for key, before in six.iteritems(self.top):
+			if key not in parts:
+				diff[key] = (before, None)
+		if not diff:
 			return False
-		
-		self.undoStack.append( sNew )
+
+		step = UndoStep( diff, self.ops )
+		self.steps.append( step )
+		self.size += step.size
+		self.top, self.ops = parts, []
+
+		while self.steps and (len(self.steps) > self.maxDepth or (len(self.steps) > 1 and self.size > self.memoryBudget)):
+			self.size -= self.steps.pop( 0 ).size
+		self.iCur = len(self.steps)
+
 		updateUndoStatus()
 		return True
-		
+
 	def setState( self ):
 		if self.iUndo is None:
 			return
 		with Model.LockRace() as race:
-			raceNew = pickle.loads( self.undoStack[self.iUndo] )
-			Model.setRace( raceNew )
+			if race is not self.race:
+				return
+			while self.iCur > self.iUndo:
+				self.iCur -= 1
+				step = self.steps[self.iCur]
+				self.setParts( race, {key: before for key, (before, after) in six.iteritems(step.diff)} )
+				self.replayOps( race, step.diff, [op for s in self.steps[self.iCur:] for op in s.ops] + self.ops )
+			while self.iCur < self.iUndo:
+				step = self.steps[self.iCur]
+				self.iCur += 1
+				self.setParts( race, {key: after for key, (before, after) in six.iteritems(step.diff)} )
+				self.replayOps( race, step.diff, [op for s in self.steps[self.iCur:] for op in s.ops] + self.ops )
+			Model.setRace( race )
 		updateUndoStatus()
 
 	def isUndo( self ):
 		if self.iUndo is not None:
 			return self.iUndo > 0
 		else:
-			return self.undoStack
+			return self.numStates() > 0
 
 	def isRedo( self ):
-		return self.iUndo is not None and self.iUndo != len(self.undoStack) - 1
-	
+		return self.iUndo is not None and self.iUndo != self.numStates() - 1
+
 	@logCall
 	def doUndo( self ):
 		if not self.isUndo():
 			return False
 		if self.iUndo is None:
-			iUndoStart = len(self.undoStack) - 1
-			self.pushState()
-			self.iUndo = iUndoStart
+			pushed = self.pushState()
+			self.iUndo = max( 0, self.numStates() - (2 if pushed else 1) )
 		else:
 			self.iUndo -= 1
 		self.setState()
@@ -0,0 +1,54 @@
+import six
+import Model
+from Undo import Undo
+
+#------------------------------------------------------------------------------
+# Check that undo reverses time edits made by the user, and keeps the chip reads
+# that arrived after the edit.
+#
+#	python UndoTest.py
+
+def makeRace():
+	race = Model.Race()
+	Model.setRace( race )
+	for t in (100.0, 200.0, 300.0):
+		race.addTime( 1, t )
+	return race
+
+def test_undo_delete():
+	race = makeRace()
+	undo = Undo()
+	undo.pushState()
+	race.deleteTime( 1, 200.0 )
+	assert race.riders[1].times == [100.0, 300.0]
+	undo.doUndo()
+	assert race.riders[1].times == [100.0, 200.0, 300.0]
+	undo.doRedo()
+	assert race.riders[1].times == [100.0, 300.0]
+
+def test_undo_add():
+	race = makeRace()
+	undo = Undo()
+	undo.pushState()
+	race.addTime( 1, 150.0 )
+	race.addTime( 1, 250.0 )
+	assert race.riders[1].times == [100.0, 150.0, 200.0, 250.0, 300.0]
+	undo.doUndo()
+	assert race.riders[1].times == [100.0, 200.0, 300.0]
+
+def test_undo_keeps_reads():
+	race = makeRace()
+	undo = Undo()
+	undo.pushState()
+	race.deleteTime( 1, 200.0 )
+	with undo.recordingReads():
+		race.addTimes( [(1, 400.0), (2, 410.0)] )
+	undo.doUndo()
+	assert race.riders[1].times == [100.0, 200.0, 300.0, 400.0]
+	assert race.riders[2].times == [410.0]
+
+if __name__ == '__main__':
+	test_undo_delete()
+	test_undo_add()
+	test_undo_keeps_reads()
+	six.print_( 'passed' )
@@ -797,6 +797,37 @@ def dict_compare(d_new, d_old):
 		'm':{o:d_new[o] for o in d_new_keys.intersection(d_old_keys) if d_new[o] != d_old[o]},
 	}
 
+def dict_delta(d_new, d_old):
+	'''
+		Like dict_compare, but modified values that are dicts are sent as changes to their fields:
+			p:			{key: {field: new value}} for changed fields
+			e:			{key: {field: appended items}} for list fields that only grew at the end
+		Other modified values are in 'm' as before.
+	'''
+	delta = dict_compare( d_new, d_old )
+	modified, patched, extended = delta['m'], {}, {}
+	for o in list(modified.keys()):
+		v_new, v_old = d_new[o], d_old[o]
+		if not (isinstance(v_new, dict) and isinstance(v_old, dict)) or set(v_new.keys()) != set(v_old.keys()):
+			continue
+		p, e = {}, {}
+		for f, v in six.iteritems(v_new):
+			w = v_old[f]
+			if v == w:
+				continue
+			if isinstance(v, list) and isinstance(w, list) and len(v) > len(w) and v[:len(w)] == w:
+				e[f] = v[len(w):]
+			else:
+				p[f] = v
+		if p:
+			patched[o] = p
+		if e:
+			extended[o] = e
+		del modified[o]
+	delta['p'] = patched
+	delta['e'] = extended
+	return delta
+
 def GetContrastTextColour( backgroundColour ):
 	r, g, b = backgroundColour.Get( False )
 	yiq = ((r*299)+(g*587)+(b*114))/1000.0
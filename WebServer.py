@@ -8,6 +8,7 @@ import glob
 import time
 import json
 import base64
+import hashlib
 urllib = six.moves.urllib
 from six.moves.urllib.parse import quote
 from six.moves.urllib.request import url2pathname
@@ -15,7 +16,7 @@ import socket
 import datetime
 import traceback
 import threading
-from collections import defaultdict
+from collections import defaultdict, deque
 from six.moves.queue import Queue, Empty
 try:
     # Python 2.x
@@ -34,10 +35,17 @@ from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 StringIO = six.StringIO
 import Utils
 import Model
-from GetResults import GetResultsRAM, GetResultsBaseline, GetRaceName
+from GetResults import GetResultsRAM, GetResultsBaseline, GetResultsSince, GetRaceName
 from Synchronizer import syncfunc
 
 from ThreadPoolMixIn import ThreadPoolMixIn
+from AsyncWebServer import AsyncWebServer
+
+# Set CrossMgrWebServer=async to serve the pages and the WebSocket feeds from one asyncio loop.
+# Use it when many spectators are connected.
+asyncMode = (os.environ.get('CrossMgrWebServer', None) == 'async')
+asyncServer = None
+
 class CrossMgrServer(ThreadPoolMixIn, HTTPServer):
     pass
 
@@ -85,6 +93,45 @@ def gzipEncode( content ):
 def validContent( content ):
 	return content.strip().endswith( '</html>' )
 
+def makeETag( content ):
+	return '"{}"'.format( hashlib.sha1(content).hexdigest()[:24] )
+
+payloadStart = u'/* !!! payload begin !!! */'
+payloadEnd = u'/* !!! payload end !!! */'
+payloadJsonLoader = u'function LoadPayloadJson('		# Pages with this function can load the payload from <page>.json.
+
+def makePageTemplate( content ):
+	'''
+		Returns the page with the payload replaced by a request for <page>.json, if the page supports it.
+		The template only changes when the html around the payload changes, so browsers keep it
+		and only fetch the json when the race changes.
+	'''
+	if payloadJsonLoader not in content:
+		return content
+	try:
+		iStart = content.index( payloadStart ) + len(payloadStart)
+		iEnd = content.index( payloadEnd, iStart )
+	except ValueError:
+		return content
+	return u''.join( (content[:iStart], u"\nvar payload = 'json';\n", content[iEnd:]) )
+
+def makeCacheEntry( content, mtime ):
+	'''
+		Returns a cache entry with everything a request needs: the page template, the payload as json, the gzip versions and the ETags.
+		Built once per change so requests only send bytes.
+	'''
+	cache = {'mtime': mtime}
+	content = content.decode('utf-8') if isinstance(content, bytes) else content
+	result = ParseHtmlPayload( content=content )
+	cache['payload'] = result['payload'] if result['success'] else {}
+	cache['content'] = makePageTemplate( content ).encode('utf-8')
+	cache['gzip_content'] = gzipEncode( cache['content'] )
+	cache['etag'] = makeETag( cache['content'] )
+	cache['payload_json'] = json.dumps( cache['payload'], default=str, separators=(',',':') ).encode()
+	cache['payload_gzip'] = gzipEncode( cache['payload_json'] )
+	cache['payload_etag'] = makeETag( cache['payload_json'] )
+	return cache
+
 @syncfunc
 def getCurrentHtml():
 	return Model.getCurrentHtml()
@@ -119,12 +166,73 @@ class ContentBuffer( object ):
 	Changed = 1
 	ReadError = 2
 	ContentError = 3
+	
+	buildWaitSeconds = 10.0		# Longest time a request waits for a page that is being built.
 
 	def __init__( self ):
 		self.fileCache = {}
 		self.fnameRace = None
 		self.dirRace = None
 		self.lock = threading.Lock()
+		self.condition = threading.Condition( self.lock )
+		self.building = set()
+	
+	def _build( self, fname, builder, *args ):
+		'''
+			Builds the cache entry of a page with builder(*args) in a separate thread, outside the lock.
+			Requests that arrive while the page is being built wait for the same build.
+			Call with the lock held.
+		'''
+		if fname not in self.building:
+			self.building.add( fname )
+			thread = threading.Thread( target=self._runBuild, args=(fname, builder) + args, name='ContentBuilder' )
+			thread.daemon = True
+			thread.start()
+		self.condition.wait_for( lambda: fname not in self.building, self.buildWaitSeconds )
+	
+	def _runBuild( self, fname, builder, *args ):
+		cache = None
+		try:
+			cache = builder( *args )
+		except Exception as e:
+			Utils.logException( e, sys.exc_info() )
+		with self.condition:
+			self.building.discard( fname )
+			if cache:
+				self.fileCache[fname] = cache
+			self.condition.notify_all()
+	
+	def _buildPage( self, fname ):
+		# Renders a page of the current race.
+		tStart = time.time()
+		if '_TTCountdown' in fname:
+			content = getCurrentTTCountdownHtml()
+		elif '_TTStartList' in fname:
+			content = getCurrentTTStartListHtml()
+		else:
+			content = getCurrentHtml()
+		if not content:
+			return None
+		cache = makeCacheEntry( content, tStart )
+		cache['status'] = self.Changed
+		return cache
+	
+	def _readFile( self, fnameFull, mtime ):
+		# Reads a page of another race from the disk.  Returns None if it cannot be read.
+		try:
+			with io.open(fnameFull, encoding='utf-8') as f:
+				content = f.read()
+		except Exception:
+			return None
+		
+		status = self.Changed
+		if not validContent(content):
+			status = self.ContentError
+			content = ''
+			
+		cache = makeCacheEntry( content, mtime )
+		cache['status'] = status
+		return cache
 	
 	def _updateFile( self, fname, forceUpdate=False ):
 		if not self.fnameRace:
@@ -143,27 +251,8 @@ class ContentBuffer( object ):
 		fnameFull = os.path.join( self.dirRace, fname )
 		if race and self.fnameRace and coreName(self.fnameRace) == coreName(fnameFull):
 			if forceUpdate or race.lastChangedTime > cache.get('mtime',0.0):
-				
-				if '_TTCountdown' in fname:
-					content = getCurrentTTCountdownHtml()
-				elif '_TTStartList' in fname:
-					content = getCurrentTTStartListHtml()
-				else:
-					content = getCurrentHtml()
-				
-				if content:
-					cache['mtime'] = time.time()
-					result = ParseHtmlPayload( content=content )
-					cache['payload'] = result['payload'] if result['success'] else {}
-					if six.PY2:
-						cache['content'] = content
-						cache['gzip_content'] = gzipEncode( content )
-					else:
-						cache['content'] = content.encode() if not isinstance(content, bytes) else content
-						cache['gzip_content'] = gzipEncode( content )
-					cache['status'] = self.Changed
-					self.fileCache[fname] = cache
-			
+				self._build( fname, self._buildPage, fname )
+				cache = self.fileCache.get( fname, cache )
 			return cache
 			
 		try:
@@ -176,25 +265,12 @@ class ContentBuffer( object ):
 			cache['status'] = self.Unchanged
 			return cache
 			
-		cache['status'] = self.Changed
-		try:
-			with io.open(fnameFull, encoding='utf-8') as f:
-				content = f.read()
-		except Exception as e:
+		self._build( fname, self._readFile, fnameFull, mtime )
+		cacheNew = self.fileCache.get( fname )
+		if cacheNew is None or cacheNew is cache:
 			cache['status'] = self.ReadError
 			return cache
-			
-		if not validContent(content):
-			cache['status'] = self.ContentError
-			content = ''
-			
-		cache['mtime'] = mtime
-		result = ParseHtmlPayload( content=content )
-		cache['payload'] = result['payload'] if result['success'] else {}
-		cache['content'] = content.encode('utf-8')
-		cache['gzip_content'] = gzipEncode( cache['content'] )
-		self.fileCache[fname] = cache
-		return cache
+		return cacheNew
 	
 	def reset( self ):
 		if self.fnameRace:
@@ -228,11 +304,20 @@ class ContentBuffer( object ):
 		return cache
 	
 	def getContent( self, fname, checkForUpdate=True ):
+		''' Returns the content, its gzip version and its ETag. '''
 		with self.lock:
 			cache = self._getCache( fname, checkForUpdate )
 			if cache:
-				return cache.get('content', ''), cache.get('gzip_content', None)
-			return '', None
+				return cache.get('content', b''), cache.get('gzip_content', None), cache.get('etag', None)
+			return b'', None, None
+	
+	def getPayload( self, fname, checkForUpdate=True ):
+		''' Returns the payload of the content as json, its gzip version and its ETag. '''
+		with self.lock:
+			cache = self._getCache( fname, checkForUpdate )
+			if cache and 'payload_json' in cache:
+				return cache['payload_json'], cache['payload_gzip'], cache['payload_etag']
+			return b'{}', None, None
 		
 	def getIndexInfo( self ):
 		with self.lock:
@@ -382,77 +467,114 @@ def WriteHtmlIndexPage():
 			f.write( getIndexPage(share=False) )
 	return fname
 
-class CrossMgrHandler( BaseHTTPRequestHandler ):
-	html_content = 'text/html; charset=utf-8'
-	json_content = 'application/json'
-	reLapCounterHtml = re.compile( r'^\/LapCounter[\d-]*\.html$' )
+html_content = 'text/html; charset=utf-8'
+json_content = 'application/json'
+reLapCounterHtml = re.compile( r'^\/LapCounter[\d-]*\.html$' )
+
+def GetResponse( path, requestHeaders ):
+	'''
+		Returns (status, headers, content) for a GET of path.
+		requestHeaders is a mapping of lower-case header names to values.
+		Shared by the threaded and the asyncio servers.
+	'''
+	up = urllib.parse.urlparse( path )
+	content, gzip_content, etag = None, None, None
+	try:
+		if up.path=='/':
+			content = getIndexPage()
+			content_type = html_content
+			assert isinstance( content, bytes )
+		elif up.path=='/favicon.ico':
+			content = favicon
+			content_type = 'image/x-icon'
+			assert isinstance( content, bytes )
+		elif reLapCounterHtml.match( up.path ):
+			content = getLapCounterHtml()
+			content_type = html_content
+			assert isinstance( content, bytes )
+		elif up.path=='/Announcer.html':
+			content = getAnnouncerHtml()
+			content_type = html_content
+			assert isinstance( content, bytes )
+		elif up.path=='/qrcode.html':
+			urlPage = GetCrossMgrHomePage()
+			content = getQRCodePage( urlPage )
+			content_type = html_content
+			assert isinstance( content, bytes )
+		elif up.path=='/servertimestamp.html':
+			content = Utils.ToJson( {
+					'servertime':time.time()*1000.0,
+					'requesttimestamp':float(up.query),
+				}
+			).encode()
+			content_type = json_content;
+			assert isinstance( content, bytes )
+		else:
+			file = None
+			isPayload = up.path.endswith( '.json' )
+			filePath = up.path[:-len('.json')] + '.html' if isPayload else up.path
+			
+			if filePath == '/CurrentResults.html':
+				try:
+					file = os.path.splitext(Model.race.getFileName())[0] + '.html'
+				except:
+					pass
+			
+			elif filePath == '/PreviousResults.html':
+				file = GetPreviousFileName()
+			
+			if file is None: 
+				file = url2pathname(os.path.basename(filePath))
+			if isPayload:
+				content, gzip_content, etag = contentBuffer.getPayload( file )
+				content_type = json_content
+			else:
+				content, gzip_content, etag = contentBuffer.getContent( file )
+				content_type = html_content
+			assert isinstance( content, bytes )
+	except Exception as e:
+		message = u'File Not Found: {} {}\n{}'.format(path, e, traceback.format_exc())
+		return 404, [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', len(message.encode()))], message.encode()
+	
+	headers = []
+	useGzip = gzip_content and 'gzip' in requestHeaders.get('accept-encoding', '')
+	if etag:
+		# The gzip version is a different representation, so it needs a different strong ETag.
+		if useGzip:
+			etag = etag[:-1] + '-gz"'
+		if etag in requestHeaders.get('if-none-match', ''):
+			headers.append( ('ETag', etag) )
+			headers.append( ('Cache-Control', 'no-cache, must-revalidate') )
+			return 304, headers, b''
 	
+	headers.append( ('Content-Type',content_type) )
+	if etag:
+		# Browsers revalidate on every request, and get a 304 if the page has not changed.
+		if useGzip:
+			content = gzip_content
+			headers.append( ('Content-Encoding', 'gzip') )
+		headers.append( ('ETag', etag) )
+		headers.append( ('Vary', 'Accept-Encoding') )
+		headers.append( ('Cache-Control', 'no-cache, must-revalidate') )
+	elif content_type == html_content:
+		if useGzip:
+			content = gzip_content
+			headers.append( ('Content-Encoding', 'gzip') )
+		headers.append( ('Cache-Control', 'no-cache, no-store, must-revalidate') )
+		headers.append( ('Pragma', 'no-cache') )
+		headers.append( ('Expires', '0') )
+	headers.append( ('Content-Length', len(content)) )
+	return 200, headers, content
+
+class CrossMgrHandler( BaseHTTPRequestHandler ):
 	def do_GET(self):
-		up = urllib.parse.urlparse( self.path )		
-		content, gzip_content = None,  None
-		try:
-			if up.path=='/':
-				content = getIndexPage()
-				content_type = self.html_content
-				assert isinstance( content, bytes )
-			elif up.path=='/favicon.ico':
-				content = favicon
-				content_type = 'image/x-icon'
-				assert isinstance( content, bytes )
-			elif self.reLapCounterHtml.match( up.path ):
-				content = getLapCounterHtml()
-				content_type = self.html_content
-				assert isinstance( content, bytes )
-			elif up.path=='/Announcer.html':
-				content = getAnnouncerHtml()
-				content_type = self.html_content
-				assert isinstance( content, bytes )
-			elif up.path=='/qrcode.html':
-				urlPage = GetCrossMgrHomePage()
-				content = getQRCodePage( urlPage )
-				content_type = self.html_content
-				assert isinstance( content, bytes )
-			elif up.path=='/servertimestamp.html':
-				content = Utils.ToJson( {
-						'servertime':time.time()*1000.0,
-						'requesttimestamp':float(up.query),
-					}
-				).encode()
-				content_type = self.json_content;
-				assert isinstance( content, bytes )
-			else:
-				file = None
-				
-				if up.path == '/CurrentResults.html':
-					try:
-						file = os.path.splitext(Model.race.getFileName())[0] + '.html'
-					except:
-						pass
-				
-				elif up.path == '/PreviousResults.html':
-					file = GetPreviousFileName()
-				
-				if file is None: 
-					file = url2pathname(os.path.basename(up.path))
-				content, gzip_content = contentBuffer.getContent( file )
-				content_type = self.html_content
-				assert isinstance( content, bytes )
-		except Exception as e:
-			self.send_error(404,'File Not Found: {} {}\n{}'.format(self.path, e, traceback.format_exc()))
-			return
-		
-		self.send_response( 200 )
-		self.send_header('Content-Type',content_type)
-		if content_type == self.html_content:
-			if gzip_content and 'Accept-Encoding' in self.headers and 'gzip' in self.headers['Accept-Encoding']:
-				content = gzip_content
-				self.send_header( 'Content-Encoding', 'gzip' )
-			self.send_header( 'Cache-Control', 'no-cache, no-store, must-revalidate' )
-			self.send_header( 'Pragma', 'no-cache' )
-			self.send_header( 'Expires', '0' )
-		self.send_header( 'Content-Length', len(content) )
+		status, headers, content = GetResponse( self.path, {k.lower(): v for k, v in self.headers.items()} )
+		self.send_response( status )
+		for k, v in headers:
+			self.send_header( k, v )
 		self.end_headers()
-		self.wfile.write( content )
+		if content:
+			self.wfile.write( content )
 	
 	def log_message(self, format, *args):
 		return
@@ -503,22 +625,75 @@ def queueListener( q ):
 	if server:
 		server.shutdown()
 		server = None
+	if asyncServer:
+		asyncServer.stop()
 
 q = Queue()
 qThread = threading.Thread( target=queueListener, name='queueListener', args=(q,) )
 qThread.daemon = True
 qThread.start()
 
-webThread = threading.Thread( target=WebServer, name='WebServer' )
-webThread.daemon = True
-webThread.start()
+if not asyncMode:
+	webThread = threading.Thread( target=WebServer, name='WebServer' )
+	webThread.daemon = True
+	webThread.start()
 
 from websocket_server import WebsocketServer
 #-------------------------------------------------------------------
 
+class FeedStats( object ):
+	''' Size and encode time of the messages sent on the results feed. '''
+	def __init__( self ):
+		self.reset()
+
+	def reset( self ):
+		self.updates = 0
+		self.bytes = 0
+		self.bytesMax = 0
+		self.encodeSeconds = 0.0
+		self.baselines = 0
+		self.resumes = 0
+		self.resumeUpdates = 0
+
+	def encode( self, message ):
+		t = time.perf_counter()
+		data = Utils.ToJson( message ).encode()
+		self.encodeSeconds += time.perf_counter() - t
+		self.updates += 1
+		self.bytes += len(data)
+		self.bytesMax = max( self.bytesMax, len(data) )
+		return data
+
+	def getStats( self ):
+		return {
+			'updates': self.updates,
+			'bytesAvg': float(self.bytes) / self.updates if self.updates else None,
+			'bytesMax': self.bytesMax,
+			'encodeSecondsAvg': self.encodeSeconds / self.updates if self.updates else None,
+			'baselines': self.baselines,
+			'resumes': self.resumes,
+			'resumeUpdates': self.resumeUpdates,
+		}
+
+feedStats = FeedStats()
+
 def message_received(client, server, message):
 	msg = json.loads( message )
-	if msg['cmd'] == 'send_baseline' and (msg['raceName'] == 'CurrentResults' or msg['raceName'] == GetRaceName()):
+	if not (msg.get('raceName') == 'CurrentResults' or msg.get('raceName') == GetRaceName()):
+		return
+	cmd = msg.get('cmd')
+	if cmd == 'send_since':
+		# A client that reconnects gets the updates after its version, if we still have them.
+		rams = GetResultsSince( msg.get('versionCount', 0) )
+		if rams is not None:
+			feedStats.resumes += 1
+			feedStats.resumeUpdates += len(rams)
+			for ram in rams:
+				server.send_message( client, Utils.ToJson(ram) )
+			return
+		cmd = 'send_baseline'
+	if cmd == 'send_baseline':
+		feedStats.baselines += 1
 		server.send_message( client, json.dumps(GetResultsBaseline()) )
 
 wsServer = None
@@ -542,7 +717,7 @@ def WsQueueListener( q ):
 		if message.get('cmd', None) == 'exit':
 			keepGoing = False
 		elif wsServer and wsServer.hasClients():
-			wsServer.send_message_to_all( Utils.ToJson(message).encode() )
+			wsServer.send_message_to_all( feedStats.encode(message) )
 		q.task_done()
 	
 	wsServer = None	
@@ -552,48 +727,109 @@ wsQThread = threading.Thread( target=WsQueueListener, name='WsQueueListener', ar
 wsQThread.daemon = True
 wsQThread.start()
 
-wsThread = threading.Thread( target=WsServerLaunch, name='WsServer' )
-wsThread.daemon = True
-wsThread.start()
+if not asyncMode:
+	wsThread = threading.Thread( target=WsServerLaunch, name='WsServer' )
+	wsThread.daemon = True
+	wsThread.start()
+
+class LatencyStats( object ):
+	''' Seconds from a change to the message sent to the displays, over the recent changes. '''
+	windowMax = 1000
+
+	def __init__( self ):
+		self.reset()
+
+	def reset( self ):
+		self.count = 0
+		self.window = deque( maxlen=self.windowMax )
+
+	def add( self, seconds ):
+		self.count += 1
+		self.window.append( seconds )
 
-wsTimer = tTimerStart = None
-def WsPost():
-	global wsServer, wsTimer, tTimerStart
-	if wsServer and wsServer.hasClients():
-		while 1:
+	def getStats( self ):
+		w = sorted( self.window )
+		if not w:
+			return {'count': self.count, 'last': None, 'avg': None, 'p50': None, 'p95': None, 'max': None}
+		return {
+			'count': self.count,
+			'last': self.window[-1],
+			'avg': sum(w) / len(w),
+			'p50': w[len(w) // 2],
+			'p95': w[min(len(w) - 1, int(len(w) * 0.95))],
+			'max': w[-1],
+		}
+
+class ResultsPublisher( object ):
+	'''
+		Computes the results update once per change to the race and queues it for all the results clients.
+		
+		Runs in its own thread, woken by Model.raceChanges, so updates do not wait for the main window to refresh.
+		Changes that arrive while an update is computed are sent together in the next one.
+		If computing an update fails, it is tried again.
+		Updates are at least minInterval apart, and further apart if they take a long time to compute,
+		so a large race does not take too much time from the user interface.
+	'''
+	minInterval = 0.05		# Seconds between updates.
+	computeFactor = 2.0		# Wait this many times the last compute time before the next update.
+	errorRetrySeconds = 1.0	# Wait before trying again after an unexpected error.
+
+	def __init__( self, q ):
+		self.q = q
+		self.event = threading.Event()
+		self.tChange = None		# Time of the first change not yet sent.
+		self.tNext = 0.0
+		self.latency = LatencyStats()
+		self.thread = threading.Thread( target=self.run, name='ResultsPublisher' )
+		self.thread.daemon = True
+		Model.raceChanges.listeners.append( self.notify )
+		self.thread.start()
+
+	def notify( self, tChange = None ):
+		if self.tChange is None:
+			self.tChange = tChange or time.time()
+		self.event.set()
+
+	def run( self ):
+		while True:
+			self.event.wait()
+			tWait = self.tNext - time.time()
+			if tWait > 0.0:
+				time.sleep( tWait )
+			self.event.clear()
+			tChange, self.tChange = self.tChange, None
+			if not (wsServer and wsServer.hasClients()):
+				continue
+
+			tStart = time.time()
+			failed, tRetry = False, 0.0
 			try:
 				ram = GetResultsRAM()
-				break
 			except AttributeError:
-				time.sleep( 0.25 )
-		if ram:
-			wsQ.put( ram )
-	if wsTimer:
-		wsTimer.cancel()
-	wsTimer = tTimerStart = None
+				# The race changed while we read it.
+				ram, failed = None, True
+			except Exception as e:
+				ram, failed = None, True
+				tRetry = self.errorRetrySeconds
+				Utils.logException( e, sys.exc_info() )
+			tEnd = time.time()
+			self.tNext = tEnd + max( self.minInterval, self.computeFactor * (tEnd - tStart), tRetry )
+			if failed:
+				# Try again, so the change is not lost.
+				self.notify( tChange )
+				continue
+			if ram:
+				self.q.put( ram )
+				if tChange is not None:
+					self.latency.add( tEnd - tChange )
+
+resultsPublisher = ResultsPublisher( wsQ )
 
 def WsRefresh( updatePrevious=False ):
-	global wsTimer, tTimerStart
-	
 	if updatePrevious:
 		wsQ.put( {'cmd':'reload_previous'} )
-		return
-	
-	# If we have a string of competitors, don't send the update
-	# until there is a gap of a second or more between arrivals.
-	if not tTimerStart:
-		tTimerStart = now()
 	else:
-		# Check if it has been 5 seconds since the last update.
-		# If so, let the currently scheduled update fire.
-		if (now() - tTimerStart).total_seconds() > 5.0:
-			return
-		wsTimer.cancel()
-
-	# Schedule an update to be sent in the next second.
-	# This either schedules the first update, or extends a pending update.
-	wsTimer = threading.Timer( 1.0, WsPost )
-	wsTimer.start()
+		resultsPublisher.notify()
 			
 #-------------------------------------------------------------------
 def GetLapCounterRefresh():
@@ -610,7 +846,11 @@ def GetLapCounterRefresh():
 		}
 
 def lap_counter_new_client(client, server):
-	server.send_message( client, json.dumps(GetLapCounterRefresh()) )
+	# Send the last state sent to the other displays, so we don't read the lap counter window outside the main thread.
+	message = lastMessage if lastMessage is not None and lastRaceName == GetRaceName() else GetLapCounterRefresh()
+	server.send_message( client, json.dumps(message) )
+
+lapCounterLatency = LatencyStats()
 
 wsLapCounterServer = None
 def WsLapCounterServerLaunch():
@@ -632,11 +872,14 @@ def WsLapCounterQueueListener( q ):
 		message = q.get()
 		cmd = message.get('cmd', None)
 		if cmd == 'refresh':
+			tQueued = message.pop( 'tQueued', None )
 			if wsLapCounterServer and wsLapCounterServer.hasClients():
 				race = Model.race
 				message['tNow'] = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
 				message['curRaceTime'] = race.curRaceTime() if race and race.startTime else 0.0
 				wsLapCounterServer.send_message_to_all( Utils.ToJson(message).encode() )
+				if tQueued is not None:
+					lapCounterLatency.add( time.time() - tQueued )
 		elif cmd == 'exit':
 			keepGoing = False
 		q.task_done()
@@ -648,9 +891,17 @@ wsLapCounterQThread = threading.Thread( target=WsLapCounterQueueListener, name='
 wsLapCounterQThread.daemon = True
 wsLapCounterQThread.start()
 
-wsLapCounterThread = threading.Thread( target=WsLapCounterServerLaunch, name='WsLapCounterServer' )
-wsLapCounterThread.daemon = True
-wsLapCounterThread.start()
+if not asyncMode:
+	wsLapCounterThread = threading.Thread( target=WsLapCounterServerLaunch, name='WsLapCounterServer' )
+	wsLapCounterThread.daemon = True
+	wsLapCounterThread.start()
+else:
+	asyncServer = AsyncWebServer( GetResponse, PORT_NUMBER )
+	wsServer = asyncServer.addChannel( 'Results', PORT_NUMBER + 1 )
+	wsServer.set_fn_message_received( message_received )
+	wsLapCounterServer = asyncServer.addChannel( 'LapCounter', PORT_NUMBER + 2 )
+	wsLapCounterServer.set_fn_new_client( lap_counter_new_client )
+	asyncServer.start()
 
 lastRaceName, lastMessage = None, None
 def WsLapCounterRefresh():
@@ -662,7 +913,7 @@ def WsLapCounterRefresh():
 		return
 	message, raceName = GetLapCounterRefresh(), GetRaceName()
 	if lastMessage != message or lastRaceName != raceName:
-		wsLapCounterQ.put( message )
+		wsLapCounterQ.put( dict(message, tQueued=time.time()) )
 		lastMessage, lastRaceName = message, raceName
 			
 if __name__ == '__main__':
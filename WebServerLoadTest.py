@@ -0,0 +1,148 @@
+import sys
+import time
+import json
+import base64
+import asyncio
+import argparse
+from AsyncWebServer import readFrame, OPCODE_CLOSE
+
+#------------------------------------------------------------------------------
+# Simulate spectators against a running CrossMgr web server.
+#
+# Each http client fetches a page over one keep-alive connection, revalidating with the ETag.
+# Each WebSocket client opens the results feed, asks for the baseline and counts the updates.
+# Slow clients read one frame every few seconds to check that the server drops them and
+# the other clients are not held back.
+#
+#	python WebServerLoadTest.py --http 200 --ws 2000 --seconds 30
+
+class Stats( object ):
+	def __init__( self ):
+		self.latencies = []
+		self.errors = 0
+		self.notModified = 0
+		self.bytes = 0
+		self.wsConnected = 0
+		self.wsMessages = 0
+		self.wsBytes = 0
+		self.wsClosed = 0
+
+def percentile( values, p ):
+	if not values:
+		return None
+	values = sorted( values )
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+async def readResponse( reader ):
+	status = int( (await reader.readline()).split()[1] )
+	headers = {}
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b''):
+			break
+		k, sep, v = line.decode('latin-1').partition( ':' )
+		headers[k.strip().lower()] = v.strip()
+	content = await reader.readexactly( int(headers.get('content-length', 0)) )
+	return status, headers, content
+
+async def httpClient( host, port, path, tEnd, stats ):
+	try:
+		reader, writer = await asyncio.open_connection( host, port )
+	except OSError:
+		stats.errors += 1
+		return
+	etag = None
+	try:
+		while time.time() < tEnd:
+			request = 'GET {} HTTP/1.1\r\nHost: {}\r\nAccept-Encoding: gzip\r\n'.format( path, host )
+			if etag:
+				request += 'If-None-Match: {}\r\n'.format( etag )
+			t = time.perf_counter()
+			writer.write( (request + '\r\n').encode() )
+			status, headers, content = await readResponse( reader )
+			stats.latencies.append( time.perf_counter() - t )
+			stats.bytes += len(content)
+			if status == 304:
+				stats.notModified += 1
+			elif status != 200:
+				stats.errors += 1
+			etag = headers.get( 'etag', etag )
+	except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+		stats.errors += 1
+	finally:
+		writer.close()
+
+async def wsClient( host, port, tEnd, stats, slow=False ):
+	try:
+		reader, writer = await asyncio.open_connection( host, port )
+	except OSError:
+		stats.errors += 1
+		return
+	key = base64.b64encode( b'CrossMgrLoadTest' ).decode()
+	writer.write( (
+		'GET / HTTP/1.1\r\nHost: {}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+		'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n').format(host, key).encode()
+	)
+	try:
+		if b' 101 ' not in await reader.readline():
+			stats.errors += 1
+			return
+		while (await reader.readline()) not in (b'\r\n', b''):
+			pass
+		stats.wsConnected += 1
+		message = json.dumps( {'cmd':'send_baseline', 'raceName':'CurrentResults'} ).encode()
+		mask = b'\x00\x00\x00\x00'		# A zero mask leaves the payload unchanged.
+		writer.write( bytes([0x81, 0x80 | len(message)]) + mask + message )
+		while True:
+			remaining = tEnd - time.time()
+			if remaining <= 0:
+				break
+			fin, opcode, payload = await asyncio.wait_for( readFrame(reader), remaining )
+			if opcode == OPCODE_CLOSE:
+				break
+			stats.wsMessages += 1
+			stats.wsBytes += len(payload)
+			if slow:
+				await asyncio.sleep( 5.0 )
+	except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+		pass
+	finally:
+		stats.wsClosed += 1
+		writer.close()
+
+async def loadTest( args ):
+	stats = Stats()
+	tEnd = time.time() + args.seconds
+	clients = [httpClient(args.host, args.port, args.path, tEnd, stats) for i in range(args.http)]
+	clients.extend( wsClient(args.host, args.port + 1, tEnd, stats) for i in range(args.ws) )
+	clients.extend( wsClient(args.host, args.port + 1, tEnd, stats, True) for i in range(args.slow) )
+	t = time.perf_counter()
+	await asyncio.gather( *clients )
+	return stats, time.perf_counter() - t
+
+def main():
+	parser = argparse.ArgumentParser( description='Load test the CrossMgr web server with simulated spectators.' )
+	parser.add_argument( '--host', default='127.0.0.1' )
+	parser.add_argument( '--port', type=int, default=8765 )
+	parser.add_argument( '--path', default='/CurrentResults.html' )
+	parser.add_argument( '--http', type=int, default=100, help='http clients' )
+	parser.add_argument( '--ws', type=int, default=500, help='WebSocket clients' )
+	parser.add_argument( '--slow', type=int, default=0, help='WebSocket clients that read slowly' )
+	parser.add_argument( '--seconds', type=float, default=20.0 )
+	args = parser.parse_args()
+
+	stats, seconds = asyncio.get_event_loop().run_until_complete( loadTest(args) )
+	latencies = stats.latencies
+	print( 'seconds           {:.1f}'.format(seconds) )
+	print( 'requests          {} ({:.0f}/s, {} not modified)'.format(len(latencies), len(latencies) / seconds, stats.notModified) )
+	for p in (0.5, 0.9, 0.99):
+		v = percentile( latencies, p )
+		print( 'latency p{:<8}{}'.format(int(p * 100), '{:.1f} ms'.format(v * 1000.0) if v is not None else '-') )
+	print( 'http bytes        {}'.format(stats.bytes) )
+	print( 'ws connected      {}'.format(stats.wsConnected) )
+	print( 'ws messages       {} ({} bytes)'.format(stats.wsMessages, stats.wsBytes) )
+	print( 'errors            {}'.format(stats.errors) )
+	return 0 if not stats.errors else 1
+
+if __name__ == '__main__':
+	sys.exit( main() )